@@ -0,0 +1,210 @@
+"""ASGI entry point for the Flask apps.
+
+    CACHE_BACKEND=redis python serve.py --server asgi --workers 2
+    uvicorn asgi:application
+
+Request handlers still run as WSGI on a thread pool, so every route works
+unchanged. The event loop sends the response bodies: a listener on a slow
+connection costs a socket and a chunk of buffer, not a thread. Audio from
+streaming.send_audio() and send_slice() is read with pread (seek and read
+where there is none) on a separate I/O pool, one chunk ahead of what the
+client has accepted.
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from streaming import CHUNK_SIZE, FileBody, read_at
+
+WSGI_APP = os.getenv('WSGI_APP', 'app')
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 16))
+ASGI_IO_THREADS = int(os.getenv('ASGI_IO_THREADS', 8))
+# Request bodies larger than this are spooled to a temp file
+BODY_SPOOL_SIZE = 1024 * 1024
+# Response chunks are gathered into sends of about this size
+BATCH_SIZE = 64 * 1024
+
+
+def _file_wrapper(file, block_size=CHUNK_SIZE):
+    # werkzeug's wrap_file() hands whole-file responses to this
+    start = file.tell()
+    return FileBody(file, [(start, os.fstat(file.fileno()).st_size)])
+
+
+def _next_batch(chunks, size=BATCH_SIZE):
+    """The next chunks joined up to about size bytes, and whether that was all."""
+    batch = []
+    length = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            return b''.join(batch), False
+    return b''.join(batch), True
+
+
+def _environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        # The whole body has been read, so it can be consumed without a Content-Length
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': _file_wrapper,
+    }
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            key = 'CONTENT_TYPE'
+        elif name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """ASGI application that serves a WSGI app. threads bounds how many
+    handlers run at once; io_threads bounds concurrent audio reads."""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, io_threads=ASGI_IO_THREADS):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi')
+        self.io_executor = ThreadPoolExecutor(io_threads, thread_name_prefix='asgi-io')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.io_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(BODY_SPOOL_SIZE)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                body.seek(0)
+                return body
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        async def start():
+            response['sent'] = True
+            await send({'type': 'http.response.start', 'status': response['status'],
+                        'headers': response['headers']})
+
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        result = None
+        try:
+            result = await loop.run_in_executor(self.executor, self.wsgi_app, _environ(scope, body), start_response)
+            if isinstance(result, FileBody):
+                await start()
+                await self._send_file(result, send, disconnected)
+                return
+
+            # Generators may call start_response late and may touch the database: iterate on the pool,
+            # one round trip per batch rather than per chunk
+            chunks = iter(result)
+            data, done = await loop.run_in_executor(self.executor, _next_batch, chunks)
+            await start()
+            while not done and not disconnected.done():
+                if data:
+                    await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                data, done = await loop.run_in_executor(self.executor, _next_batch, chunks)
+            await send({'type': 'http.response.body', 'body': data if done else b''})
+        finally:
+            disconnected.cancel()
+            body.close()
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+
+    async def _wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def _send_file(self, body, send, disconnected):
+        loop = asyncio.get_running_loop()
+
+        def read(offset, stop):
+            return loop.run_in_executor(self.io_executor, read_at, body.file,
+                                        min(CHUNK_SIZE, stop - offset), offset)
+
+        for piece in body.pieces():
+            if isinstance(piece, bytes):
+                await send({'type': 'http.response.body', 'body': piece, 'more_body': True})
+                continue
+            offset, stop = piece
+            pending = read(offset, stop) if offset < stop else None
+            while pending is not None:
+                data = await pending
+                if not data:
+                    break
+                offset += len(data)
+                # Read the next chunk while this one waits for the client to take it
+                pending = read(offset, stop) if offset < stop else None
+                if disconnected.done():
+                    if pending is not None:
+                        await pending
+                    return
+                # send() waits while the connection's write buffer is full
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+                body.sent += len(data)
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def create_application(module=WSGI_APP):
+    """WsgiBridge around the `app` of the named module (app, simple_app)."""
+    return WsgiBridge(importlib.import_module(module).app)
+
+
+def __getattr__(name):
+    # `uvicorn asgi:application` imports the Flask app only when asked for it
+    if name == 'application':
+        global application
+        application = create_application()
+        return application
+    raise AttributeError(name)
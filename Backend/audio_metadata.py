@@ -0,0 +1,341 @@
+import os
+import struct
+from collections import namedtuple
+
+# Only container headers are read: never the whole audio payload
+HEADER_READ = 256 * 1024
+
+MP3Frame = namedtuple('MP3Frame', 'version layer bitrate sample_rate samples length channels')
+
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+def parse_mp3_frame_header(header):
+    """Decode a 4-byte MPEG audio frame header, or return None."""
+    if len(header) < 4:
+        return None
+    h = int.from_bytes(header[:4], 'big')
+    if (h >> 21) & 0x7FF != 0x7FF:
+        return None
+    version = {0: 2.5, 2: 2, 3: 1}.get((h >> 19) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((h >> 17) & 3)
+    bitrate_index = (h >> 12) & 0xF
+    rate_index = (h >> 10) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index]
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (h >> 9) & 1
+    channels = 1 if (h >> 6) & 3 == 3 else 2
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return MP3Frame(version, layer, bitrate, sample_rate, samples, length, channels)
+
+
+def find_mp3_frame(data, start=0):
+    """Offset of the first frame header that is followed by another one."""
+    pos = data.find(b'\xff', start)
+    while 0 <= pos < len(data) - 4:
+        frame = parse_mp3_frame_header(data[pos:pos + 4])
+        if frame:
+            following = data[pos + frame.length:pos + frame.length + 4]
+            if len(following) < 4 or parse_mp3_frame_header(following):
+                return pos, frame
+        pos = data.find(b'\xff', pos + 1)
+    return None, None
+
+
+def vbr_header(data, pos, frame):
+    """(tag, frame count) of a Xing/Info/VBRI header stored in the frame
+    at pos, or (None, None). Such a frame carries no audio."""
+    side_info = (17 if frame.channels == 1 else 32) if frame.version == 1 else (9 if frame.channels == 1 else 17)
+    xing = pos + 4 + side_info
+    tag = bytes(data[xing:xing + 4])
+    if tag in (b'Xing', b'Info'):
+        flags = int.from_bytes(data[xing + 4:xing + 8], 'big')
+        return tag, int.from_bytes(data[xing + 8:xing + 12], 'big') if flags & 1 else None
+    if data[pos + 36:pos + 40] == b'VBRI':
+        return b'VBRI', int.from_bytes(data[pos + 50:pos + 54], 'big')
+    return None, None
+
+
+def id3v2_size(data):
+    """Bytes taken by a leading ID3v2 tag (0 when there is none)."""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = _syncsafe(data[6:10]) + 10
+    if data[5] & 0x10:
+        size += 10  # footer
+    return size
+
+
+def _syncsafe(raw):
+    return (raw[0] << 21) | (raw[1] << 14) | (raw[2] << 7) | raw[3]
+
+
+def _id3_text(payload):
+    if not payload:
+        return None
+    encoding = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}.get(payload[0], 'latin-1')
+    text = payload[1:].decode(encoding, errors='replace')
+    return text.split('\x00')[0].strip() or None
+
+
+def parse_id3v2(data):
+    tags = {}
+    end = min(id3v2_size(data), len(data))
+    if not end:
+        return tags
+    major = data[3]
+    pos = 10
+    if data[5] & 0x40 and major >= 3:
+        ext = data[10:14]
+        pos += _syncsafe(ext) if major == 4 else int.from_bytes(ext, 'big') + 4
+
+    names = {'TIT2': 'title', 'TPE1': 'artist', 'TLEN': 'length', 'TT2': 'title', 'TP1': 'artist', 'TLE': 'length'}
+    header_size = 6 if major == 2 else 10
+    while pos + header_size <= end:
+        if major == 2:
+            frame_id = data[pos:pos + 3].decode('latin-1')
+            size = int.from_bytes(data[pos + 3:pos + 6], 'big')
+        else:
+            frame_id = data[pos:pos + 4].decode('latin-1')
+            raw = data[pos + 4:pos + 8]
+            size = _syncsafe(raw) if major == 4 else int.from_bytes(raw, 'big')
+        if not frame_id.strip('\x00') or size <= 0:
+            break
+        if frame_id in names:
+            tags[names[frame_id]] = _id3_text(data[pos + header_size:pos + header_size + size])
+        pos += header_size + size
+    return tags
+
+
+def parse_mp3(f, file_size):
+    data = f.read(HEADER_READ)
+    meta = {'format': 'mp3'}
+    tags = parse_id3v2(data)
+    meta.update({k: v for k, v in tags.items() if k in ('title', 'artist') and v})
+
+    tail_tag = 0
+    if file_size >= 128:
+        f.seek(file_size - 128)
+        tail = f.read(128)
+        if tail[:3] == b'TAG':
+            tail_tag = 128
+            meta.setdefault('title', tail[3:33].split(b'\x00')[0].decode('latin-1').strip() or None)
+            meta.setdefault('artist', tail[33:63].split(b'\x00')[0].decode('latin-1').strip() or None)
+
+    # The tag may be longer than what was read: look for the first frame after it
+    start = id3v2_size(data)
+    f.seek(start)
+    audio = f.read(HEADER_READ)
+    pos, frame = find_mp3_frame(audio)
+    if frame is None:
+        return meta
+    meta['sample_rate'] = frame.sample_rate
+    meta['channels'] = frame.channels
+
+    # A Xing/Info or VBRI header in the first frame gives the exact frame count
+    tag, frames = vbr_header(audio, pos, frame)
+    pos += start
+
+    audio_bytes = file_size - pos - tail_tag
+    if frames:
+        duration = frames * frame.samples / frame.sample_rate
+        meta['bitrate'] = round(audio_bytes * 8 / duration / 1000) if duration else frame.bitrate
+    else:
+        duration = audio_bytes * 8 / (frame.bitrate * 1000)
+        meta['bitrate'] = frame.bitrate
+    meta['duration'] = round(duration)
+    if not meta.get('duration') and (tags.get('length') or '').isdigit():
+        meta['duration'] = round(int(tags['length']) / 1000)
+    return meta
+
+
+def parse_wav(f, file_size):
+    meta = {'format': 'wav'}
+    f.seek(12)
+    byte_rate = data_size = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, size = header[:4], struct.unpack('<I', header[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(size)
+            channels, sample_rate, byte_rate = struct.unpack('<HII', fmt[2:12])
+            meta.update(channels=channels, sample_rate=sample_rate, bitrate=round(byte_rate * 8 / 1000))
+        elif chunk_id == b'data':
+            data_size = min(size, file_size - f.tell())
+            f.seek(size, 1)
+        elif chunk_id == b'LIST':
+            body = f.read(size)
+            if body[:4] == b'INFO':
+                _parse_riff_info(body[4:], meta)
+        else:
+            f.seek(size, 1)
+        if size % 2:
+            f.seek(1, 1)
+    if byte_rate and data_size is not None:
+        meta['duration'] = round(data_size / byte_rate)
+    return meta
+
+
+def _parse_riff_info(body, meta):
+    pos = 0
+    while pos + 8 <= len(body):
+        sub_id, size = body[pos:pos + 4], struct.unpack('<I', body[pos + 4:pos + 8])[0]
+        value = body[pos + 8:pos + 8 + size].split(b'\x00')[0].decode('utf-8', errors='replace').strip()
+        if sub_id == b'INAM' and value:
+            meta['title'] = value
+        elif sub_id == b'IART' and value:
+            meta['artist'] = value
+        pos += 8 + size + (size % 2)
+
+
+def parse_flac(f, file_size):
+    meta = {'format': 'flac'}
+    start = f.tell()
+    if f.read(4) != b'fLaC':
+        return meta
+    last = False
+    while not last:
+        header = f.read(4)
+        if len(header) < 4:
+            break
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        size = int.from_bytes(header[1:4], 'big')
+        if block_type == 0:
+            info = f.read(size)
+            packed = int.from_bytes(info[10:18], 'big')
+            sample_rate = packed >> 44
+            total_samples = packed & 0xFFFFFFFFF
+            meta['sample_rate'] = sample_rate
+            meta['channels'] = ((packed >> 41) & 7) + 1
+            if sample_rate and total_samples:
+                duration = total_samples / sample_rate
+                meta['duration'] = round(duration)
+                meta['bitrate'] = round((file_size - start) * 8 / duration / 1000)
+        elif block_type == 4:
+            _parse_vorbis_comment(f.read(size), meta)
+        else:
+            f.seek(size, 1)
+    return meta
+
+
+def _parse_vorbis_comment(block, meta):
+    vendor_length = struct.unpack('<I', block[:4])[0]
+    pos = 4 + vendor_length
+    count = struct.unpack('<I', block[pos:pos + 4])[0]
+    pos += 4
+    for _ in range(count):
+        length = struct.unpack('<I', block[pos:pos + 4])[0]
+        comment = block[pos + 4:pos + 4 + length].decode('utf-8', errors='replace')
+        pos += 4 + length
+        key, _, value = comment.partition('=')
+        if key.upper() == 'TITLE' and value:
+            meta.setdefault('title', value)
+        elif key.upper() == 'ARTIST' and value:
+            meta.setdefault('artist', value)
+
+
+def _mp4_atoms(f, end):
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield kind, start + header, start + size
+        f.seek(start + size)
+
+
+def parse_m4a(f, file_size):
+    meta = {'format': 'm4a'}
+    for kind, body, end in _mp4_atoms(f, file_size):
+        if kind == b'moov':
+            _parse_moov(f, body, end, meta)
+            break
+    if meta.get('duration'):
+        meta['bitrate'] = round(file_size * 8 / meta['duration'] / 1000)
+    return meta
+
+
+def _parse_moov(f, body, end, meta):
+    f.seek(body)
+    for kind, child, child_end in _mp4_atoms(f, end):
+        if kind == b'mvhd':
+            f.seek(child)
+            version = f.read(1)[0]
+            f.seek(3 + (16 if version == 1 else 8), 1)
+            timescale = struct.unpack('>I', f.read(4))[0]
+            duration = struct.unpack('>Q' if version == 1 else '>I', f.read(8 if version == 1 else 4))[0]
+            if timescale:
+                meta['duration'] = round(duration / timescale)
+        elif kind == b'udta':
+            _parse_mp4_tags(f, child, child_end, meta)
+        f.seek(child_end)
+
+
+def _parse_mp4_tags(f, body, end, meta):
+    names = {b'\xa9nam': 'title', b'\xa9ART': 'artist'}
+    f.seek(body)
+    for kind, child, child_end in _mp4_atoms(f, end):
+        if kind == b'meta':
+            f.seek(child + 4)  # meta is a full box
+            for ilst, items, items_end in _mp4_atoms(f, child_end):
+                if ilst != b'ilst':
+                    continue
+                f.seek(items)
+                for name, item, item_end in _mp4_atoms(f, items_end):
+                    if name in names:
+                        f.seek(item)
+                        for data_kind, data, data_end in _mp4_atoms(f, item_end):
+                            if data_kind == b'data':
+                                f.seek(data + 8)
+                                meta[names[name]] = f.read(data_end - data - 8).decode('utf-8', errors='replace')
+                                break
+                    f.seek(item_end)
+                f.seek(items_end)
+        f.seek(child_end)
+
+
+def read_metadata(path):
+    """Duration (seconds), bitrate (kbps), sample rate, channels, title and
+    artist read from the container headers of an MP3, WAV, FLAC or M4A file.
+    Fields that cannot be determined are left out."""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(12)
+        f.seek(0)
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            return parse_wav(f, file_size)
+        if head[4:8] == b'ftyp':
+            return parse_m4a(f, file_size)
+        if head[:4] == b'fLaC':
+            return parse_flac(f, file_size)
+        if head[:3] == b'ID3':
+            f.seek(id3v2_size(f.read(10)))
+            if f.read(4) == b'fLaC':
+                f.seek(-4, 1)
+                return parse_flac(f, file_size)
+            f.seek(0)
+        return parse_mp3(f, file_size)
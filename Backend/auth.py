@@ -0,0 +1,129 @@
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import jsonify
+from flask_jwt_extended import JWTManager, get_jwt, get_jwt_identity, verify_jwt_in_request
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+ROLE_CACHE_TTL = float(os.getenv('ROLE_CACHE_TTL', 60))
+ROLE_CACHE_SIZE = 10000
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager that keeps the claims of tokens it has verified until they
+    expire, so a client reusing its token costs one dict lookup instead of a
+    signature check and three JSON decodes per request.
+
+    Call tokens.clear() after rotating JWT_SECRET_KEY.
+    """
+
+    def __init__(self, app=None, max_tokens=TOKEN_CACHE_SIZE):
+        self.tokens = OrderedDict()
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        super().__init__(app)
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        key = (encoded_token, csrf_value)
+        with self.lock:
+            claims = self.tokens.get(key)
+            if claims is not None:
+                self.tokens.move_to_end(key)
+        if claims is not None and (allow_expired or claims.get('exp', float('inf')) > time.time()):
+            return claims
+
+        # Expired or unknown tokens take the normal path and its errors
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        if self.max_tokens:
+            with self.lock:
+                self.tokens[key] = claims
+                while len(self.tokens) > self.max_tokens:
+                    self.tokens.popitem(last=False)
+        return claims
+
+
+class RoleCache:
+    """Whether a user is an admin, loaded with load(user_id) on first use and
+    kept for ttl seconds.
+
+    watch(model) drops a user's entry once a transaction that changed its
+    is_admin or deleted it commits. Other processes pick the change up when
+    their entry expires. Bulk query.update() calls skip the mapper events.
+    """
+
+    def __init__(self, load, ttl=ROLE_CACHE_TTL, max_entries=ROLE_CACHE_SIZE):
+        self.load = load
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def is_admin(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        is_admin = bool(self.load(user_id))
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                now = time.monotonic()
+                self.entries = {k: v for k, v in self.entries.items() if v[1] > now}
+            self.entries[user_id] = (is_admin, time.monotonic() + self.ttl)
+        return is_admin
+
+    def invalidate(self, user_id=None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+    def watch(self, model):
+        def updated(mapper, connection, target):
+            if inspect(target).attrs.is_admin.history.has_changes():
+                changed(mapper, connection, target)
+
+        def changed(mapper, connection, target):
+            object_session(target).info.setdefault('role_changes', set()).add(target.id)
+
+        event.listen(model, 'after_update', updated)
+        event.listen(model, 'after_delete', changed)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('role_changes', ()):
+            self.invalidate(user_id)
+
+    def _after_rollback(self, session):
+        session.info.pop('role_changes', None)
+
+    def admin_required(self):
+        """Like jwt_required(), and also answer 403 unless the user is an
+        admin.
+
+        Tokens without the is_admin claim fall back to the cache. A false
+        claim is rejected without a lookup, so a promoted user has to log in
+        again. A true claim is still checked against the cache, so a demotion
+        applies at once.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                verify_jwt_in_request()
+                if not get_jwt().get('is_admin', True) or not self.is_admin(int(get_jwt_identity())):
+                    return jsonify({'message': 'Admin access required'}), 403
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,8 @@
+"""Benchmarks that need whole processes, run from Backend/:
+
+    python -m benchmarks.listeners    # concurrent listeners per core, wsgi vs asgi
+    python -m benchmarks.startup      # cold start of a worker process
+
+Request-level load (browse, search, stream, playlists, login storms) is
+loadgen.py's.
+"""
@@ -0,0 +1,177 @@
+"""Concurrent listener capacity per core.
+
+Starts serve.py in each mode against a scratch database, then holds N
+listeners on /stream, each reading at a player's pace, while timing a JSON
+request alongside them. A level passes when every listener gets audio at
+its bitrate and the JSON p99 stays under PROBE_LIMIT.
+
+    python -m benchmarks.listeners
+    BENCH_LEVELS=16,64,256,512 BENCH_THREADS=16 python -m benchmarks.listeners
+    CACHE_BACKEND=redis BENCH_WORKERS=4 python -m benchmarks.listeners
+"""
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEVELS = [int(n) for n in os.getenv('BENCH_LEVELS', '4,16,64,256').split(',')]
+WORKERS = int(os.getenv('BENCH_WORKERS', 1))
+THREADS = int(os.getenv('BENCH_THREADS', 8))
+BITRATE = 320 * 1000 // 8           # bytes per second a listener consumes
+PLAYER_BUFFER = 2.0                 # seconds a player reads ahead
+TRACK_SIZE = 30 * 1024 * 1024       # longer than any run, so no listener finishes
+WARMUP = 3.0
+WINDOW = 5.0
+PROBES = 20
+PROBE_LIMIT = 1.0
+HOST = '127.0.0.1'
+
+
+def seed(folder):
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(folder, "bench.db")}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(folder, 'uploads')
+    from app import app, db, Track
+    from migrations import upgrade
+
+    path = os.path.join(folder, 'uploads', 'long.mp3')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(TRACK_SIZE))
+    with app.app_context():
+        upgrade(db.engine, db.metadata, echo=lambda message: None)
+        track = Track(title='Long', artist='Bench', file_path=path)
+        db.session.add(track)
+        db.session.commit()
+        return track.id
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port):
+    server = subprocess.Popen(
+        [sys.executable, 'serve.py', '--server', mode, '--port', str(port), '--workers', str(WORKERS),
+         '--threads', str(THREADS), '--log-level', 'error'],
+        cwd=BACKEND_DIR, env=os.environ,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+async def connect(port):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    # A small receive buffer keeps the kernel from absorbing the stream on the client's behalf
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 32 * 1024)
+    sock.setblocking(False)
+    await loop.sock_connect(sock, (HOST, port))
+    return await asyncio.open_connection(sock=sock)
+
+
+class Listener:
+    def __init__(self):
+        self.first_byte = None
+        self.window_bytes = 0
+        self.counting = False
+
+    async def run(self, port, path, stop):
+        loop = asyncio.get_running_loop()
+        reader, writer = await connect(port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n'.encode())
+        received = 0
+        try:
+            while not stop.is_set():
+                data = await reader.read(16 * 1024)
+                if not data:
+                    break
+                if self.first_byte is None:
+                    self.first_byte = loop.time()
+                received += len(data)
+                if self.counting:
+                    self.window_bytes += len(data)
+                ahead = received / BITRATE - (loop.time() - self.first_byte)
+                if ahead > PLAYER_BUFFER:
+                    await asyncio.sleep(ahead - PLAYER_BUFFER)
+        finally:
+            writer.close()
+
+
+async def probe(port):
+    start = time.perf_counter()
+    reader, writer = await connect(port)
+    writer.write(f'GET /tracks?limit=5 HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n'.encode())
+    await reader.read()
+    writer.close()
+    return time.perf_counter() - start
+
+
+async def run_level(port, track_id, listeners):
+    stop = asyncio.Event()
+    crowd = [Listener() for _ in range(listeners)]
+    tasks = [asyncio.create_task(listener.run(port, f'/stream/track/{track_id}', stop)) for listener in crowd]
+    await asyncio.sleep(WARMUP)
+    for listener in crowd:
+        listener.counting = True
+    window_start = time.perf_counter()
+
+    latencies = []
+    for _ in range(PROBES):
+        try:
+            latencies.append(await asyncio.wait_for(probe(port), PROBE_LIMIT * 5))
+        except asyncio.TimeoutError:
+            latencies.append(PROBE_LIMIT * 5)
+        await asyncio.sleep(WINDOW / PROBES)
+    elapsed = time.perf_counter() - window_start
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    served = sum(1 for listener in crowd if listener.window_bytes >= BITRATE * elapsed * 0.9)
+    return served, latencies
+
+
+def run_benchmark():
+    with tempfile.TemporaryDirectory() as folder:
+        track_id = seed(folder)
+        cores = min(WORKERS, os.cpu_count() or 1)
+        print(f"Listeners at {BITRATE * 8 // 1000} kbps, {WORKERS} worker(s) x {THREADS} threads "
+              f"on {os.cpu_count()} core(s); JSON probe limit p99 < {PROBE_LIMIT * 1000:.0f}ms\n")
+        for mode in ('wsgi', 'asgi'):
+            port = free_port()
+            server = start_server(mode, port)
+            capacity = 0
+            try:
+                for level in LEVELS:
+                    served, latencies = asyncio.run(run_level(port, track_id, level))
+                    p99 = statistics.quantiles(latencies, n=100)[98]
+                    ok = served == level and p99 < PROBE_LIMIT
+                    capacity = level if ok else capacity
+                    print(f"{mode} {level:5} listeners  served at bitrate={served:5}  "
+                          f"json p50={statistics.median(latencies) * 1000:7.1f}ms p99={p99 * 1000:7.1f}ms"
+                          f"  {'ok' if ok else 'FAIL'}")
+                    if not ok:
+                        break
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{mode} capacity: {capacity} listeners, {capacity // cores} per core\n")
+
+
+if __name__ == '__main__':
+    run_benchmark()
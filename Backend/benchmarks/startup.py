@@ -0,0 +1,72 @@
+"""Cold start of a worker process: python starting, importing app, building
+it with create_app() and answering its first requests. Each run is a fresh
+interpreter, as a newly scaled-out worker would be.
+
+    python -m benchmarks.startup [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1] != '--child' else 7
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ['interpreter', 'import models', 'import app', 'create_app()', 'first request', 'second request']
+# Modules a worker should not pay for until it needs them
+DEFERRED = ['dotenv', 'sqlalchemy.dialects.postgresql']
+
+
+def child():
+    timings = {'interpreter': (time.time() - float(os.environ['BENCH_STARTED'])) * 1000}
+
+    def stage(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings[name] = (time.perf_counter() - start) * 1000
+        return result
+
+    stage('import models', lambda: __import__('models'))
+    module = stage('import app', lambda: __import__('app'))
+    loaded = [name for name in DEFERRED if name in sys.modules]
+    app = stage('create_app()', module.create_app)
+    client = app.test_client()
+    for name in ('first request', 'second request'):
+        response = stage(name, lambda: client.get('/tracks?limit=20'))
+        assert response.status_code == 200, response.status_code
+    print(json.dumps({'timings': timings, 'loaded': loaded}))
+
+
+def run_child(env):
+    env = dict(env, BENCH_STARTED=repr(time.time()))
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child'], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def run_benchmark():
+    folder = tempfile.mkdtemp(prefix='bench-startup-')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(folder, "startup.db")}',
+               UPLOAD_FOLDER=os.path.join(folder, 'uploads'), LOG_LEVEL='WARNING')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'seed'], cwd=BACKEND_DIR, env=env,
+                   capture_output=True, check=True)
+
+    runs = [run_child(env) for _ in range(RUNS)]
+    print(f'Cold start, median of {RUNS} fresh processes\n')
+    total = 0
+    for name in STAGES:
+        values = [run['timings'][name] for run in runs]
+        total += statistics.median(values)
+        print(f'  {name:16} {statistics.median(values):8.1f} ms   (min {min(values):6.1f}, max {max(values):6.1f})')
+    print(f'  {"ready to serve":16} {total:8.1f} ms')
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    print(f'\nDeferred modules loaded by import app: {", ".join(loaded) or "none"}')
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        child()
+    else:
+        run_benchmark()
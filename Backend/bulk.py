@@ -0,0 +1,192 @@
+import csv
+import io
+import json
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+EXPORT_COLUMNS = ['type', 'id', 'title', 'artist', 'file_path', 'duration', 'category', 'podcast_name']
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, raw dict) pairs from a binary NDJSON or CSV
+    stream without reading it all first. Unparseable lines yield the error
+    in place of the dict."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        for line_no, row in enumerate(csv.DictReader(text), start=2):
+            yield line_no, row
+        return
+    for line_no, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f'Invalid JSON: {e}')
+            continue
+        yield line_no, row if isinstance(row, dict) else RowError('Expected a JSON object')
+
+
+def _text(row, name, required=True, limit=200):
+    value = row.get(name)
+    value = value.strip() if isinstance(value, str) else value
+    if value in (None, ''):
+        if required:
+            raise RowError(f'Missing {name}')
+        return None
+    value = str(value)
+    if len(value) > limit:
+        raise RowError(f'{name} is longer than {limit} characters')
+    return value
+
+
+def validate_row(row):
+    """Map an import row onto ('track' | 'podcast', column values). Rows use
+    the same fields as POST /admin/tracks: artist doubles as a podcast's host."""
+    is_podcast = str(row.get('type', '')).lower() == 'podcast' or str(row.get('is_podcast', '')).lower() in ('1', 'true')
+    duration = row.get('duration')
+    if duration in (None, ''):
+        duration = 0
+    else:
+        try:
+            duration = int(float(duration))
+        except (TypeError, ValueError):
+            raise RowError('duration must be a number')
+        if duration < 0:
+            raise RowError('duration must not be negative')
+
+    values = {
+        'title': _text(row, 'title'),
+        'file_path': _text(row, 'file_path', limit=500),
+        'duration': duration,
+        'category': _text(row, 'category', required=False, limit=100),
+    }
+    if is_podcast:
+        values['host'] = _text(row, 'host', required=False) or _text(row, 'artist')
+        values['podcast_name'] = _text(row, 'podcast_name', required=False) or ''
+        return 'podcast', values
+    values['artist'] = _text(row, 'artist')
+    return 'track', values
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line_no, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_no, 'error': message})
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'failed': self.failed, 'errors': self.errors}
+
+
+class BulkImporter:
+    """Validates rows and inserts them with one executemany per model and
+    batch, committing each batch on its own. A batch the database rejects is
+    retried row by row so only the offending rows are reported.
+
+    after_insert(session, content_type, rows) receives the inserted column
+    values with their new ids, inside the batch's transaction.
+    """
+
+    def __init__(self, session, models, batch_size=BATCH_SIZE, after_insert=None):
+        self.session = session
+        self.models = models
+        self.batch_size = batch_size
+        self.after_insert = after_insert
+        self.report = ImportReport()
+
+    def run(self, rows):
+        pending = {content_type: [] for content_type in self.models}
+        count = 0
+        for line_no, raw in rows:
+            try:
+                if isinstance(raw, Exception):
+                    raise raw
+                content_type, values = validate_row(raw)
+            except RowError as e:
+                self.report.error(line_no, str(e))
+                continue
+            pending[content_type].append((line_no, values))
+            count += 1
+            if count >= self.batch_size:
+                self._flush(pending)
+                count = 0
+        self._flush(pending)
+        return self.report
+
+    def _flush(self, pending):
+        if not any(pending.values()):
+            return
+        try:
+            for content_type, batch in pending.items():
+                if batch:
+                    self._insert(content_type, [values for line_no, values in batch])
+            self.session.commit()
+            self.report.inserted += sum(len(batch) for batch in pending.values())
+        except SQLAlchemyError:
+            self.session.rollback()
+            for content_type, batch in pending.items():
+                for line_no, values in batch:
+                    self._insert_one(content_type, line_no, values)
+        for batch in pending.values():
+            batch.clear()
+
+    def _insert_one(self, content_type, line_no, values):
+        try:
+            self._insert(content_type, [values])
+            self.session.commit()
+            self.report.inserted += 1
+        except SQLAlchemyError as e:
+            self.session.rollback()
+            self.report.error(line_no, str(e.orig if getattr(e, 'orig', None) else e).splitlines()[0])
+
+    def _insert(self, content_type, mappings):
+        model = self.models[content_type]
+        ids = self.session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True), mappings
+        ).all()
+        if self.after_insert:
+            self.after_insert(self.session, content_type, [dict(values, id=i) for values, i in zip(mappings, ids)])
+
+
+def export_rows(session, models, fmt, content_types=None, batch_size=BATCH_SIZE):
+    """Yield the catalog as NDJSON or CSV text chunks, reading batch_size
+    rows at a time."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    for content_type in content_types or list(models):
+        model = models[content_type]
+        columns = [c for c in model.__table__.columns if c.name != 'created_at']
+        result = session.execute(
+            model.__table__.select().with_only_columns(*columns).order_by(model.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for partition in result.partitions():
+            chunk = io.StringIO()
+            if fmt == 'csv':
+                writer = csv.DictWriter(chunk, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+            for row in partition:
+                item = dict(row._mapping, type=content_type)
+                if 'host' in item:
+                    item['artist'] = item.pop('host')
+                if fmt == 'csv':
+                    writer.writerow(item)
+                else:
+                    chunk.write(json.dumps(item) + '\n')
+            yield chunk.getvalue()
@@ -0,0 +1,139 @@
+"""Tracks and podcasts read as one catalog.
+
+Each content type is an arm: a model and the public fields it has. A
+catalog row has a `type` discriminator followed by the union of all the
+arms' fields, NULL where an arm lacks one. Mixed reads are single queries:
+
+- listing() is a UNION ALL of the arms ordered by (created_at, id, type).
+  Each arm walks its (category,) created_at, id index and the database
+  merges them, stopping at the limit.
+- lookup() fetches (type, id) keys with one primary-key IN per arm.
+- referenced() joins rows that point at content through one nullable
+  foreign key per type (playlist entries, plays) to what they point at.
+
+A database view over the UNION ALL would be simpler to query, but SQLite
+materializes the whole view when it is joined and sorts it for ORDER BY,
+so the arms are composed per query with their predicates inside.
+"""
+from sqlalchemy import and_, case, func, literal, null, or_, select, union_all
+
+from pagination import decode_cursor, encode_cursor
+
+
+def compile_serializer(content_type, fields, positions):
+    """row -> {field: row[position], ..., 'type': content_type}, with the
+    pairs worked out once rather than per row."""
+    pairs = list(zip(fields, positions))
+
+    def serialize(row):
+        item = {field: row[position] for field, position in pairs}
+        item['type'] = content_type
+        return item
+    return serialize
+
+
+class Catalog:
+    def __init__(self, db, arms):
+        """arms maps a content type to (model, {field: column})."""
+        self.db = db
+        self.arms = arms
+        self.fields = list(dict.fromkeys(field for _, columns in arms.values() for field in columns))
+        self._serializers = {}
+
+    def serializer(self, content_type, fields):
+        """Serializer for rows holding just `fields` of one content type,
+        in that order."""
+        key = (content_type, tuple(fields))
+        if key not in self._serializers:
+            self._serializers[key] = compile_serializer(content_type, fields, range(len(fields)))
+        return self._serializers[key]
+
+    def row_serializer(self, fields):
+        """Serializer for catalog rows: type, then `fields`. Each type
+        keeps only the fields it has."""
+        key = tuple(fields)
+        if key not in self._serializers:
+            by_type = {}
+            for content_type, (_, columns) in self.arms.items():
+                own = [(field, position) for position, field in enumerate(fields, 1) if field in columns]
+                by_type[content_type] = compile_serializer(content_type, [field for field, _ in own],
+                                                           [position for _, position in own])
+            self._serializers[key] = lambda row: by_type[row[0]](row)
+        return self._serializers[key]
+
+    def _arm_columns(self, content_type, fields):
+        columns = self.arms[content_type][1]
+        return [literal(content_type).label('type')] + [
+            columns[field].label(field) if field in columns else null().label(field) for field in fields
+        ]
+
+    def listing(self, fields, limit, cursor=None, category=None):
+        """One page of the catalog oldest first, and the cursor for the
+        next page (None on the last)."""
+        after = decode_catalog_cursor(cursor) if cursor else None
+        arms = []
+        for content_type, (model, _) in self.arms.items():
+            stmt = select(*self._arm_columns(content_type, fields),
+                          model.created_at.label('_created_at'), model.id.label('_id'))
+            if category:
+                stmt = stmt.where(model.category == category)
+            if after:
+                created_at, row_id, after_type = after
+                # The type breaks ties between equal (created_at, id), so it is fixed per arm
+                id_after = model.id >= row_id if content_type > after_type else model.id > row_id
+                stmt = stmt.where(or_(model.created_at > created_at, and_(model.created_at == created_at, id_after)))
+            arms.append(stmt)
+        union = union_all(*arms)
+        columns = union.selected_columns
+        union = union.order_by(columns._created_at, columns._id, columns.type).limit(limit + 1)
+        rows = self.db.session.execute(union).all()
+        to_dict = self.row_serializer(fields)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_catalog_cursor(last._created_at, last._id, last.type)
+        return [to_dict(row) for row in rows[:limit]], next_cursor
+
+    def lookup(self, keys, fields):
+        """{(type, id): dict} for the (type, id) keys that exist."""
+        ids = {}
+        for content_type, content_id in keys:
+            ids.setdefault(content_type, set()).add(content_id)
+        arms = [
+            select(*self._arm_columns(content_type, fields), model.id.label('_id')).where(model.id.in_(ids[content_type]))
+            for content_type, (model, _) in self.arms.items() if content_type in ids
+        ]
+        if not arms:
+            return {}
+        to_dict = self.row_serializer(fields)
+        rows = self.db.session.execute(union_all(*arms) if len(arms) > 1 else arms[0])
+        return {(row.type, row._id): to_dict(row) for row in rows}
+
+    def referenced(self, source, references, fields):
+        """SELECT of catalog rows for the rows of source, which point at
+        content through references, {type: foreign key column}. Complete it
+        with source's WHERE and ORDER BY. Rows pointing at nothing are left
+        out."""
+        joined = {content_type: (self.arms[content_type], column) for content_type, column in references.items()}
+        discriminator = case(*[(column.isnot(None), content_type) for content_type, (_, column) in joined.items()])
+        columns = []
+        for field in fields:
+            sources = [arm_columns[field] for (_, arm_columns), _ in joined.values() if field in arm_columns]
+            column = sources[0] if len(sources) == 1 else func.coalesce(*sources) if sources else null()
+            columns.append(column.label(field))
+        joins = source.__table__
+        for (model, _), column in joined.values():
+            joins = joins.outerjoin(model, model.id == column)
+        present = or_(*[model.id.isnot(None) for (model, _), _ in joined.values()])
+        return select(discriminator.label('type'), *columns).select_from(joins).where(present)
+
+
+def encode_catalog_cursor(created_at, row_id, content_type):
+    return f'{encode_cursor(created_at, row_id)}.{content_type}'
+
+
+def decode_catalog_cursor(cursor):
+    position, _, content_type = cursor.rpartition('.')
+    if not position or not content_type:
+        raise ValueError('Invalid cursor')
+    return (*decode_cursor(position), content_type)
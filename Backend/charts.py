@@ -0,0 +1,470 @@
+"""Play counts kept as plays arrive, served as top and trending charts.
+
+PlayCounts holds the last day in hourly buckets and the last month in daily
+ones. Each window (the last day, week or month) keeps running totals and a
+TopK per category. A play updates them in O(1) amortized, so a chart read
+is a slice of a list that is already sorted. When the clock passes a
+bucket boundary, once an hour or a day, the windows it moves are re-summed
+from their remaining buckets.
+
+Trending scores decay with a half-life, stored as plays * 2 ** ((t - L) / h)
+for a fixed landmark time L ("forward decay"). Stored scores only grow and
+keep their order as time passes, so the same TopK serves them. Scaling by
+2 ** -((now - L) / h) turns them back into decayed plays.
+
+Charts keeps one process's PlayCounts current. Plays are also saved as
+hourly increments to a table that every process adds to, and each process
+rebuilds from it every rebuild_seconds to pick up the others' plays.
+"""
+import atexit
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from operator import itemgetter
+
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session, object_session
+
+HOUR = 3600
+CHART_SIZE = int(os.getenv('CHART_SIZE', 100))
+TRENDING_HALF_LIFE = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 6)) * HOUR
+PERSIST_SECONDS = float(os.getenv('CHARTS_PERSIST_SECONDS', 60))
+REBUILD_SECONDS = float(os.getenv('CHARTS_REBUILD_SECONDS', 600))
+
+GRANULARITY = {'hour': HOUR, 'day': 24 * HOUR}
+# Window name -> (bucket granularity, buckets); the current, partial bucket is one of them
+WINDOWS = {'day': ('hour', 24), 'week': ('day', 7), 'month': ('day', 30)}
+KEEP = {granularity: max(size for g, size in WINDOWS.values() if g == granularity) for granularity in GRANULARITY}
+RETENTION_HOURS = KEEP['day'] * 24
+# Trending scores are rescaled this many half-lives after the landmark, dropping those below TREND_FLOOR
+REBASE_HALF_LIVES = 8
+TREND_FLOOR = 0.01
+
+logger = logging.getLogger(__name__)
+
+
+def timestamp(played_at):
+    """Seconds since the epoch of a naive UTC datetime."""
+    return played_at.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TopK:
+    """The k keys with the highest scores offered, for scores that only
+    grow. Keys outside can only enter by passing the lowest score inside."""
+
+    __slots__ = ('k', 'scores', 'floor', 'floor_key', '_ranked')
+
+    def __init__(self, k, scores=()):
+        self.k = k
+        self.scores = dict(heapq.nlargest(k, scores, key=itemgetter(1)))
+        self._changed()
+
+    def offer(self, key, score):
+        scores = self.scores
+        if key in scores:
+            scores[key] = score
+            if key != self.floor_key:
+                self._ranked = None
+                return
+        elif len(scores) < self.k:
+            scores[key] = score
+        elif score > self.floor:
+            del scores[self.floor_key]
+            scores[key] = score
+        else:
+            return
+        self._changed()
+
+    def _changed(self):
+        self._ranked = None
+        if len(self.scores) < self.k:
+            self.floor, self.floor_key = float('-inf'), None
+        else:
+            self.floor_key = min(self.scores, key=self.scores.get)
+            self.floor = self.scores[self.floor_key]
+
+    def ranked(self):
+        if self._ranked is None:
+            self._ranked = sorted(self.scores.items(), key=lambda item: (-item[1], item[0]))
+        return self._ranked
+
+
+class PlayCounts:
+    """Windowed play counts and decayed trending scores for (type, id) keys,
+    each with a TopK for all keys (category None) and one per category."""
+
+    def __init__(self, k=CHART_SIZE, half_life=TRENDING_HALF_LIFE, now=None):
+        now = time.time() if now is None else now
+        self.k = k
+        self.half_life = half_life
+        self.current = {granularity: int(now // seconds) for granularity, seconds in GRANULARITY.items()}
+        self.buckets = {granularity: defaultdict(Counter) for granularity in GRANULARITY}
+        self.counts = {window: Counter() for window in WINDOWS}
+        self.charts = {window: {} for window in WINDOWS}
+        self.landmark = now
+        self.trend = Counter()
+        self.trending_charts = {}
+        self.categories = {}
+
+    def _offer(self, charts, key, category, score):
+        for chart_category in (None, category) if category is not None else (None,):
+            chart = charts.get(chart_category)
+            if chart is None:
+                chart = charts[chart_category] = TopK(self.k)
+            chart.offer(key, score)
+
+    def add(self, key, category, ts, plays=1):
+        self.categories[key] = category
+        indexes = {}
+        for granularity, seconds in GRANULARITY.items():
+            # Plays stamped in the future count as now
+            index = indexes[granularity] = min(int(ts // seconds), self.current[granularity])
+            if index > self.current[granularity] - KEEP[granularity]:
+                self.buckets[granularity][index][key] += plays
+        for window, (granularity, size) in WINDOWS.items():
+            if indexes[granularity] > self.current[granularity] - size:
+                counts = self.counts[window]
+                counts[key] += plays
+                self._offer(self.charts[window], key, category, counts[key])
+        self.trend[key] += plays * 2 ** ((ts - self.landmark) / self.half_life)
+        self._offer(self.trending_charts, key, category, self.trend[key])
+
+    def load(self, plays):
+        """add() for many (key, category, ts, plays) at once: sums first,
+        then builds each TopK in one pass."""
+        categories, trend = self.categories, self.trend
+        # Stored counts come in hourly rows, so most timestamps repeat
+        slots = {}
+        for key, category, ts, count in plays:
+            slot = slots.get(ts)
+            if slot is None:
+                buckets = []
+                for granularity, seconds in GRANULARITY.items():
+                    index = min(int(ts // seconds), self.current[granularity])
+                    if index > self.current[granularity] - KEEP[granularity]:
+                        buckets.append(self.buckets[granularity][index])
+                slot = slots[ts] = (buckets, 2 ** ((ts - self.landmark) / self.half_life))
+            categories[key] = category
+            for bucket in slot[0]:
+                bucket[key] += count
+            trend[key] += count * slot[1]
+        for window, (granularity, size) in WINDOWS.items():
+            self._recount(window, self.current[granularity] - size)
+        self.trending_charts = self._charts(trend)
+
+    def advance(self, now):
+        """Move the windows up to now, dropping the plays they no longer cover."""
+        for granularity, seconds in GRANULARITY.items():
+            index = int(now // seconds)
+            if index <= self.current[granularity]:
+                continue
+            self.current[granularity] = index
+            buckets = self.buckets[granularity]
+            for expired in [b for b in buckets if b <= index - KEEP[granularity]]:
+                del buckets[expired]
+            for window, (window_granularity, size) in WINDOWS.items():
+                if window_granularity == granularity:
+                    self._recount(window, index - size)
+        if now - self.landmark > REBASE_HALF_LIVES * self.half_life:
+            self._rebase(now)
+
+    def remove(self, key):
+        """Forget key's plays, e.g. once its content is deleted."""
+        if self.categories.pop(key, None) is None and key not in self.trend:
+            return
+        for buckets in self.buckets.values():
+            for bucket in buckets.values():
+                bucket.pop(key, None)
+        for window, counts in self.counts.items():
+            counts.pop(key, None)
+            self.charts[window] = self._charts(counts)
+        self.trend.pop(key, None)
+        self.trending_charts = self._charts(self.trend)
+
+    def _recount(self, window, last_expired):
+        granularity = WINDOWS[window][0]
+        counts = Counter()
+        for index, bucket in self.buckets[granularity].items():
+            if index > last_expired:
+                counts.update(bucket)
+        self.counts[window] = counts
+        self.charts[window] = self._charts(counts)
+
+    def _charts(self, scores):
+        by_category = defaultdict(list)
+        for key, score in scores.items():
+            by_category[self.categories.get(key)].append((key, score))
+        charts = {category: TopK(self.k, items) for category, items in by_category.items() if category is not None}
+        charts[None] = TopK(self.k, scores.items())
+        return charts
+
+    def _rebase(self, now):
+        factor = 2 ** -((now - self.landmark) / self.half_life)
+        self.trend = Counter({key: score * factor for key, score in self.trend.items() if score * factor >= TREND_FLOOR})
+        self.landmark = now
+        self.trending_charts = self._charts(self.trend)
+        live = set(self.trend).union(*self.counts.values())
+        self.categories = {key: category for key, category in self.categories.items() if key in live}
+
+    def top(self, window, category=None, limit=CHART_SIZE):
+        """[((type, id), plays)] over the window, most played first."""
+        chart = self.charts[window].get(category)
+        return chart.ranked()[:limit] if chart else []
+
+    def trending(self, now, category=None, limit=CHART_SIZE):
+        """[((type, id), decayed plays)] as of now, highest first."""
+        chart = self.trending_charts.get(category)
+        if not chart:
+            return []
+        scale = 2 ** -((now - self.landmark) / self.half_life)
+        return [(key, round(score * scale, 3)) for key, score in chart.ranked()[:limit]]
+
+    def stats(self):
+        return {'items': len(self.categories), 'trending': len(self.trend),
+                'day_items': len(self.counts['day']), 'month_items': len(self.counts['month'])}
+
+
+class PlayCountStore:
+    """Hourly play counts in model's table, which every process adds to,
+    and the play history (history's rows, pointing at content through one
+    column per type) to recover them from.
+
+    arms maps a content type to (content model, history column)."""
+
+    def __init__(self, db, model, arms, app=None):
+        self.db = db
+        self.model = model
+        self.arms = arms
+        self.app = app
+
+    def init_app(self, app):
+        self.app = app
+
+    def load(self, since_hour):
+        """(hour, type, id, category, plays) rows from since_hour on."""
+        rows = []
+        with self.app.app_context():
+            for content_type, (content, _) in self.arms.items():
+                stmt = select(self.model.hour, self.model.content_id, content.category, self.model.plays).join(
+                    content, content.id == self.model.content_id
+                ).where(self.model.content_type == content_type, self.model.hour >= since_hour)
+                # Core rows: the ORM's per-row handling would double the time of a large load
+                rows += [(hour, content_type, content_id, category, plays)
+                         for hour, content_id, category, plays in self.db.session.connection().execute(stmt)]
+        return rows
+
+    def save(self, increments, prune_before=None):
+        """Add {(hour, type, id): plays} to the stored counts and drop the
+        hours before prune_before."""
+        model = self.model
+        with self.app.app_context():
+            session = self.db.session
+            if increments:
+                # Deferred: importing the postgresql dialect adds ~50ms to every worker's start
+                from sqlalchemy.dialects import postgresql, sqlite
+                dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+                stmt = dialect.insert(model)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['hour', 'content_type', 'content_id'],
+                    set_={'plays': model.__table__.c.plays + stmt.excluded.plays},
+                )
+                session.execute(stmt, [
+                    {'hour': hour, 'content_type': content_type, 'content_id': content_id, 'plays': plays}
+                    for (hour, content_type, content_id), plays in increments.items()
+                ])
+            if prune_before is not None:
+                session.execute(delete(model).where(model.hour < prune_before))
+            session.commit()
+
+    def remove(self, connection, content_type, content_id):
+        connection.execute(delete(self.model).where(
+            self.model.content_type == content_type, self.model.content_id == content_id))
+
+    def clear(self):
+        with self.app.app_context():
+            self.db.session.execute(delete(self.model))
+            self.db.session.commit()
+
+    def history(self, since, until):
+        """(played_at, type, id) for the plays recorded from since to until."""
+        rows = []
+        with self.app.app_context():
+            for content_type, (_, column) in self.arms.items():
+                played_at = column.class_.played_at
+                stmt = select(played_at, column).where(column.isnot(None), played_at >= since, played_at <= until)
+                rows += [(at, content_type, content_id) for at, content_id in self.db.session.execute(stmt)]
+        return rows
+
+
+class Charts:
+    """Serves PlayCounts built from a PlayCountStore and keeps it current.
+
+    Counts are loaded on first use. add() counts plays at once and queues
+    them as increments, saved every persist_seconds and at exit; a failed
+    save keeps them for the next one. Every rebuild_seconds the counts are
+    reloaded from the store, which holds every process's plays, plus the
+    increments not saved yet.
+    """
+
+    def __init__(self, store, k=CHART_SIZE, half_life=TRENDING_HALF_LIFE, persist_seconds=PERSIST_SECONDS,
+                 rebuild_seconds=REBUILD_SECONDS, clock=time.time):
+        self.store = store
+        self.k = k
+        self.half_life = half_life
+        self.persist_seconds = persist_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.clock = clock
+        self._counts = None
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.persist_lock = threading.RLock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.rebuilt_at = None
+        self.saved = 0
+        self._session_hooks = False
+        atexit.register(self.close)
+
+    def watch(self, model, content_type):
+        """Forget the plays of model rows as they are deleted: stored counts
+        in the deleting transaction, counted ones once it commits. Bulk
+        deletes skip these events; the next rebuild drops their counts from
+        memory, but their stored rows stay until they age out."""
+        def after_delete(mapper, connection, target):
+            self.store.remove(connection, content_type, target.id)
+            object_session(target).info.setdefault('chart_removals', []).append((content_type, target.id))
+
+        event.listen(model, 'after_delete', after_delete)
+        if not self._session_hooks:
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_rollback', self._after_rollback)
+            self._session_hooks = True
+
+    def _after_commit(self, session):
+        removed = session.info.pop('chart_removals', None)
+        if not removed:
+            return
+        with self.lock:
+            for key in removed:
+                if self._counts is not None:
+                    self._counts.remove(key)
+            for pending in [p for p in self.pending if p[1:] in removed]:
+                del self.pending[pending]
+
+    def _after_rollback(self, session):
+        session.info.pop('chart_removals', None)
+
+    def _ready(self):
+        if self._counts is None:
+            with self.persist_lock:
+                if self._counts is None:
+                    self.rebuild()
+            self._start()
+
+    def add(self, plays):
+        """Count plays, (content_type, content_id, category, played_at)
+        with played_at a naive UTC datetime."""
+        self._ready()
+        now = self.clock()
+        with self.lock:
+            counts = self._counts
+            counts.advance(now)
+            for content_type, content_id, category, played_at in plays:
+                ts = min(timestamp(played_at), now)
+                counts.add((content_type, content_id), category, ts)
+                self.pending[int(ts // HOUR), content_type, content_id] += 1
+
+    def top(self, window='day', category=None, limit=CHART_SIZE):
+        self._ready()
+        with self.lock:
+            self._counts.advance(self.clock())
+            return self._counts.top(window, category, limit)
+
+    def trending(self, category=None, limit=CHART_SIZE):
+        self._ready()
+        now = self.clock()
+        with self.lock:
+            self._counts.advance(now)
+            return self._counts.trending(now, category, limit)
+
+    def persist(self):
+        """Save the queued increments. Returns how many rows were written."""
+        with self.persist_lock:
+            with self.lock:
+                batch, self.pending = self.pending, Counter()
+            prune_before = int(self.clock() // HOUR) - RETENTION_HOURS
+            try:
+                self.store.save(batch, prune_before)
+            except Exception:
+                logger.exception('Saving %d play counts failed; keeping them for the next save', len(batch))
+                with self.lock:
+                    self.pending.update(batch)
+                return 0
+            self.saved += len(batch)
+            return len(batch)
+
+    def rebuild(self, from_history=False):
+        """Reload the counts from the store. from_history first replaces the
+        stored counts with ones recounted from the play history, for when
+        they were lost; the history only holds each user's latest plays."""
+        with self.persist_lock:
+            now = self.clock()
+            since = int(now // HOUR) - RETENTION_HOURS
+            if from_history:
+                with self.lock:
+                    self.pending.clear()
+                self.store.clear()
+                recounted = Counter(
+                    (int(timestamp(played_at) // HOUR), content_type, content_id)
+                    for played_at, content_type, content_id in self.store.history(
+                        datetime.utcfromtimestamp(since * HOUR), datetime.utcfromtimestamp(now))
+                )
+                self.store.save(recounted)
+            elif self._counts is not None:
+                self.persist()
+            counts = PlayCounts(self.k, self.half_life, now)
+            counts.load(((content_type, content_id), category, min((hour + 0.5) * HOUR, now), plays)
+                        for hour, content_type, content_id, category, plays in self.store.load(since))
+            with self.lock:
+                # Plays counted while loading, or whose save failed
+                categories = self._counts.categories if self._counts is not None else {}
+                for (hour, content_type, content_id), plays in self.pending.items():
+                    key = (content_type, content_id)
+                    counts.add(key, categories.get(key), min((hour + 0.5) * HOUR, now), plays)
+                counts.advance(self.clock())
+                self._counts = counts
+            self.rebuilt_at = time.time()
+            return counts
+
+    def _start(self):
+        if self.thread is None and self.persist_seconds > 0:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='charts', daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.persist_seconds):
+            try:
+                if self.rebuild_seconds and time.time() - self.rebuilt_at >= self.rebuild_seconds:
+                    self.rebuild()
+                else:
+                    self.persist()
+            except Exception:
+                logger.exception('Refreshing charts failed')
+
+    def close(self):
+        self.stopped.set()
+        if self._counts is not None:
+            self.persist()
+
+    def stats(self):
+        with self.lock:
+            stats = self._counts.stats() if self._counts is not None else {}
+            pending = len(self.pending)
+        return dict(stats, pending=pending, saved=self.saved,
+                    rebuilt_at=self.rebuilt_at or 0)
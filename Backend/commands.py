@@ -0,0 +1,105 @@
+import sys
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from bulk import BulkImporter, export_rows
+from extensions import charts, import_catalog, index_imported, password_hasher, playlist_editor
+from migrations import current_version, head, upgrade
+from models import db, CATALOG_MODELS, User
+
+SAMPLE_USERS = [
+    {'username': 'admin', 'email': 'admin@example.com', 'password': 'admin123', 'is_admin': True},
+]
+SAMPLE_CONTENT = [
+    {'type': 'track', 'title': 'Sample Song 1', 'artist': 'Artist 1', 'file_path': 'sample1.mp3',
+     'duration': 180, 'category': 'Pop'},
+    {'type': 'track', 'title': 'Sample Song 2', 'artist': 'Artist 2', 'file_path': 'sample2.mp3',
+     'duration': 210, 'category': 'Rock'},
+    {'type': 'podcast', 'title': 'Tech Talk Ep1', 'host': 'Tech Host', 'file_path': 'podcast1.mp3',
+     'duration': 1800, 'podcast_name': 'Tech Talk', 'category': 'Technology'},
+]
+
+def seed_sample_data(users=SAMPLE_USERS, content=SAMPLE_CONTENT):
+    """Add the sample users and content that aren't there yet, with one
+    query per table to find them and one bulk insert per table to add them.
+    Users are matched by username, content by its file. Returns the number
+    of rows added."""
+    known = set(db.session.scalars(select(User.username).where(User.username.in_([u['username'] for u in users]))))
+    missing = [user for user in users if user['username'] not in known]
+    if missing:
+        db.session.execute(insert(User), [
+            {'username': user['username'], 'email': user['email'], 'is_admin': user.get('is_admin', False),
+             'password_hash': generate_password_hash(user['password'], password_hasher.method)} for user in missing])
+        db.session.commit()
+
+    rows = []
+    for content_type, model in CATALOG_MODELS.items():
+        paths = [item['file_path'] for item in content if item['type'] == content_type]
+        stored = set(db.session.scalars(select(model.file_path).where(model.file_path.in_(paths))))
+        rows += [item for item in content if item['type'] == content_type and item['file_path'] not in stored]
+    report = BulkImporter(db.session, CATALOG_MODELS, after_insert=index_imported).run(enumerate(rows, 1))
+    return len(missing) + report.inserted
+
+@click.command('seed')
+@with_appcontext
+def seed_command():
+    """Add the sample admin user, tracks and podcast if they are missing."""
+    upgrade(db.engine, db.metadata, echo=click.echo)
+    click.echo(f'Added {seed_sample_data()} sample rows')
+
+@click.command('import-catalog')
+@click.argument('source', type=click.File('rb'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def import_catalog_command(source, fmt, batch_size):
+    """Bulk load tracks and podcasts from an NDJSON or CSV file ('-' for stdin)."""
+    upgrade(db.engine, db.metadata, echo=click.echo)
+    report = import_catalog(source, fmt, batch_size)
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"Imported {report['inserted']} rows, {report['failed']} failed")
+
+@click.command('export-catalog')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--type', 'content_type', type=click.Choice(['track', 'podcast']))
+@with_appcontext
+def export_catalog_command(fmt, content_type):
+    """Write the catalog to stdout as NDJSON or CSV."""
+    for chunk in export_rows(db.session, CATALOG_MODELS, fmt, [content_type] if content_type else None):
+        sys.stdout.write(chunk)
+
+@click.command('charts-rebuild')
+@with_appcontext
+def charts_rebuild_command():
+    """Recount the stored chart play counts from the play history."""
+    counts = charts.rebuild(from_history=True)
+    click.echo(f'Counted plays of {counts.stats()["items"]} items')
+
+@click.command('playlists-refresh')
+@with_appcontext
+def playlists_refresh_command():
+    """Recount every playlist's item count and total duration, e.g. after bulk SQL edits."""
+    playlist_editor.refresh()
+    db.session.commit()
+    click.echo('Playlist summaries recounted')
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this version.')
+@with_appcontext
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    upgrade(db.engine, db.metadata, target, echo=click.echo)
+    click.echo(f'Schema version {current_version(db.engine)} (latest {head()})')
+
+@click.command('db-version')
+@with_appcontext
+def db_version_command():
+    """Show the applied schema version."""
+    click.echo(f'Schema version {current_version(db.engine)} (latest {head()})')
+
+COMMANDS = [seed_command, import_catalog_command, export_catalog_command, charts_rebuild_command,
+            playlists_refresh_command, db_upgrade_command, db_version_command]
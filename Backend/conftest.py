@@ -0,0 +1,66 @@
+"""Tests that need the app take the `app` fixture: one app for the session,
+built on a temporary database rather than the one DATABASE_URL names, whose
+tables are emptied after each test. The `simple_app` fixture runs the JSON
+file backend in a fresh directory instead."""
+import importlib
+import os
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from extensions import catalog_search, charts, play_buffer, recommender, response_cache, role_cache
+from migrations import upgrade
+from models import db, User
+from response_cache import backend_from_env
+
+
+@pytest.fixture(scope='session')
+def test_app(tmp_path_factory):
+    # One app per process: create_app() rebinds the services in extensions.py
+    folder = tmp_path_factory.mktemp('app')
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + str(folder / 'test.db'),
+        'DATABASE_REPLICA_URL': None,
+        'UPLOAD_FOLDER': str(folder / 'uploads'),
+        'RENDITION_CACHE_DIR': None,
+    })
+    with app.app_context():
+        upgrade(db.engine, db.metadata, echo=lambda message: None)
+    return app
+
+
+@pytest.fixture
+def app(test_app):
+    yield test_app
+    with test_app.app_context():
+        play_buffer.flush()
+        with db.engine.begin() as connection:
+            for table in reversed(db.metadata.sorted_tables):
+                connection.execute(table.delete())
+        # Ids are reused once the tables are empty: drop what was derived from the old rows
+        catalog_search.rebuild()
+        charts.rebuild(from_history=True)
+        recommender.rebuild()
+        role_cache.invalidate()
+    response_cache.backend = backend_from_env()
+
+
+@pytest.fixture
+def admin_headers(app):
+    with app.app_context():
+        admin = User(username='test-admin', email='test-admin@test.com', password_hash='x', is_admin=True)
+        db.session.add(admin)
+        db.session.commit()
+        return {'Authorization': f'Bearer {create_access_token(identity=str(admin.id))}'}
+
+
+@pytest.fixture
+def simple_app(tmp_path, monkeypatch):
+    # simple_app keeps its files relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('uploads')
+    module = importlib.import_module('simple_app')
+    module.users_store.data = None
+    module.content_store.data = None
+    return module
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import Select
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING')
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+SQLITE_WAL = os.getenv('DB_SQLITE_WAL', '1') == '1'
+SQLITE_SYNCHRONOUS = os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.getenv('DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('DB_SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_FOREIGN_KEYS = os.getenv('DB_SQLITE_FOREIGN_KEYS', '1') == '1'
+READ_METHODS = ('GET', 'HEAD')
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def to_dict(self, pool):
+        waits = self.checkouts + self.timeouts
+        stats = {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'connects': self.connects,
+            'wait_avg_ms': round(self.wait_total / waits * 1000, 3) if waits else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+        }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0),
+                         idle=pool.checkedin())
+        return stats
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times how long each checkout waited for a connection."""
+
+    # Log as QueuePool does, under the 'sqlalchemy' logger: SQLAlchemy keeps that at WARN, where
+    # this module's own name would inherit the root level and log every checkout
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.QueuePool'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url):
+    """Engine keyword arguments for url from the DB_* environment settings."""
+    url = make_url(url)
+    if _is_memory_sqlite(url):
+        # Flask-SQLAlchemy pins in-memory SQLite to one StaticPool connection
+        return {}
+    server = url.get_backend_name() != 'sqlite'
+    options = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': POOL_PRE_PING == '1' if POOL_PRE_PING is not None else server,
+    }
+    if STATEMENT_TIMEOUT_MS and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}'}
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if SQLITE_WAL:
+        # WAL lets readers run while a write is in progress
+        cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    if SQLITE_FOREIGN_KEYS:
+        # Off by default in SQLite; the ON DELETE CASCADE rules depend on it
+        cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def configure_engine(engine):
+    """Apply connect-time settings to an engine built with engine_options().
+    Must run before the engine's first connection."""
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _sqlite_pragmas)
+    if isinstance(engine.pool, MeteredQueuePool):
+        metrics = engine.pool.metrics
+
+        @event.listens_for(engine, 'connect')
+        def count_connect(dbapi_connection, connection_record):
+            metrics.connects += 1
+
+
+def pool_stats(engine):
+    metrics = getattr(engine.pool, 'metrics', None)
+    if metrics is None:
+        return {'pool': type(engine.pool).__name__}
+    return dict(metrics.to_dict(engine.pool), pool=type(engine.pool).__name__)
+
+
+def use_primary():
+    """Read from the primary for the rest of this request, e.g. after a GET
+    handler wrote something it is about to read back."""
+    g.primary_reads = True
+
+
+class ReplicaSession(Session):
+    """Sends SELECTs issued while handling a GET or HEAD request to the
+    'replica' bind, when one is configured. Writes, flushes, reads outside
+    such requests and reads after use_primary() go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and has_request_context() and request.method in READ_METHODS
+                and not g.get('primary_reads')):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,198 @@
+"""Services the blueprints share. Like db they are created without an app
+and attached to one by init_app(); their threads and worker pools start
+on first use, not on import. Background work (play flushes, chart and
+recommendation rebuilds, ingest hooks) runs in the app given to init_app().
+"""
+import functools
+import os
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, or_, select
+
+from auth import CachingJWTManager, RoleCache
+from bulk import BulkImporter, read_rows
+from catalog import Catalog
+from charts import Charts, PlayCountStore
+from db_config import configure_engine, pool_stats
+from ingest import IngestQueue
+from metrics import Metrics
+from models import (db, CATALOG_MODELS, PODCAST_FIELDS, TRACK_FIELDS, PlayCount, Playlist, PlaylistTrack, Podcast,
+                    RecentlyPlayed, Track, User)
+from passwords import PasswordHasher
+from play_events import PlayBuffer, RETENTION
+from playlist_editor import PlaylistEditor
+from recommendations import Recommender
+from renditions import RenditionCache
+from response_cache import ResponseCache
+from search_index import CatalogSearch
+from seek_index import load_seek_table
+
+metrics = Metrics()
+jwt = CachingJWTManager()
+
+catalog_search = CatalogSearch(db)
+catalog_search.register('track', Track, 'artist')
+catalog_search.register('podcast', Podcast, 'host')
+
+response_cache = ResponseCache()
+response_cache.watch(Track, 'track')
+response_cache.watch(Podcast, 'podcast')
+
+ingest_queue = IngestQueue()
+renditions = RenditionCache()
+
+@ingest_queue.on_complete
+def index_seek_points(filename, metadata):
+    if metadata.get('format') == 'mp3':
+        load_seek_table(os.path.join(ingest_queue.folder, filename))
+
+@ingest_queue.on_complete
+def queue_renditions(filename, metadata):
+    renditions.prepare(os.path.join(ingest_queue.folder, filename), metadata.get('duration'))
+
+@ingest_queue.on_complete
+def fill_missing_durations(filename, metadata):
+    # Content added before its upload finished parsing gets the duration now
+    if not metadata.get('duration'):
+        return
+    file_path = os.path.join(ingest_queue.folder, filename)
+    with _app.app_context():
+        for model, namespace in ((Track, 'track'), (Podcast, 'podcast')):
+            updated = model.query.filter(
+                model.file_path == file_path, or_(model.duration.is_(None), model.duration == 0)
+            ).update({'duration': metadata['duration']}, synchronize_session=False)
+            if updated:
+                response_cache.backend.bump(namespace)
+                column = getattr(PlaylistTrack, f'{namespace}_id')
+                playlist_editor.refresh(select(PlaylistTrack.playlist_id).join(model, model.id == column)
+                                        .where(model.file_path == file_path))
+        db.session.commit()
+
+catalog = Catalog(db, {'track': (Track, TRACK_FIELDS), 'podcast': (Podcast, PODCAST_FIELDS)})
+
+# What playlists, play history and search list for each item
+ITEM_FIELDS = ['id', 'title', 'artist', 'host']
+
+def content_items(model, *criteria, order_by, limit=None, entry_field=None):
+    # model's rows (PlaylistTrack, RecentlyPlayed) and the content they point at, in one query.
+    # order_by is a tuple of columns; entry_field names the model row's own id in each item
+    stmt = catalog.referenced(model, {'track': model.track_id, 'podcast': model.podcast_id}, ITEM_FIELDS)
+    serialize = catalog.row_serializer(ITEM_FIELDS)
+    if not entry_field:
+        return list(map(serialize, db.session.execute(stmt.where(*criteria).order_by(*order_by).limit(limit))))
+    rows = db.session.execute(stmt.add_columns(model.id).where(*criteria).order_by(*order_by).limit(limit))
+    return [dict(serialize(row), **{entry_field: row[-1]}) for row in rows]
+
+def content_reference(data):
+    # Playlist entries and plays point at exactly one track or podcast
+    track_id, podcast_id = data.get('track_id'), data.get('podcast_id')
+    if (track_id is None) == (podcast_id is None):
+        raise ValueError('Exactly one of track_id and podcast_id is required')
+    return track_id, podcast_id
+
+role_cache = RoleCache(lambda user_id: db.session.scalar(db.select(User.is_admin).where(User.id == user_id)))
+role_cache.watch(User)
+admin_required = role_cache.admin_required
+
+password_hasher = PasswordHasher()
+
+charts = Charts(PlayCountStore(db, PlayCount, {
+    'track': (Track, RecentlyPlayed.track_id), 'podcast': (Podcast, RecentlyPlayed.podcast_id)}))
+charts.watch(Track, 'track')
+charts.watch(Podcast, 'podcast')
+
+def write_plays(events):
+    # One executemany insert per flush, then trim the touched users' history to the newest RETENTION rows
+    categories = {}
+    with _app.app_context():
+        # Plays of content deleted since they were buffered would fail the foreign keys
+        for column, model in (('track_id', Track), ('podcast_id', Podcast)):
+            ids = {event[column] for event in events if event[column] is not None}
+            if ids:
+                known = dict(db.session.execute(select(model.id, model.category).where(model.id.in_(ids))).all())
+                categories[column] = known
+                events = [event for event in events if event[column] is None or event[column] in known]
+        if not events:
+            return
+        db.session.execute(insert(RecentlyPlayed), events)
+        ranked = select(
+            RecentlyPlayed.id,
+            func.row_number().over(
+                partition_by=RecentlyPlayed.user_id,
+                order_by=(RecentlyPlayed.played_at.desc(), RecentlyPlayed.id.desc())
+            ).label('position')
+        ).where(RecentlyPlayed.user_id.in_({event['user_id'] for event in events})).subquery()
+        db.session.execute(
+            delete(RecentlyPlayed).where(RecentlyPlayed.id.in_(
+                select(ranked.c.id).where(ranked.c.position > RETENTION)
+            ))
+        )
+        db.session.commit()
+    charts.add(
+        (content_type, event[column], categories[column][event[column]], event['played_at'] or datetime.utcnow())
+        for event in events for content_type, column in (('track', 'track_id'), ('podcast', 'podcast_id'))
+        if event[column] is not None
+    )
+    recommender.add((('user', event['user_id']), event['track_id']) for event in events if event['track_id'])
+
+play_buffer = PlayBuffer(write_plays)
+
+def basket_rows():
+    # Each playlist and each user's listening history is one basket of tracks
+    with _app.app_context():
+        playlist_rows = db.session.execute(
+            select(PlaylistTrack.playlist_id, PlaylistTrack.track_id)
+            .where(PlaylistTrack.track_id.isnot(None))
+            .order_by(PlaylistTrack.playlist_id, PlaylistTrack.added_at, PlaylistTrack.id)
+        ).all()
+        play_rows = db.session.execute(
+            select(RecentlyPlayed.user_id, RecentlyPlayed.track_id)
+            .where(RecentlyPlayed.track_id.isnot(None))
+            .order_by(RecentlyPlayed.user_id, RecentlyPlayed.played_at, RecentlyPlayed.id)
+        ).all()
+    for playlist_id, track_id in playlist_rows:
+        yield ('playlist', playlist_id), track_id
+    for user_id, track_id in play_rows:
+        yield ('user', user_id), track_id
+
+recommender = Recommender(basket_rows)
+recommender.watch(PlaylistTrack, lambda pt: ('playlist', pt.playlist_id), lambda pt: pt.track_id)
+
+playlist_editor = PlaylistEditor(db, Playlist, PlaylistTrack, {
+    'track': (Track, PlaylistTrack.track_id), 'podcast': (Podcast, PlaylistTrack.podcast_id)})
+playlist_editor.watch()
+
+def index_imported(session, content_type, rows):
+    # Bulk inserts skip the mapper events that keep search and the cache current
+    catalog_search.index_many(session, content_type, rows)
+    response_cache.mark(session, content_type)
+
+def import_catalog(stream, fmt, batch_size):
+    importer = BulkImporter(db.session, CATALOG_MODELS, batch_size, after_insert=index_imported)
+    return importer.run(read_rows(stream, fmt)).to_dict()
+
+_app = None
+
+def init_app(app):
+    global _app
+    _app = app
+    metrics.instrument(app)
+    db.init_app(app)
+    jwt.init_app(app)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            configure_engine(engine)
+            metrics.watch_engine(engine)
+            metrics.add_stats(f'db_pool_{key or "primary"}', functools.partial(pool_stats, engine))
+    ingest_queue.init_app(app)
+    renditions.use_directory(app.config['RENDITION_CACHE_DIR']
+                             or os.path.join(app.config['UPLOAD_FOLDER'], '.renditions'))
+    charts.store.init_app(app)
+
+    metrics.add_stats('response_cache', response_cache.stats)
+    metrics.add_stats('role_cache', role_cache.stats)
+    metrics.add_stats('password_hasher', password_hasher.stats)
+    metrics.add_stats('play_buffer', play_buffer.stats)
+    metrics.add_stats('renditions', renditions.stats)
+    metrics.add_stats('recommendations', recommender.stats)
+    metrics.add_stats('charts', charts.stats)
@@ -0,0 +1,95 @@
+import glob
+import math
+import os
+
+from json_store import write_atomic
+from seek_index import load_seek_table
+
+SEGMENT_SECONDS = float(os.getenv('HLS_SEGMENT_SECONDS', 10))
+# Segment URLs carry the source version, so they can be cached for good
+SEGMENT_MAX_AGE = 365 * 24 * 3600
+MANIFEST_MIMETYPE = 'application/vnd.apple.mpegurl'
+
+
+class SegmentedAudio:
+    """An MP3 split into segments of about segment_seconds, each starting on
+    a frame boundary from the file's seek table. Segments are byte ranges of
+    the stored file, so packaging copies no audio."""
+
+    def __init__(self, table, segment_seconds=SEGMENT_SECONDS):
+        self.table = table
+        self.per_segment = max(1, round(segment_seconds / table.interval))
+        self.segment_seconds = self.per_segment * table.interval
+        self.version = f'{table.mtime_ns:x}-{table.size:x}'
+
+    def __len__(self):
+        return math.ceil(len(self.table.offsets) / self.per_segment)
+
+    def byte_range(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        offsets = self.table.offsets
+        start = offsets[index * self.per_segment]
+        following = (index + 1) * self.per_segment
+        return start, offsets[following] if following < len(offsets) else self.table.size
+
+    def duration_of(self, index):
+        start = index * self.segment_seconds
+        return max(min(self.segment_seconds, self.table.duration - start), 0.0)
+
+    def segment_for(self, seconds):
+        return min(max(int(seconds / self.segment_seconds), 0), len(self) - 1)
+
+    def manifest(self, extension='.mp3'):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{math.ceil(self.segment_seconds)}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+        ]
+        for index in range(len(self)):
+            lines.append(f'#EXTINF:{self.duration_of(index):.3f},')
+            lines.append(f'segments/{self.version}/{index}{extension}')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+
+def segment(path, segment_seconds=SEGMENT_SECONDS):
+    """SegmentedAudio for path, or None if it can't be split. The seek table
+    behind it is built on first use and kept on disk."""
+    table = load_seek_table(path)
+    if table is None:
+        return None
+    return SegmentedAudio(table, segment_seconds)
+
+
+def _manifest_prefix(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.hls', name)
+
+
+def manifest_path(path, version, segment_seconds):
+    return f'{_manifest_prefix(path)}.{version}.{segment_seconds:g}.m3u8'
+
+
+def load_manifest(path, segmented):
+    """The playlist for segmented, read from disk or written there on first
+    request. Playlists of earlier versions of the file are removed."""
+    manifest_file = manifest_path(path, segmented.version, segmented.segment_seconds)
+    try:
+        with open(manifest_file) as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    manifest = segmented.manifest()
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    current = f'{_manifest_prefix(path)}.{segmented.version}.'
+    for stale in glob.glob(glob.escape(_manifest_prefix(path)) + '.*.m3u8'):
+        if not stale.startswith(current):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+    write_atomic(manifest_file, manifest.encode())
+    return manifest
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import Request, current_app
+
+from audio_metadata import read_metadata
+from json_store import write_atomic
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 2))
+COPY_CHUNK = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class HashingFile:
+    """Spool target for one uploaded file part: bytes go straight to a temp
+    file in the upload folder while a SHA-256 of them is kept. The temp file
+    is removed on close unless store_upload() has claimed it."""
+
+    def __init__(self, directory):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix='.upload-', delete=False)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.claimed = False
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        if not self.claimed and os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        folder = current_app.config['UPLOAD_FOLDER']
+        os.makedirs(folder, exist_ok=True)
+        return HashingFile(folder)
+
+
+class StoredUpload:
+    def __init__(self, filename, checksum, duplicate):
+        self.filename = filename
+        self.checksum = checksum
+        self.duplicate = duplicate
+
+
+def store_upload(file, folder, filename):
+    """Move an uploaded FileStorage to its content-addressed name.
+
+    The stored name is the checksum prefix plus the original extension, so a
+    second upload of the same bytes is detected with one exists() call and
+    its temp file is dropped.
+    """
+    stream = file.stream
+    if not isinstance(stream, HashingFile):
+        # Parsed without UploadRequest: hash while copying in chunks
+        spool = HashingFile(folder)
+        while True:
+            chunk = stream.read(COPY_CHUNK)
+            if not chunk:
+                break
+            spool.write(chunk)
+        stream = spool
+
+    checksum = stream.sha256.hexdigest()
+    stored_name = checksum[:20] + os.path.splitext(filename)[1].lower()
+    stored_path = os.path.join(folder, stored_name)
+    stream.file.flush()
+    duplicate = os.path.exists(stored_path)
+    if not duplicate:
+        stream.file.close()
+        os.replace(stream.file.name, stored_path)
+        stream.claimed = True
+    stream.close()
+    return StoredUpload(stored_name, checksum, duplicate)
+
+
+class IngestQueue:
+    """Parses uploaded audio headers on a thread pool.
+
+    Job records and the extracted metadata are JSON files under the upload
+    folder, so any worker process can report on a job another one queued.
+    """
+
+    def __init__(self, folder=None, workers=INGEST_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        self.callbacks = []
+        self.lock = threading.Lock()
+        if folder is not None:
+            self.use_folder(folder)
+
+    def init_app(self, app):
+        self.use_folder(app.config['UPLOAD_FOLDER'])
+
+    def use_folder(self, folder):
+        self.folder = folder
+        self.jobs_dir = os.path.join(folder, '.jobs')
+        self.meta_dir = os.path.join(folder, '.meta')
+
+    def on_complete(self, callback):
+        """callback(filename, metadata) runs on the worker after parsing."""
+        self.callbacks.append(callback)
+        return callback
+
+    def submit(self, stored):
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'file_path': stored.filename,
+            'checksum': stored.checksum,
+            'duplicate': stored.duplicate,
+            'metadata': None,
+            'error': None,
+            'created_at': datetime.utcnow().isoformat(),
+        }
+        known = self.metadata_for(stored.filename) if stored.duplicate else None
+        if known is not None:
+            job.update(status='done', metadata=known)
+            self._save(job)
+        else:
+            self._save(job)
+            self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job['status'] = 'running'
+        self._save(job)
+        try:
+            metadata = read_metadata(os.path.join(self.folder, job['file_path']))
+            os.makedirs(self.meta_dir, exist_ok=True)
+            write_atomic(self._meta_path(job['file_path']), json.dumps(metadata).encode())
+            job.update(status='done', metadata=metadata)
+        except Exception as e:
+            job.update(status='failed', error=str(e))
+        else:
+            # The metadata is stored: a failing consumer doesn't fail the job or skip the others
+            for callback in self.callbacks:
+                try:
+                    callback(job['file_path'], metadata)
+                except Exception:
+                    logger.exception('Ingest callback failed', extra={'file_path': job['file_path']})
+        self._save(job)
+
+    def _save(self, job):
+        with self.lock:
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            write_atomic(os.path.join(self.jobs_dir, job['id'] + '.json'), json.dumps(job).encode())
+
+    def _meta_path(self, filename):
+        return os.path.join(self.meta_dir, os.path.basename(filename) + '.json')
+
+    def get(self, job_id):
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.jobs_dir, job_id + '.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def metadata_for(self, filename):
+        """Metadata extracted for a stored upload, or None if not parsed yet."""
+        try:
+            with open(self._meta_path(filename)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
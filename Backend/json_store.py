@@ -0,0 +1,334 @@
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+COMPACT_EVERY = int(os.getenv('STORE_COMPACT_EVERY', 1000))
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock shared by every process that opens the same path."""
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _container(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+def _items(data, path):
+    try:
+        return _container(data, path)
+    except (KeyError, IndexError):
+        return []
+
+
+def apply_op(data, op):
+    path = op['path']
+    if op['op'] == 'append':
+        for index, key in enumerate(path):
+            data = data.setdefault(key, [] if index == len(path) - 1 else {})
+        data.append(op['value'])
+    elif op['op'] == 'remove':
+        items = _container(data, path)
+        if op['value'] in items:
+            items.remove(op['value'])
+    elif op['op'] == 'set':
+        _container(data, path[:-1])[path[-1]] = op['value']
+
+
+class KeyIndex:
+    """Maps item[field] to the first item with that value in the list at path."""
+
+    def __init__(self, path, field):
+        self.path = list(path)
+        self.field = field
+        self.items = {}
+
+    def rebuild(self, data):
+        self._index(_items(data, self.path))
+
+    def _index(self, items):
+        self.items = {}
+        for item in items:
+            self.items.setdefault(item[self.field], []).append(item)
+
+    def apply(self, op):
+        if op['path'] != self.path:
+            return
+        if op['op'] == 'append':
+            self.items.setdefault(op['value'][self.field], []).append(op['value'])
+        elif op['op'] == 'remove':
+            # Same-keyed items keep their list order, so this drops the one apply_op removed
+            key = op['value'][self.field]
+            items = self.items.get(key, [])
+            if op['value'] in items:
+                items.remove(op['value'])
+                if not items:
+                    del self.items[key]
+        elif op['op'] == 'set':
+            self._index(op['value'])
+
+    def get(self, key):
+        items = self.items.get(key)
+        return items[0] if items else None
+
+
+class GroupIndex:
+    """Ordered sets mirroring a dict of lists at path, e.g. favorites."""
+
+    def __init__(self, path):
+        self.path = list(path)
+        self.groups = {}
+
+    def rebuild(self, data):
+        self._index(_items(data, self.path))
+
+    def _index(self, groups):
+        self.groups = {key: dict.fromkeys(values) for key, values in dict(groups).items()}
+
+    def apply(self, op):
+        if op['op'] == 'set' and op['path'] == self.path:
+            self._index(op['value'])
+            return
+        if op['path'][:-1] != self.path or len(op['path']) != len(self.path) + 1:
+            return
+        group = self.groups.setdefault(op['path'][-1], {})
+        if op['op'] == 'append':
+            group[op['value']] = None
+        elif op['op'] == 'remove':
+            group.pop(op['value'], None)
+        elif op['op'] == 'set':
+            self.groups[op['path'][-1]] = dict.fromkeys(op['value'])
+
+    def get(self, key):
+        return self.groups.get(key, {})
+
+
+class IdAllocator:
+    """Hands out ids above the highest one appended at path; a removed id
+    stays taken until a compaction drops it from the snapshot. Call
+    next_id() inside locked() so no other writer can take the same id."""
+
+    def __init__(self, path, field='id'):
+        self.path = list(path)
+        self.field = field
+        self.last = 0
+
+    def rebuild(self, data):
+        self.last = max((item[self.field] for item in _items(data, self.path)), default=0)
+
+    def apply(self, op):
+        if op['path'] != self.path:
+            return
+        if op['op'] == 'append':
+            self.last = max(self.last, op['value'][self.field])
+        elif op['op'] == 'set':
+            self.last = max([self.last] + [item[self.field] for item in op['value']])
+
+    def next_id(self):
+        return self.last + 1
+
+
+class JsonStore:
+    """A JSON document persisted as a snapshot plus an append-only log of
+    changes.
+
+    Readers keep the parsed document in memory and only look at the disk
+    again when the snapshot or log signature changes, replaying just the new
+    log lines. Writers hold a cross-process file lock, append one line per
+    change and fold the log back into the snapshot every COMPACT_EVERY
+    changes. The log's first line records the hash of the snapshot it
+    applies to, so a log left behind by an interrupted compaction is
+    ignored rather than replayed twice.
+    """
+
+    def __init__(self, path, default, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.log_path = path + '.log'
+        self.lock_path = path + '.lock'
+        self.default = default
+        self.compact_every = compact_every
+        self.data = None
+        self.snapshot_signature = None
+        self.snapshot_hash = None
+        self.log_signature = None
+        self.log_offset = 0
+        self.log_entries = 0
+        self.log_valid = False
+        self.indexes = []
+        self.mutex = threading.RLock()
+
+    def add_index(self, index):
+        """Keep index in step with the document; returns it for convenience."""
+        with self.mutex:
+            self.indexes.append(index)
+            if self.data is not None:
+                index.rebuild(self.data)
+        return index
+
+    def _apply(self, op):
+        apply_op(self.data, op)
+        for index in self.indexes:
+            index.apply(op)
+
+    def _rebuild_indexes(self):
+        for index in self.indexes:
+            index.rebuild(self.data)
+
+    def load(self):
+        with self.mutex:
+            self._refresh()
+            return self.data
+
+    @contextmanager
+    def locked(self):
+        """Hold the store for a read-modify-write; yields the current data."""
+        with self.mutex, file_lock(self.lock_path):
+            self._refresh()
+            yield self.data
+
+    def _refresh(self):
+        signature = _signature(self.path)
+        if self.data is None or signature != self.snapshot_signature:
+            self._load_snapshot(signature)
+        if _signature(self.log_path) != self.log_signature:
+            self._replay_log()
+
+    def _load_snapshot(self, signature):
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            self.data = json.loads(raw)
+        except FileNotFoundError:
+            raw = b''
+            self.data = copy.deepcopy(self.default)
+        self._rebuild_indexes()
+        self.snapshot_signature = signature
+        self.snapshot_hash = hashlib.sha1(raw).hexdigest()
+        self.log_signature = None
+        self.log_offset = 0
+        self.log_entries = 0
+        self.log_valid = False
+
+    def _replay_log(self):
+        signature = _signature(self.log_path)
+        if signature is None:
+            self.log_signature = None
+            return
+        if self.log_signature is not None and (signature[0] != self.log_signature[0]
+                                               or signature[2] < self.log_offset):
+            # The log was replaced by a compaction elsewhere
+            self._load_snapshot(_signature(self.path))
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.log_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # a writer is mid-append
+                entry = json.loads(line)
+                if self.log_offset == 0:
+                    self.log_valid = entry.get('base') == self.snapshot_hash
+                elif self.log_valid:
+                    self._apply(entry)
+                    self.log_entries += 1
+                self.log_offset += len(line)
+        self.log_signature = _signature(self.log_path)
+
+    def _write_op(self, op):
+        if not self.log_valid:
+            self._reset_log()
+        line = (json.dumps(op, separators=(',', ':')) + '\n').encode()
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        self._apply(op)
+        self.log_offset += len(line)
+        self.log_entries += 1
+        self.log_signature = _signature(self.log_path)
+        if self.log_entries >= self.compact_every:
+            self.compact()
+
+    def _reset_log(self):
+        header = json.dumps({'base': self.snapshot_hash}) + '\n'
+        write_atomic(self.log_path, header.encode())
+        self.log_signature = _signature(self.log_path)
+        self.log_offset = len(header)
+        self.log_entries = 0
+        self.log_valid = True
+
+    # Mutations must run inside locked()
+    def append(self, path, value):
+        self._write_op({'op': 'append', 'path': list(path), 'value': value})
+
+    def remove(self, path, value):
+        self._write_op({'op': 'remove', 'path': list(path), 'value': value})
+
+    def set(self, path, value):
+        self._write_op({'op': 'set', 'path': list(path), 'value': value})
+
+    def compact(self):
+        self._write_snapshot(self.data)
+
+    def save(self, data):
+        """Replace the whole document, e.g. for a one-off rewrite."""
+        with self.mutex, file_lock(self.lock_path):
+            self._write_snapshot(data)
+
+    def _write_snapshot(self, data):
+        raw = json.dumps(data).encode()
+        write_atomic(self.path, raw)
+        self.data = data
+        self._rebuild_indexes()
+        self.snapshot_signature = _signature(self.path)
+        self.snapshot_hash = hashlib.sha1(raw).hexdigest()
+        self._reset_log()
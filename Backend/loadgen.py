@@ -0,0 +1,665 @@
+"""Seeded load generation for the backends.
+
+Builds a synthetic library in a scratch folder (users, tracks, podcasts,
+playlists and play histories, with item and search term popularity
+following a Zipf law), then drives scenarios against it and reports
+throughput and p50/p95/p99 latency per scenario as JSON.
+
+    python loadgen.py                                   # app.py through the test client
+    python loadgen.py --target asgi --concurrency 16    # a live serve.py server
+    python loadgen.py --app simple_app --scenarios browse,stream
+    python loadgen.py --scenarios listings --playlist-size 500
+    python loadgen.py --scenarios browse --alongside login_storm    # reads during a login storm
+    python loadgen.py --save-baseline                   # store as loadgen_baselines/<app>-<target>.json
+    python loadgen.py --compare --threshold 0.25        # exit 1 on a regression
+
+The same --seed and sizes give the same data and the same request mix.
+Baselines are only comparable on the machine that recorded them.
+"""
+import argparse
+import bisect
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(BACKEND_DIR, 'loadgen_baselines')
+ZIPF_S = float(os.getenv('LOADGEN_ZIPF_S', 1.1))
+PASSWORD = 'loadgen-password'
+CATEGORIES = ['Pop', 'Rock', 'Jazz', 'Hip-Hop', 'Classical', 'Electronic', 'Folk', 'Talk', 'News', 'Comedy']
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'su', 'ne', 'to', 'vi', 'de', 'an', 'mor', 'zen']
+WORDS = ['love', 'night', 'the', 'sun', 'deep', 'talk', 'drive', 'morning', 'blue', 'song'] + [
+    a + b for a in SYLLABLES for b in SYLLABLES
+]
+AUDIO_FILES = 4
+AUDIO_SECONDS = 60
+READ_LIMIT = 64 * 1024      # bytes of audio a listener takes before seeking or leaving
+HOST = '127.0.0.1'
+
+
+class Zipf:
+    """Draws indexes 0..n-1 with P(k) proportional to 1 / (k + 1) ** s."""
+
+    def __init__(self, n, s=ZIPF_S):
+        self.cumulative = []
+        total = 0.0
+        for k in range(1, n + 1):
+            total += 1 / k ** s
+            self.cumulative.append(total)
+
+    def index(self, rng):
+        return bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+
+    def choice(self, rng, ranked):
+        return ranked[self.index(rng)]
+
+
+def mp3_file(path, seconds):
+    # Constant 128 kbps MPEG-1 Layer III frames at 44.1 kHz: enough for seek tables
+    frame = bytes([0xFF, 0xFB, 0x90, 0xC4]).ljust(144 * 128000 // 44100, b'\x00')
+    with open(path, 'wb') as f:
+        f.write(frame * int(seconds * 44100 / 1152))
+
+
+class Dataset:
+    """The generated library, in plain rows, with the popularity rankings
+    the scenarios draw from. Ids are assigned here, starting at 1."""
+
+    def __init__(self, seed=1, users=200, tracks=5000, podcasts=1000, playlists=2, playlist_size=20, plays=20):
+        rng = random.Random(seed)
+        self.sizes = {'seed': seed, 'users': users, 'tracks': tracks, 'podcasts': podcasts,
+                      'playlists': playlists, 'playlist_size': playlist_size, 'plays': plays}
+        word_zipf = Zipf(len(WORDS))
+        self.words = rng.sample(WORDS, len(WORDS))
+        self.word_zipf = word_zipf
+
+        def phrase(n):
+            return ' '.join(word_zipf.choice(rng, self.words) for _ in range(n))
+
+        start = datetime(2024, 1, 1)
+        self.users = [{'id': n, 'username': f'load{n}', 'email': f'load{n}@example.com'} for n in range(1, users + 1)]
+        artists = [phrase(2).title() for _ in range(max(tracks // 20, 1))]
+        artist_zipf = Zipf(len(artists))
+        self.tracks = [
+            {'id': n, 'title': phrase(3).title(), 'artist': artist_zipf.choice(rng, artists),
+             'category': rng.choice(CATEGORIES[:7]), 'duration': AUDIO_SECONDS, 'audio': n % AUDIO_FILES,
+             'created_at': start + timedelta(minutes=n)}
+            for n in range(1, tracks + 1)
+        ]
+        self.podcasts = [
+            {'id': n, 'title': phrase(4).title(), 'host': phrase(2).title(), 'podcast_name': phrase(2).title(),
+             'category': rng.choice(CATEGORIES[7:]), 'duration': AUDIO_SECONDS, 'audio': n % AUDIO_FILES,
+             'created_at': start + timedelta(minutes=n, seconds=30)}
+            for n in range(1, podcasts + 1)
+        ]
+        self.categories = rng.sample(CATEGORIES, len(CATEGORIES))
+        self.category_zipf = Zipf(len(CATEGORIES))
+
+        # Popularity is independent of id, so hot rows are spread through the tables
+        self.track_ranking = rng.sample([t['id'] for t in self.tracks], tracks)
+        self.podcast_ranking = rng.sample([p['id'] for p in self.podcasts], podcasts)
+        self.track_zipf = Zipf(tracks)
+        self.podcast_zipf = Zipf(max(podcasts, 1))
+        self.user_ranking = rng.sample([u['id'] for u in self.users], users)
+        self.user_zipf = Zipf(users)
+
+        self.playlists = []
+        self.user_playlists = {}
+        self.playlist_items = []
+        self.plays = []
+        for user in self.users:
+            for n in range(rng.randint(0, 2 * playlists)):
+                playlist_id = len(self.playlists) + 1
+                self.playlists.append({'id': playlist_id, 'user_id': user['id'], 'name': f'{phrase(2).title()} {n}'})
+                self.user_playlists.setdefault(user['id'], []).append(playlist_id)
+                # A playlist holds an item once
+                held = set()
+                for _ in range(rng.randint(1, 2 * playlist_size)):
+                    item = self.item(rng)
+                    if (item['track_id'], item['podcast_id']) not in held:
+                        held.add((item['track_id'], item['podcast_id']))
+                        self.playlist_items.append({'playlist_id': playlist_id, **item})
+            for n in range(rng.randint(0, 2 * plays)):
+                self.plays.append({'user_id': user['id'], **self.item(rng),
+                                   'played_at': start + timedelta(days=30, seconds=rng.randrange(30 * 86400))})
+
+    def item(self, rng):
+        # Playlist entries and plays: four tracks to every podcast episode
+        if self.podcasts and rng.random() < 0.2:
+            return {'track_id': None, 'podcast_id': self.podcast(rng)}
+        return {'track_id': self.track(rng), 'podcast_id': None}
+
+    def track(self, rng):
+        return self.track_zipf.choice(rng, self.track_ranking)
+
+    def podcast(self, rng):
+        return self.podcast_zipf.choice(rng, self.podcast_ranking)
+
+    def user(self, rng):
+        return self.user_zipf.choice(rng, self.user_ranking)
+
+    def category(self, rng):
+        return self.category_zipf.choice(rng, self.categories)
+
+    def query(self, rng):
+        # One or two popular words, the last often still being typed
+        words = [self.word_zipf.choice(rng, self.words) for _ in range(rng.choice((1, 1, 2)))]
+        if rng.random() < 0.5:
+            words[-1] = words[-1][:max(2, len(words[-1]) - rng.randrange(3))]
+        return ' '.join(words)
+
+
+def write_audio(folder):
+    os.makedirs(folder, exist_ok=True)
+    paths = [os.path.join(folder, f'load{n}.mp3') for n in range(AUDIO_FILES)]
+    for path in paths:
+        mp3_file(path, AUDIO_SECONDS)
+    return paths
+
+
+def load_app(data, folder):
+    """Write data into a fresh app.py database in folder and return the
+    imported app module. Must run before anything else imports app."""
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(folder, "loadgen.db")}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(folder, 'uploads')
+    sys.path.insert(0, BACKEND_DIR)
+    import app as module
+    from sqlalchemy import insert
+    from migrations import upgrade
+    from passwords import PasswordHasher
+    from playlist_editor import POSITION_GAP
+
+    audio = write_audio(os.environ['UPLOAD_FOLDER'])
+    # One real hash shared by every user keeps seeding fast and logins honest
+    password_hash = PasswordHasher(workers=0).hash(PASSWORD)
+
+    def rows(items, drop=('audio',)):
+        return [{k: v for k, v in item.items() if k not in drop} for item in items]
+
+    with module.app.app_context():
+        upgrade(module.db.engine, module.db.metadata, echo=lambda message: None)
+        session = module.db.session
+        session.execute(insert(module.User), [{**user, 'password_hash': password_hash} for user in data.users])
+        session.execute(insert(module.Track), [
+            {**track, 'file_path': audio[track['audio']]} for track in rows(data.tracks, ())])
+        session.execute(insert(module.Podcast), [
+            {**podcast, 'file_path': audio[podcast['audio']]} for podcast in rows(data.podcasts, ())])
+        session.execute(insert(module.Playlist), data.playlists)
+        if data.playlist_items:
+            positions = {}
+            entries = []
+            for item in data.playlist_items:
+                positions[item['playlist_id']] = positions.get(item['playlist_id'], 0) + POSITION_GAP
+                entries.append({**item, 'position': positions[item['playlist_id']]})
+            session.execute(insert(module.PlaylistTrack), entries)
+        if data.plays:
+            session.execute(insert(module.RecentlyPlayed), data.plays)
+        # The bulk insert skipped the events that keep playlist summaries
+        module.playlist_editor.refresh()
+        session.commit()
+        module.catalog_search.rebuild()
+    return module
+
+
+def load_simple_app(data, folder):
+    """Write data as simple_app.py's JSON files in folder, make it the
+    working directory and return the imported simple_app module."""
+    write_audio(os.path.join(folder, 'uploads'))
+    with open(os.path.join(folder, 'users.json'), 'w') as f:
+        json.dump([{**user, 'password': PASSWORD, 'is_admin': False} for user in data.users], f)
+    favorites = {}
+    for play in data.plays:
+        if play['track_id'] and play['track_id'] not in favorites.setdefault(str(play['user_id']), []):
+            favorites[str(play['user_id'])].append(play['track_id'])
+    with open(os.path.join(folder, 'content.json'), 'w') as f:
+        json.dump({
+            'tracks': [{'id': t['id'], 'title': t['title'], 'artist': t['artist'], 'type': 'track',
+                        'category': t['category'], 'file_path': f'load{t["audio"]}.mp3'} for t in data.tracks],
+            'podcasts': [{'id': p['id'], 'title': p['title'], 'host': p['host'], 'type': 'podcast',
+                          'category': p['category'], 'file_path': f'load{p["audio"]}.mp3'} for p in data.podcasts],
+            'favorites': favorites,
+        }, f)
+    os.chdir(folder)
+    sys.path.insert(0, BACKEND_DIR)
+    import simple_app as module
+    return module
+
+
+class Reply:
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class ClientTransport:
+    """Requests through Flask's test client: the app's own cost, no sockets."""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None, limit=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers, buffered=False)
+        try:
+            data = bytearray()
+            for chunk in response.response:
+                data += chunk
+                if limit is not None and len(data) >= limit:
+                    break
+            return Reply(response.status_code, response.headers, bytes(data[:limit]))
+        finally:
+            response.close()
+
+
+class HttpTransport:
+    """Requests over HTTP/1.1 keep-alive connections, one per thread."""
+
+    def __init__(self, port, host=HOST):
+        self.host = host
+        self.port = port
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None, limit=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read(limit) if limit is not None else response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self.local.conn = None
+            raise
+        if not response.isclosed():
+            # A listener leaving mid-file: the rest of the body is not wanted
+            conn.close()
+            self.local.conn = None
+        return Reply(response.status, response.headers, data)
+
+
+def start_server(app_name, mode, port, threads, cwd):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, 'serve.py'), '--app', app_name, '--server', mode,
+         '--port', str(port), '--workers', '1', '--threads', str(threads), '--log-level', 'error'],
+        cwd=cwd, env={**os.environ, 'PYTHONPATH': BACKEND_DIR},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            socket.create_connection((HOST, port), timeout=0.2).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f'{app_name} {mode} server did not start')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+class Session:
+    """One simulated client: times each request it makes. Requests made
+    with timed=False (logging in before the scenario) aren't counted."""
+
+    def __init__(self, transport, data, rng):
+        self.transport = transport
+        self.data = data
+        self.rng = rng
+        self.latencies = []
+        self.errors = 0
+        self.token = None
+        self.user_id = None
+
+    def request(self, method, path, body=None, headers=None, limit=None, timed=True):
+        if self.token:
+            headers = {'Authorization': f'Bearer {self.token}', **(headers or {})}
+        start = time.perf_counter()
+        try:
+            reply = self.transport.request(method, path, body, headers, limit)
+        except Exception:
+            reply = None
+        if timed:
+            self.latencies.append(time.perf_counter() - start)
+            if reply is None or reply.status >= 400:
+                self.errors += 1
+        return reply
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, body, **kwargs):
+        return self.request('POST', path, body, **kwargs)
+
+    def log_in(self):
+        if self.token is None:
+            user_id = self.data.user(self.rng)
+            reply = self.post('/login', {'username': f'load{user_id}', 'password': PASSWORD}, timed=False)
+            if reply is None or reply.status != 200:
+                raise RuntimeError(f'Logging in as load{user_id} failed')
+            self.token, self.user_id = reply.json()['token'], user_id
+
+
+def browse(session):
+    data, rng = session.data, session.rng
+    roll = rng.random()
+    if roll < 0.4:
+        # Scroll the mixed catalog a few pages
+        path = '/catalog?limit=20'
+        for _ in range(rng.randint(1, 3)):
+            reply = session.get(path)
+            cursor = reply and reply.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            path = f'/catalog?limit=20&cursor={cursor}'
+    elif roll < 0.7:
+        session.get(f'/tracks?limit=50&category={data.category(rng)}&fields=id,title,artist')
+    elif roll < 0.85:
+        session.get(f'/podcasts?limit=20&category={data.category(rng)}')
+    else:
+        session.get(f'/tracks/{data.track(rng)}/similar?limit=10')
+
+
+def search(session):
+    session.get(f'/search?q={session.data.query(session.rng).replace(" ", "+")}&limit=20')
+
+
+def stream(session):
+    data, rng = session.data, session.rng
+    if rng.random() < 0.2:
+        path = f'/stream/podcast/{data.podcast(rng)}'
+    else:
+        path = f'/stream/track/{data.track(rng)}'
+    session.get(path, headers={'Range': f'bytes=0-{READ_LIMIT - 1}'}, limit=READ_LIMIT)
+    for _ in range(rng.randint(1, 3)):
+        session.get(f'{path}?t={rng.uniform(0, AUDIO_SECONDS - 1):.1f}', limit=READ_LIMIT)
+
+
+def playlist_edit(session):
+    data, rng = session.data, session.rng
+    session.log_in()
+    owned = [p['id'] for p in session.get('/playlists').json()]
+    if not owned or rng.random() < 0.1:
+        owned.append(session.post('/playlists', {'name': f'Mix {rng.randrange(1000)}'}).json()['id'])
+    playlist_id = rng.choice(owned)
+    entries = session.get(f'/playlists/{playlist_id}/tracks').json()
+    # One batch: a few items the playlist doesn't hold yet, and often a move or a removal
+    held = {(entry['type'], entry['id']) for entry in entries}
+    operations = []
+    for _ in range(rng.randint(1, 3)):
+        item = data.item(rng)
+        content = ('track', item['track_id']) if item['track_id'] else ('podcast', item['podcast_id'])
+        if content not in held:
+            held.add(content)
+            operations.append({'op': 'add', f'{content[0]}_id': content[1]})
+    if len(entries) >= 2:
+        moved, anchor = rng.sample(entries, 2)
+        roll = rng.random()
+        if roll < 0.5:
+            operations.append({'op': 'move', 'id': moved['entry_id'], 'before': anchor['entry_id']})
+        elif roll < 0.75:
+            operations.append({'op': 'remove', 'id': moved['entry_id']})
+    if operations:
+        reply = session.request('PATCH', f'/playlists/{playlist_id}/tracks', {'operations': operations})
+        # Two clients logged in as one user can add the same item at once: one is told it's there already
+        if reply is not None and reply.status == 409:
+            session.errors -= 1
+    session.get(f'/playlists/summary?ids={",".join(map(str, owned))}')
+
+
+def listings(session):
+    # The listings whose items are loaded with the rows that list them: a playlist and the play history
+    session.log_in()
+    owned = session.data.user_playlists.get(session.user_id)
+    if owned:
+        session.get(f'/playlists/{session.rng.choice(owned)}/tracks')
+    session.get('/recently-played')
+
+
+def login_storm(session):
+    rng = session.rng
+    user_id = rng.randint(1, len(session.data.users))
+    # One attempt in ten has the wrong password, and is expected to fail
+    wrong = rng.random() < 0.1
+    reply = session.post('/login', {'username': f'load{user_id}', 'password': 'wrong' if wrong else PASSWORD})
+    if reply is not None and (reply.status == 429 or wrong and reply.status == 401):
+        session.errors -= 1
+    if reply is not None and reply.status == 429:
+        # Backpressure: the client waits as told before its next attempt
+        time.sleep(float(reply.headers.get('Retry-After', 1)))
+
+
+def simple_browse(session):
+    session.get('/tracks' if session.rng.random() < 0.8 else '/podcasts')
+
+
+def simple_stream(session):
+    data, rng = session.data, session.rng
+    path = f'/stream/track/{data.track(rng)}'
+    size = int(AUDIO_SECONDS * 16000)
+    for _ in range(rng.randint(2, 4)):
+        # Seeks as byte ranges, the way a player without a seek map does them
+        start = rng.randrange(size - READ_LIMIT)
+        session.get(path, headers={'Range': f'bytes={start}-{start + READ_LIMIT - 1}'}, limit=READ_LIMIT)
+
+
+def simple_favorites(session):
+    data, rng = session.data, session.rng
+    user_id = data.user(rng)
+    session.post(f'/favorites/{user_id}', {'track_id': data.track(rng)})
+    session.get(f'/favorites/{user_id}')
+
+
+SCENARIOS = {
+    'app': {'browse': browse, 'search': search, 'stream': stream,
+            'playlist_edit': playlist_edit, 'listings': listings, 'login_storm': login_storm},
+    'simple_app': {'browse': simple_browse, 'stream': simple_stream,
+                   'playlist_edit': simple_favorites, 'login_storm': login_storm},
+}
+
+
+def percentile(ordered, q):
+    # Nearest rank: the smallest value with at least q of the values at or below it
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def run_scenario(scenario, transport, data, iterations, concurrency, seed, warmup=0):
+    """Run scenario iterations times split over concurrency clients, each
+    with its own seeded random stream, after warmup untimed iterations
+    that fill caches and lazily built indexes."""
+    warm = Session(transport, data, random.Random(f'{seed}-{scenario.__name__}-warmup'))
+    for _ in range(warmup):
+        scenario(warm)
+    sessions = [Session(transport, data, random.Random(f'{seed}-{scenario.__name__}-{n}'))
+                for n in range(concurrency)]
+    counts = [iterations // concurrency + (n < iterations % concurrency) for n in range(concurrency)]
+
+    def worker(session, count):
+        for _ in range(count):
+            scenario(session)
+
+    threads = [threading.Thread(target=worker, args=(s, c)) for s, c in zip(sessions, counts)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    latencies = sorted(latency for session in sessions for latency in session.latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(session.errors for session in sessions),
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_alongside(scenario, transport, data, concurrency, seed):
+    """Start concurrency clients repeating scenario in the background.
+    Returns a function that stops them and reports their requests."""
+    stop = threading.Event()
+    sessions = [Session(transport, data, random.Random(f'{seed}-{scenario.__name__}-alongside-{n}'))
+                for n in range(concurrency)]
+
+    def worker(session):
+        while not stop.is_set():
+            scenario(session)
+
+    threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in threads:
+        thread.start()
+
+    def finish():
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return {'scenario': scenario.__name__, 'concurrency': concurrency,
+                'requests': sum(len(session.latencies) for session in sessions),
+                'errors': sum(session.errors for session in sessions)}
+    return finish
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline: a scenario regresses when
+    its throughput falls, or its p95 latency rises, by more than threshold."""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        if current['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append(f'{name}: throughput {before["throughput"]} -> {current["throughput"]} req/s')
+        if current['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {before["p95_ms"]} -> {current["p95_ms"]} ms')
+        if current['errors'] > before['errors']:
+            regressions.append(f'{name}: errors {before["errors"]} -> {current["errors"]}')
+    return regressions
+
+
+def baseline_path(app_name, target):
+    return os.path.join(BASELINE_DIR, f'{app_name}-{target}.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate load against the backend and report latency.')
+    parser.add_argument('--app', choices=sorted(SCENARIOS), default='app')
+    parser.add_argument('--target', choices=('client', 'asgi', 'wsgi'), default='client',
+                        help='the Flask test client, or a serve.py server in that mode')
+    parser.add_argument('--scenarios', help='comma separated, default all the app has')
+    parser.add_argument('--iterations', type=int, default=200, help='per scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed iterations per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tracks', type=int, default=5000)
+    parser.add_argument('--podcasts', type=int, default=1000)
+    parser.add_argument('--playlist-size', type=int, default=20, help='average items per playlist')
+    parser.add_argument('--alongside', metavar='SCENARIO',
+                        help='repeat this scenario on more clients while the others are measured')
+    parser.add_argument('--alongside-concurrency', type=int, default=16)
+    parser.add_argument('--output', help='write the results here as well as to stdout')
+    parser.add_argument('--save-baseline', nargs='?', const='', metavar='PATH')
+    parser.add_argument('--compare', nargs='?', const='', metavar='PATH')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed regression, as a fraction')
+    args = parser.parse_args(argv)
+
+    scenarios = SCENARIOS[args.app]
+    names = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    unknown = set(names + [args.alongside] if args.alongside else names) - set(scenarios)
+    if unknown:
+        parser.error(f'{args.app} has no scenario {", ".join(sorted(unknown))}')
+
+    folder = tempfile.mkdtemp(prefix='loadgen-')
+    data = Dataset(args.seed, args.users, args.tracks, args.podcasts, playlist_size=args.playlist_size)
+    module = load_app(data, folder) if args.app == 'app' else load_simple_app(data, folder)
+
+    server = None
+    clients = args.concurrency + (args.alongside_concurrency if args.alongside else 0)
+    if args.target == 'client':
+        transport = ClientTransport(module.app)
+    else:
+        port = free_port()
+        server = start_server(args.app, args.target, port, max(clients, 4), folder)
+        transport = HttpTransport(port)
+    stop_alongside = None
+    try:
+        if args.alongside:
+            stop_alongside = run_alongside(scenarios[args.alongside], transport, data,
+                                           args.alongside_concurrency, args.seed)
+        results = {
+            'app': args.app,
+            'target': args.target,
+            'concurrency': args.concurrency,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'data': data.sizes,
+            'machine': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+            'scenarios': {name: run_scenario(scenarios[name], transport, data, args.iterations,
+                                             args.concurrency, args.seed, args.warmup)
+                          for name in names},
+        }
+    finally:
+        alongside = stop_alongside() if stop_alongside else None
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if alongside:
+        results['alongside'] = alongside
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.save_baseline is not None:
+        path = args.save_baseline or baseline_path(args.app, args.target)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    if args.compare is not None:
+        path = args.compare or baseline_path(args.app, args.target)
+        with open(path) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Request instrumentation exported in the Prometheus text format.
+
+    metrics = Metrics()
+    metrics.instrument(app)
+    metrics.watch_engine(db.engine)
+    metrics.add_stats('response_cache', response_cache.stats)
+
+Records per-route latency, SQL statement counts and time, and audio bytes
+streamed. add_stats() sources (caches, pools, queues) are read at scrape
+time. A fraction PROFILE_RATE of requests can be run under a sampling
+profiler that writes collapsed stacks for flamegraph.pl or speedscope.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, request
+
+from streaming import FileBody
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 1.0))
+PROFILE_RATE = float(os.getenv('PROFILE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+
+logger = logging.getLogger(__name__)
+
+# The request being handled on this thread; cheaper to reach than flask.g
+_current = contextvars.ContextVar('request_timer', default=None)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count, as Prometheus expects."""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Callers hold the registry lock
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every interval seconds from a
+    helper thread, so the profiled code runs at full speed."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class _RequestTimer:
+    __slots__ = ('start', 'queries', 'query_seconds', 'profiler')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.profiler = None
+
+
+class Metrics:
+    def __init__(self, profile_rate=PROFILE_RATE, profile_dir=PROFILE_DIR):
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = Counter()
+        self.query_seconds = Counter()
+        self.query_latency = Histogram(QUERY_BUCKETS)
+        self.streamed = Counter()
+        self.stats_sources = {}
+
+    def instrument(self, app, path='/metrics'):
+        """Time every request of app and serve the metrics at path."""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule(path, 'metrics', self.export)
+
+    def watch_engine(self, engine):
+        # Imported here: the JSON-file backends run without SQLAlchemy
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def add_stats(self, name, stats):
+        """Export the numbers in the dict stats() returns as gauges named
+        <name>_<key>, e.g. response_cache_hits."""
+        self.stats_sources[name] = stats
+
+    def _before_request(self):
+        timer = _RequestTimer()
+        if self.profile_rate and random.random() < self.profile_rate:
+            timer.profiler = SamplingProfiler(threading.get_ident()).start()
+        _current.set(timer)
+
+    def _after_request(self, response):
+        timer = _current.get()
+        if timer is None:
+            return response
+        elapsed = time.perf_counter() - timer.start
+        # One lookup through the request proxy instead of one per use
+        req = request._get_current_object()
+        method, endpoint, status = req.method, req.endpoint or 'unmatched', response.status_code
+        with self.lock:
+            self.requests[method, endpoint, status] += 1
+            self.latency[method, endpoint].observe(elapsed)
+            self.queries[endpoint] += timer.queries
+            self.query_seconds[endpoint] += timer.query_seconds
+        if isinstance(response.response, FileBody):
+            # Counted as the body closes: a listener may leave before the end
+            response.response.on_close = lambda body: self._count_streamed(endpoint, body.sent)
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            logger.warning('Slow request', extra={'method': method, 'endpoint': endpoint, 'status': status,
+                                                  'queries': timer.queries, 'seconds': round(elapsed, 3)})
+        return response
+
+    def _teardown_request(self, error=None):
+        timer = _current.get()
+        _current.set(None)
+        if timer is None or timer.profiler is None:
+            return
+        profiler = timer.profiler
+        profiler.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{request.endpoint or "unmatched"}-{os.getpid()}-{id(profiler):x}'
+        path = os.path.join(self.profile_dir, f'{name}.folded')
+        with open(path, 'w') as f:
+            f.write(profiler.folded())
+        logger.info('Request profiled', extra={'endpoint': request.endpoint, 'path': path,
+                                               'samples': sum(profiler.stacks.values())})
+
+    def _count_streamed(self, endpoint, sent):
+        with self.lock:
+            self.streamed[endpoint] += sent
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context.metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.metrics_start
+        with self.lock:
+            self.query_latency.observe(elapsed)
+        # Background threads (play flushes, rebuilds) only reach the histogram
+        timer = _current.get()
+        if timer is not None:
+            timer.queries += 1
+            timer.query_seconds += elapsed
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+
+        with self.lock:
+            family('http_requests_total', 'counter', 'Requests handled.', (
+                f'http_requests_total{_labels((("method", m), ("endpoint", e), ("status", s)))} {n}'
+                for (m, e, s), n in sorted(self.requests.items())))
+            family('http_request_duration_seconds', 'histogram', 'Time to produce a response.', (
+                line for (m, e), histogram in sorted(self.latency.items())
+                for line in histogram.samples('http_request_duration_seconds', (('method', m), ('endpoint', e)))))
+            family('db_queries_total', 'counter', 'SQL statements run while handling requests.', (
+                f'db_queries_total{_labels((("endpoint", e),))} {n}' for e, n in sorted(self.queries.items())))
+            family('db_query_seconds_total', 'counter', 'Time spent in SQL while handling requests.', (
+                f'db_query_seconds_total{_labels((("endpoint", e),))} {_number(n)}'
+                for e, n in sorted(self.query_seconds.items())))
+            family('db_query_duration_seconds', 'histogram', 'Time per SQL statement, from any thread.',
+                   list(self.query_latency.samples('db_query_duration_seconds', ())))
+            family('stream_bytes_total', 'counter', 'Audio bytes sent to clients.', (
+                f'stream_bytes_total{_labels((("endpoint", e),))} {n}' for e, n in sorted(self.streamed.items())))
+
+        for source, stats in self.stats_sources.items():
+            try:
+                values = stats()
+            except Exception:
+                logger.exception('Reading %s stats failed', source)
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    family(f'{source}_{key}', 'gauge', f'{source} {key}.', [f'{source}_{key} {_number(value)}'])
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
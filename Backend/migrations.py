@@ -0,0 +1,294 @@
+"""Versioned schema migrations.
+
+Each migration is a function decorated with @migration(version,
+description) that receives a Connection inside its own transaction.
+Applied versions are recorded in the schema_migrations table. A database
+with none of the app's tables is built with create_all() from the models
+and stamped with every version instead. Migrations therefore check before
+they change anything, so they also run cleanly against tables create_all()
+built from newer models.
+
+    flask --app app db-upgrade
+    flask --app app db-version
+"""
+from datetime import datetime
+
+from sqlalchemy import (CheckConstraint, Column, DateTime, Integer, MetaData, String, Table, create_engine, event,
+                        inspect, select, text)
+from sqlalchemy.pool import NullPool
+
+from playlist_editor import POSITION_GAP
+
+MIGRATIONS = []
+
+version_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', version_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def head():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def _migration_engine(engine):
+    url = engine.url
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return engine
+    # pysqlite commits DDL on its own; take over BEGIN so each migration is one transaction,
+    # and keep foreign keys off so rebuilding a parent table doesn't cascade into its children
+    migration_engine = create_engine(url, poolclass=NullPool)
+
+    @event.listens_for(migration_engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute('PRAGMA foreign_keys=OFF')
+
+    @event.listens_for(migration_engine, 'begin')
+    def begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return migration_engine
+
+
+def applied_versions(connection):
+    if not inspect(connection).has_table('schema_migrations'):
+        return set()
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def _record(connection, version, description):
+    connection.execute(schema_migrations.insert().values(
+        version=version, description=description, applied_at=datetime.utcnow()))
+
+
+def upgrade(engine, metadata, target=None, echo=print):
+    """Apply pending migrations up to target (default: all). Returns the
+    versions applied."""
+    target = head() if target is None else target
+    migration_engine = _migration_engine(engine)
+    applied = []
+    try:
+        with migration_engine.begin() as conn:
+            version_metadata.create_all(conn)
+            existing = set(inspect(conn).get_table_names())
+            if not existing & set(metadata.tables):
+                metadata.create_all(conn)
+                for version, description, fn in MIGRATIONS:
+                    if version <= target:
+                        _record(conn, version, description)
+                echo(f'Created schema at version {target}')
+                return applied
+            done = applied_versions(conn)
+
+        for version, description, fn in MIGRATIONS:
+            if version in done or version > target:
+                continue
+            with migration_engine.begin() as conn:
+                violations = _foreign_key_violations(conn)
+                fn(conn)
+                added = _foreign_key_violations(conn) - violations
+                if added:
+                    raise RuntimeError(f'Migration {version} left foreign key violations: {sorted(added)[:10]}')
+                _record(conn, version, description)
+            applied.append(version)
+            echo(f'Applied {version:04d} {description}')
+    finally:
+        if migration_engine is not engine:
+            migration_engine.dispose()
+            # Pooled SQLite connections opened before the upgrade can keep planning against the old schema
+            engine.dispose()
+    return applied
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def _foreign_key_violations(conn):
+    # Foreign keys are off while migrating SQLite, so rebuilt tables are checked by hand
+    if conn.dialect.name != 'sqlite':
+        return set()
+    return {tuple(row) for row in conn.exec_driver_sql('PRAGMA foreign_key_check')}
+
+
+def create_index(conn, table, name, *columns, unique=False):
+    if name not in {index['name'] for index in inspect(conn).get_indexes(table)}:
+        conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX {name} ON {table} ({", ".join(columns)})'))
+
+
+def drop_index(conn, table, name):
+    if name in {index['name'] for index in inspect(conn).get_indexes(table)}:
+        conn.execute(text(f'DROP INDEX {name}'))
+
+
+def add_column(conn, table, name, definition):
+    """Add the column unless the table has it. Returns whether it was added."""
+    if name in {column['name'] for column in inspect(conn).get_columns(table)}:
+        return False
+    conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {definition}'))
+    return True
+
+
+def set_on_delete(conn, table_name, ondelete):
+    """Give the foreign keys on the named columns an ON DELETE action.
+    ondelete maps column name to action, e.g. {'user_id': 'CASCADE'}."""
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    constraints = [
+        fk for fk in table.foreign_key_constraints
+        if len(fk.column_keys) == 1 and fk.column_keys[0] in ondelete
+        and (fk.ondelete or '').upper() != ondelete[fk.column_keys[0]]
+    ]
+    if not constraints:
+        return
+
+    if conn.dialect.name != 'sqlite':
+        for fk in constraints:
+            column = fk.column_keys[0]
+            name = fk.name or f'fk_{table_name}_{column}'
+            referred = fk.elements[0].column
+            if fk.name:
+                conn.execute(text(f'ALTER TABLE {table_name} DROP CONSTRAINT {fk.name}'))
+            conn.execute(text(
+                f'ALTER TABLE {table_name} ADD CONSTRAINT {name} FOREIGN KEY ({column}) '
+                f'REFERENCES {referred.table.name} ({referred.name}) ON DELETE {ondelete[column]}'
+            ))
+        return
+
+    for fk in constraints:
+        fk.ondelete = ondelete[fk.column_keys[0]]
+    rebuild_table(conn, table)
+
+
+def add_check(conn, table_name, name, condition):
+    if name in {check['name'] for check in inspect(conn).get_check_constraints(table_name)}:
+        return
+    if conn.dialect.name != 'sqlite':
+        conn.execute(text(f'ALTER TABLE {table_name} ADD CONSTRAINT {name} CHECK ({condition})'))
+        return
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    table.append_constraint(CheckConstraint(text(condition), name=name))
+    rebuild_table(conn, table)
+
+
+def rebuild_table(conn, table):
+    """Recreate a reflected SQLite table from its (changed) definition.
+    SQLite can't alter constraints: copy into a rebuilt table and swap it in."""
+    table_name = table.name
+    rebuilt = table.to_metadata(table.metadata, name=f'{table_name}__rebuild')
+    for index in list(rebuilt.indexes):
+        rebuilt.indexes.discard(index)
+    rebuilt.create(conn)
+    columns = ', '.join(c.name for c in table.columns)
+    conn.execute(text(f'INSERT INTO {rebuilt.name} ({columns}) SELECT {columns} FROM {table_name}'))
+    conn.execute(text(f'DROP TABLE {table_name}'))
+    conn.execute(text(f'ALTER TABLE {rebuilt.name} RENAME TO {table_name}'))
+    for index in table.indexes:
+        index.create(conn)
+
+
+@migration(1, 'Add indexes for hot query columns')
+def add_hot_query_indexes(conn):
+    create_index(conn, 'playlists', 'ix_playlists_user_id', 'user_id')
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_playlist_id', 'playlist_id')
+    create_index(conn, 'recently_played', 'ix_recently_played_user_id_played_at', 'user_id', 'played_at')
+    for table in ('tracks', 'podcasts'):
+        create_index(conn, table, f'ix_{table}_created_at_id', 'created_at', 'id')
+        create_index(conn, table, f'ix_{table}_category_created_at_id', 'category', 'created_at', 'id')
+
+
+@migration(2, 'Cascade deletes along foreign keys')
+def cascade_deletes(conn):
+    # Rows left behind by earlier deletes would fail the new constraints
+    for table in ('playlist_tracks', 'recently_played'):
+        conn.execute(text(
+            f'DELETE FROM {table} WHERE (track_id IS NOT NULL AND track_id NOT IN (SELECT id FROM tracks)) '
+            f'OR (podcast_id IS NOT NULL AND podcast_id NOT IN (SELECT id FROM podcasts))'
+        ))
+    conn.execute(text('DELETE FROM recently_played WHERE user_id NOT IN (SELECT id FROM users)'))
+    conn.execute(text('DELETE FROM playlists WHERE user_id NOT IN (SELECT id FROM users)'))
+    conn.execute(text('DELETE FROM playlist_tracks WHERE playlist_id NOT IN (SELECT id FROM playlists)'))
+
+    set_on_delete(conn, 'playlists', {'user_id': 'CASCADE'})
+    set_on_delete(conn, 'playlist_tracks', {'playlist_id': 'CASCADE', 'track_id': 'CASCADE', 'podcast_id': 'CASCADE'})
+    set_on_delete(conn, 'recently_played', {'user_id': 'CASCADE', 'track_id': 'CASCADE', 'podcast_id': 'CASCADE'})
+
+    # A cascading delete looks up the child rows by these columns
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_track_id', 'track_id')
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_podcast_id', 'podcast_id')
+    create_index(conn, 'recently_played', 'ix_recently_played_track_id', 'track_id')
+    create_index(conn, 'recently_played', 'ix_recently_played_podcast_id', 'podcast_id')
+
+
+@migration(3, 'Point playlist entries and plays at exactly one item')
+def one_content_reference(conn):
+    # Rows naming both a track and a podcast become one row for each; rows naming neither are dropped
+    for table_name in ('playlist_tracks', 'recently_played'):
+        columns = [c.name for c in Table(table_name, MetaData(), autoload_with=conn).columns if c.name != 'id']
+        both = 'track_id IS NOT NULL AND podcast_id IS NOT NULL'
+        copied = ', '.join('NULL' if c == 'track_id' else c for c in columns)
+        conn.execute(text(f'INSERT INTO {table_name} ({", ".join(columns)}) SELECT {copied} FROM {table_name} WHERE {both}'))
+        conn.execute(text(f'UPDATE {table_name} SET podcast_id = NULL WHERE {both}'))
+        conn.execute(text(f'DELETE FROM {table_name} WHERE track_id IS NULL AND podcast_id IS NULL'))
+        add_check(conn, table_name, f'ck_{table_name}_one_content', '(track_id IS NULL) <> (podcast_id IS NULL)')
+
+
+@migration(4, 'Add hourly play counts for charts')
+def add_play_counts(conn):
+    play_counts = Table(
+        'play_counts', MetaData(),
+        Column('hour', Integer, primary_key=True),
+        Column('content_type', String(20), primary_key=True),
+        Column('content_id', Integer, primary_key=True),
+        Column('plays', Integer, nullable=False),
+    )
+    play_counts.create(conn, checkfirst=True)
+    create_index(conn, 'play_counts', 'ix_play_counts_content', 'content_type', 'content_id')
+
+
+@migration(5, 'Order playlist entries and keep playlist summaries')
+def order_playlist_entries(conn):
+    if add_column(conn, 'playlist_tracks', 'position', 'BIGINT NOT NULL DEFAULT 0'):
+        # Entries keep the order they were added in
+        positions, last = [], {}
+        for entry_id, playlist_id in conn.execute(text('SELECT id, playlist_id FROM playlist_tracks ORDER BY id')):
+            last[playlist_id] = last.get(playlist_id, 0) + POSITION_GAP
+            positions.append({'id': entry_id, 'position': last[playlist_id]})
+        if positions:
+            conn.execute(text('UPDATE playlist_tracks SET position = :position WHERE id = :id'), positions)
+    add_column(conn, 'playlists', 'item_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'playlists', 'total_duration', 'INTEGER NOT NULL DEFAULT 0')
+
+    # A playlist holds an item once: later copies of it go
+    conn.execute(text(
+        'DELETE FROM playlist_tracks WHERE id NOT IN '
+        '(SELECT MIN(id) FROM playlist_tracks GROUP BY playlist_id, track_id, podcast_id)'
+    ))
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_playlist_id_position', 'playlist_id', 'position')
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_playlist_id_track_id', 'playlist_id', 'track_id',
+                 unique=True)
+    create_index(conn, 'playlist_tracks', 'ix_playlist_tracks_playlist_id_podcast_id', 'playlist_id', 'podcast_id',
+                 unique=True)
+    drop_index(conn, 'playlist_tracks', 'ix_playlist_tracks_playlist_id')
+
+    conn.execute(text(
+        'UPDATE playlists SET '
+        'item_count = (SELECT COUNT(*) FROM playlist_tracks WHERE playlist_id = playlists.id), '
+        'total_duration = '
+        '(SELECT COALESCE(SUM(tracks.duration), 0) FROM playlist_tracks JOIN tracks ON tracks.id = track_id '
+        'WHERE playlist_id = playlists.id) + '
+        '(SELECT COALESCE(SUM(podcasts.duration), 0) FROM playlist_tracks JOIN podcasts ON podcasts.id = podcast_id '
+        'WHERE playlist_id = playlists.id)'
+    ))
@@ -0,0 +1,118 @@
+from datetime import datetime
+
+from flask_sqlalchemy import SQLAlchemy
+
+from db_config import ReplicaSession
+
+# Bound to an app by create_app(); the models need no app to import
+db = SQLAlchemy(session_options={'class_': ReplicaSession})
+
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
+    is_admin = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Track(db.Model):
+    __tablename__ = 'tracks'
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    artist = db.Column(db.String(200), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    duration = db.Column(db.Integer)
+    category = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_tracks_created_at_id', 'created_at', 'id'),
+        db.Index('ix_tracks_category_created_at_id', 'category', 'created_at', 'id'),
+    )
+
+class Podcast(db.Model):
+    __tablename__ = 'podcasts'
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    host = db.Column(db.String(200), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)
+    duration = db.Column(db.Integer)
+    podcast_name = db.Column(db.String(200), nullable=False)
+    category = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_podcasts_created_at_id', 'created_at', 'id'),
+        db.Index('ix_podcasts_category_created_at_id', 'category', 'created_at', 'id'),
+    )
+
+class Playlist(db.Model):
+    __tablename__ = 'playlists'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Kept current by playlist_editor.PlaylistEditor.watch()
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_duration = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    __table_args__ = (
+        db.Index('ix_playlists_user_id', 'user_id'),
+    )
+
+class PlaylistTrack(db.Model):
+    __tablename__ = 'playlist_tracks'
+    id = db.Column(db.Integer, primary_key=True)
+    playlist_id = db.Column(db.Integer, db.ForeignKey('playlists.id', ondelete='CASCADE'), nullable=False)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id', ondelete='CASCADE'))
+    podcast_id = db.Column(db.Integer, db.ForeignKey('podcasts.id', ondelete='CASCADE'))
+    # Sparse: entries are GAP apart, see playlist_editor.py. Unset, an entry goes to the end
+    position = db.Column(db.BigInteger, nullable=False, server_default='0')
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    track = db.relationship('Track')
+    podcast = db.relationship('Podcast')
+    __table_args__ = (
+        db.CheckConstraint('(track_id IS NULL) <> (podcast_id IS NULL)', name='ck_playlist_tracks_one_content'),
+        db.Index('ix_playlist_tracks_playlist_id_position', 'playlist_id', 'position'),
+        db.Index('ix_playlist_tracks_playlist_id_track_id', 'playlist_id', 'track_id', unique=True),
+        db.Index('ix_playlist_tracks_playlist_id_podcast_id', 'playlist_id', 'podcast_id', unique=True),
+        db.Index('ix_playlist_tracks_track_id', 'track_id'),
+        db.Index('ix_playlist_tracks_podcast_id', 'podcast_id'),
+    )
+
+class RecentlyPlayed(db.Model):
+    __tablename__ = 'recently_played'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id', ondelete='CASCADE'))
+    podcast_id = db.Column(db.Integer, db.ForeignKey('podcasts.id', ondelete='CASCADE'))
+    played_at = db.Column(db.DateTime, default=datetime.utcnow)
+    track = db.relationship('Track')
+    podcast = db.relationship('Podcast')
+    __table_args__ = (
+        db.CheckConstraint('(track_id IS NULL) <> (podcast_id IS NULL)', name='ck_recently_played_one_content'),
+        db.Index('ix_recently_played_user_id_played_at', 'user_id', 'played_at'),
+        db.Index('ix_recently_played_track_id', 'track_id'),
+        db.Index('ix_recently_played_podcast_id', 'podcast_id'),
+    )
+
+class PlayCount(db.Model):
+    # Plays per item per hour, added to by every process; see charts.py
+    __tablename__ = 'play_counts'
+    hour = db.Column(db.Integer, primary_key=True)  # hours since the epoch
+    content_type = db.Column(db.String(20), primary_key=True)
+    content_id = db.Column(db.Integer, primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        # Deleting content deletes its counts
+        db.Index('ix_play_counts_content', 'content_type', 'content_id'),
+    )
+
+CATALOG_MODELS = {'track': Track, 'podcast': Podcast}
+
+TRACK_FIELDS = {
+    'id': Track.id, 'title': Track.title, 'artist': Track.artist,
+    'duration': Track.duration, 'category': Track.category,
+}
+PODCAST_FIELDS = {
+    'id': Podcast.id, 'title': Podcast.title, 'host': Podcast.host, 'duration': Podcast.duration,
+    'podcast_name': Podcast.podcast_name, 'category': Podcast.category,
+}
@@ -0,0 +1,54 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+EXPORT_BATCH = 1000
+
+
+def encode_cursor(created_at, row_id):
+    raw = f'{created_at.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+
+def after_cursor(created_col, id_col, cursor):
+    created_at, row_id = decode_cursor(cursor)
+    return or_(created_col > created_at, and_(created_col == created_at, id_col > row_id))
+
+
+def parse_fields(value, available):
+    """Columns named in a comma-separated fields= value, or all of them."""
+    if not value:
+        return list(available)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+def stream_json_array(rows, to_dict):
+    """Write a JSON array one element at a time so memory stays flat."""
+    def generate():
+        yield '['
+        first = True
+        for row in rows:
+            if not first:
+                yield ','
+            first = False
+            yield json.dumps(to_dict(row), separators=(',', ':'))
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,109 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+HASH_QUEUE_DEPTH = int(os.getenv('PASSWORD_HASH_QUEUE', max(HASH_WORKERS, 1) * 4))
+HASH_NICE = int(os.getenv('PASSWORD_HASH_NICE', 5))
+# Forking a worker that already runs request threads can copy a lock another thread holds and
+# deadlock; a forkserver child starts clean. Entry scripts guard __main__, so re-importing is safe.
+START_METHOD = os.getenv('PASSWORD_HASH_START_METHOD',
+                         'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+class HasherBusy(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Password hashing queue is full, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+def _lower_priority(nice):
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+
+
+class PasswordHasher:
+    """Runs werkzeug's password hashing in a small process pool so a burst
+    of logins holds at most `workers` cores, at a lower priority, instead of
+    one per request thread.
+
+    At most queue_depth hashes may be running or waiting. Beyond that calls
+    raise HasherBusy with a Retry-After estimate from the average hash time.
+    With workers=0 hashes run on the calling thread, still behind the same
+    limit.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, queue_depth=HASH_QUEUE_DEPTH, method=HASH_METHOD,
+                 salt_length=SALT_LENGTH, nice=HASH_NICE, start_method=START_METHOD):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.method = method
+        self.salt_length = salt_length
+        self.nice = nice
+        self.start_method = start_method
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.average = 0.1
+        self.completed = 0
+        self.rejected = 0
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def _pool(self):
+        # Created on first use in each process: a pool inherited over fork has no manager thread
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    context.set_forkserver_preload(['werkzeug.security'])
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context,
+                                                    initializer=_lower_priority, initargs=(self.nice,))
+                self.pid = os.getpid()
+            return self.executor
+
+    def _run(self, fn, *args):
+        with self.lock:
+            if self.inflight >= self.queue_depth:
+                self.rejected += 1
+                raise HasherBusy(self.retry_after())
+            self.inflight += 1
+        start = time.monotonic()
+        try:
+            if not self.workers:
+                return fn(*args)
+            try:
+                return self._pool().submit(fn, *args).result()
+            except BrokenProcessPool:
+                with self.lock:
+                    self.executor = None
+                raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.inflight -= 1
+                self.completed += 1
+                self.average += (elapsed - self.average) * 0.1
+
+    def retry_after(self):
+        return max(1, math.ceil(self.inflight * self.average / max(self.workers, 1)))
+
+    def stats(self):
+        return {'workers': self.workers, 'queue_depth': self.queue_depth, 'inflight': self.inflight,
+                'completed': self.completed, 'rejected': self.rejected,
+                'average_ms': round(self.average * 1000, 1)}
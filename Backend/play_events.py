@@ -0,0 +1,120 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+FLUSH_SIZE = int(os.getenv('PLAY_FLUSH_SIZE', 500))
+FLUSH_SECONDS = float(os.getenv('PLAY_FLUSH_SECONDS', 2))
+MAX_PENDING = int(os.getenv('PLAY_MAX_PENDING', 50000))
+RETENTION = int(os.getenv('RECENTLY_PLAYED_RETENTION', 100))
+
+logger = logging.getLogger(__name__)
+
+
+class PlayBuffer:
+    """Write-behind buffer for play events.
+
+    Events are keyed by (user_id, track_id, podcast_id), so replaying the
+    same item before a flush only moves its played_at forward. The buffer is
+    handed to write(events) once it holds flush_size events, when the oldest
+    one is flush_seconds old, and at interpreter exit. A failed write puts
+    the events back, dropping the oldest beyond max_pending.
+    """
+
+    def __init__(self, write, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS, max_pending=MAX_PENDING):
+        self.write = write
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.users = Counter()
+        self.oldest = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.flushed = 0
+        self.coalesced = 0
+        atexit.register(self.close)
+
+    def add(self, user_id, track_id=None, podcast_id=None, played_at=None):
+        key = (user_id, track_id, podcast_id)
+        with self.lock:
+            if key in self.pending:
+                self.coalesced += 1
+                self.pending.move_to_end(key)
+            else:
+                self.users[user_id] += 1
+                if self.oldest is None:
+                    self.oldest = time.monotonic()
+            self.pending[key] = played_at
+            full = len(self.pending) >= self.flush_size
+        self._start()
+        if full:
+            self.flush()
+
+    def sync(self, user_id):
+        """Write out user_id's buffered plays, or wait for a flush that may
+        be carrying them, so a read that follows sees them. Returns whether
+        anything may have been written."""
+        with self.lock:
+            pending = user_id in self.users
+        if pending or self.flush_lock.locked():
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                batch, self.pending, self.oldest = self.pending, OrderedDict(), None
+                self.users.clear()
+            events = [
+                {'user_id': user_id, 'track_id': track_id, 'podcast_id': podcast_id, 'played_at': played_at}
+                for (user_id, track_id, podcast_id), played_at in batch.items()
+            ]
+            try:
+                self.write(events)
+            except Exception:
+                logger.exception('Writing %d play events failed; keeping them for the next flush', len(events))
+                self._requeue(batch)
+                return 0
+            self.flushed += len(events)
+            return len(events)
+
+    def _requeue(self, batch):
+        with self.lock:
+            for key, played_at in self.pending.items():
+                batch[key] = played_at
+                batch.move_to_end(key)
+            while len(batch) > self.max_pending:
+                batch.popitem(last=False)
+            self.pending = batch
+            self.users = Counter(key[0] for key in batch)
+            self.oldest = time.monotonic()
+
+    def _start(self):
+        if self.thread is None and self.flush_seconds > 0:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='play-flush', daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_seconds / 4):
+            oldest = self.oldest
+            if oldest is not None and time.monotonic() - oldest >= self.flush_seconds:
+                self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.pending)
+        return {'pending': pending, 'flushed': self.flushed, 'coalesced': self.coalesced}
@@ -0,0 +1,308 @@
+"""Ordered playlists, edited in batches, with their summaries kept current.
+
+Entries are ordered by an integer position. Positions are handed out GAP
+apart, so adding an entry between two others takes the midpoint of their
+positions and moving one rewrites that row alone. Only when two
+neighbours have no integer left between them is the playlist renumbered;
+with the default gap that takes 16 inserts at the same spot.
+
+Each playlist row keeps item_count and total_duration. watch() updates
+them in the flush that adds or removes entries, and when content changes
+duration or is deleted. Bulk statements skip the mapper events: refresh()
+recounts.
+"""
+import functools
+import os
+from collections import defaultdict
+
+from sqlalchemy import and_, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session, object_session
+
+POSITION_GAP = int(os.getenv('PLAYLIST_POSITION_GAP', 1 << 16))
+MAX_OPERATIONS = int(os.getenv('PLAYLIST_MAX_OPERATIONS', 500))
+
+
+class PlaylistError(ValueError):
+    """An operation that can't be applied; the batch it was in is rolled back."""
+    status = 400
+
+
+class PlaylistConflict(PlaylistError):
+    status = 409
+
+
+class PlaylistEditor:
+    """Applies add, remove and move operations to the entries (entry model
+    rows) of playlists (playlist model rows).
+
+    arms maps a content type to (content model, entry column pointing at it).
+    """
+
+    def __init__(self, db, playlist, entry, arms, gap=POSITION_GAP):
+        self.db = db
+        self.playlist = playlist
+        self.entry = entry
+        self.arms = arms
+        self.gap = gap
+
+    def apply(self, playlist_id, operations):
+        """Apply operations in order within the session's transaction,
+        flushing but not committing. Each is one of
+
+            {'op': 'add', 'track_id' | 'podcast_id': id, 'before' | 'after': entry id}
+            {'op': 'remove', 'id': entry id}
+            {'op': 'move', 'id': entry id, 'before' | 'after': entry id}
+
+        and an add or move naming neither 'before' nor 'after' goes to the
+        end. Returns {'added': [new entry ids], 'removed': n, 'moved': n}."""
+        if not isinstance(operations, list) or not operations:
+            raise PlaylistError('operations must be a non-empty list')
+        if len(operations) > MAX_OPERATIONS:
+            raise PlaylistError(f'At most {MAX_OPERATIONS} operations per request')
+        operations = [self._parse(op) for op in operations]
+        session = self.db.session
+        present = self._check_content(playlist_id, [op['content'] for op in operations if op['op'] == 'add'])
+        # Entries the batch names are loaded at once, and held: the session keeps them only while something does
+        named = {op['id'] for op in operations if 'id' in op} | {op['anchor'][1] for op in operations if op['anchor']}
+        loaded = {entry.id: entry for entry in session.scalars(select(self.entry).where(
+            self.entry.playlist_id == playlist_id, self.entry.id.in_(named)))} if named else {}
+
+        added, removed, moved = [], 0, 0
+        tail = None
+        for op in operations:
+            if op['op'] == 'remove':
+                entry = self._entry(playlist_id, op['id'], loaded)
+                present.discard(self._content_of(entry))
+                session.delete(entry)
+                removed += 1
+                continue
+
+            if op['op'] == 'add':
+                if op['content'] in present:
+                    raise PlaylistConflict(f'{op["content"][0].title()} {op["content"][1]} is already in the playlist')
+                present.add(op['content'])
+                entry = self.entry(playlist_id=playlist_id, **{self.arms[op['content'][0]][1].key: op['content'][1]})
+                added.append(entry)
+            else:
+                entry = self._entry(playlist_id, op['id'], loaded)
+                moved += 1
+
+            if op['anchor'] is None:
+                # Appends in a row need only the first lookup of the end
+                tail = (self._last_position(playlist_id) if tail is None else tail) + self.gap
+                entry.position = tail
+            else:
+                if op['anchor'][1] == getattr(entry, 'id', None):
+                    raise PlaylistError('An entry can not be moved next to itself')
+                entry.position, renumbered = self._position_by(playlist_id, *op['anchor'], moving=entry,
+                                                               loaded=loaded)
+                if renumbered:
+                    tail = None
+            session.add(entry)
+        session.flush()
+        return {'added': [entry.id for entry in added], 'removed': removed, 'moved': moved}
+
+    def _parse(self, op):
+        if not isinstance(op, dict) or op.get('op') not in ('add', 'remove', 'move'):
+            raise PlaylistError('Each operation needs an op of add, remove or move')
+        parsed = {'op': op['op'], 'anchor': None}
+        if op['op'] == 'add':
+            named = [(content_type, op[column.key]) for content_type, (_, column) in self.arms.items()
+                     if op.get(column.key) is not None]
+            if len(named) != 1:
+                keys = ' and '.join(column.key for _, column in self.arms.values())
+                raise PlaylistError(f'Exactly one of {keys} is required')
+            parsed['content'] = named[0][0], _id(named[0][1], 'content')
+        else:
+            parsed['id'] = _id(op.get('id'), 'id')
+        if op['op'] != 'remove':
+            sides = [side for side in ('before', 'after') if op.get(side) is not None]
+            if len(sides) > 1:
+                raise PlaylistError('Give at most one of before and after')
+            if sides:
+                parsed['anchor'] = sides[0], _id(op[sides[0]], sides[0])
+        return parsed
+
+    def _check_content(self, playlist_id, contents):
+        # Everything a batch adds is looked up at once: that it exists, its duration for the
+        # summary, and whether the playlist holds it already
+        wanted = defaultdict(set)
+        for content_type, content_id in contents:
+            wanted[content_type].add(content_id)
+        present = set()
+        session = self.db.session
+        durations = session.info.setdefault('playlist_durations', {})
+        for content_type, ids in wanted.items():
+            model, column = self.arms[content_type]
+            found = dict(session.execute(select(model.id, model.duration).where(model.id.in_(ids))).all())
+            durations.update(((content_type, content_id), duration or 0) for content_id, duration in found.items())
+            missing = ids - set(found)
+            if missing:
+                raise PlaylistError(f'No {content_type} with id {min(missing)}')
+            present.update((content_type, content_id) for content_id in session.scalars(
+                select(column).where(self.entry.playlist_id == playlist_id, column.in_(ids))))
+        return present
+
+    def _entry(self, playlist_id, entry_id, loaded):
+        entry = loaded.get(entry_id) or self.db.session.get(self.entry, entry_id)
+        if entry is None or entry in self.db.session.deleted or entry.playlist_id != playlist_id:
+            raise PlaylistError(f'No entry {entry_id} in this playlist')
+        return entry
+
+    def _content_of(self, entry):
+        for content_type, (_, column) in self.arms.items():
+            if getattr(entry, column.key) is not None:
+                return content_type, getattr(entry, column.key)
+
+    def _last_position(self, playlist_id):
+        return self.db.session.scalar(
+            select(func.max(self.entry.position)).where(self.entry.playlist_id == playlist_id)) or 0
+
+    def _position_by(self, playlist_id, side, anchor_id, moving, loaded):
+        """A free position just before or after the anchor entry, and
+        whether the playlist had to be renumbered to find one."""
+        for renumbered in (False, True):
+            anchor = self._entry(playlist_id, anchor_id, loaded)
+            neighbour = self._neighbour(playlist_id, anchor, side, getattr(moving, 'id', None))
+            if neighbour is None:
+                return anchor.position + (self.gap if side == 'after' else -self.gap), renumbered
+            low, high = sorted((anchor.position, neighbour))
+            if high - low >= 2:
+                return (low + high) // 2, renumbered
+            self.renumber(playlist_id)
+        raise PlaylistError('No room left in the playlist')  # a gap of 1 would get here
+
+    def _neighbour(self, playlist_id, anchor, side, moving_id):
+        # Entries sharing a position are ordered by id, as the listing orders them
+        entry = self.entry
+        if side == 'before':
+            beyond = or_(entry.position < anchor.position, and_(entry.position == anchor.position, entry.id < anchor.id))
+            order = (entry.position.desc(), entry.id.desc())
+        else:
+            beyond = or_(entry.position > anchor.position, and_(entry.position == anchor.position, entry.id > anchor.id))
+            order = (entry.position, entry.id)
+        return self.db.session.scalar(select(entry.position).where(
+            entry.playlist_id == playlist_id, beyond, entry.id != moving_id).order_by(*order).limit(1))
+
+    def renumber(self, playlist_id):
+        """Space the playlist's entries gap apart again, keeping their order."""
+        entry, session = self.entry, self.db.session
+        ids = session.scalars(select(entry.id).where(entry.playlist_id == playlist_id)
+                              .order_by(entry.position, entry.id)).all()
+        session.execute(update(entry), [{'id': entry_id, 'position': (n + 1) * self.gap}
+                                        for n, entry_id in enumerate(ids)])
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, entry) and obj.playlist_id == playlist_id:
+                session.expire(obj, ['position'])
+
+    def summaries(self, user_id, playlist_ids=None):
+        """id, name, item_count and total_duration of the user's playlists
+        (those of playlist_ids only, if given), in one query."""
+        playlist = self.playlist
+        stmt = select(playlist.id, playlist.name, playlist.item_count, playlist.total_duration).where(
+            playlist.user_id == user_id).order_by(playlist.id)
+        if playlist_ids is not None:
+            stmt = stmt.where(playlist.id.in_(playlist_ids))
+        return [row._asdict() for row in self.db.session.execute(stmt)]
+
+    def refresh(self, playlist_ids=None):
+        """Recount item_count and total_duration from the entries, for
+        playlist_ids (ids or a SELECT of them) or every playlist."""
+        playlist, entry = self.playlist, self.entry
+        count = select(func.count()).where(entry.playlist_id == playlist.id).scalar_subquery()
+        duration = sum(
+            select(func.coalesce(func.sum(model.duration), 0)).select_from(entry)
+            .join(model, model.id == column).where(entry.playlist_id == playlist.id).scalar_subquery()
+            for model, column in self.arms.values()
+        )
+        stmt = update(playlist).values(item_count=count, total_duration=duration)
+        if playlist_ids is not None:
+            stmt = stmt.where(playlist.id.in_(playlist_ids))
+        self.db.session.execute(stmt.execution_options(synchronize_session=False))
+
+    def watch(self):
+        """Keep the summaries current through mapper events: entries added
+        or removed are counted when their flush ends, content changes in
+        the statement that makes them."""
+        event.listen(self.entry, 'before_insert', self._before_insert)
+        event.listen(self.entry, 'after_insert', functools.partial(self._entry_changed, 1))
+        event.listen(self.entry, 'after_delete', functools.partial(self._entry_changed, -1))
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._forget)
+        event.listen(Session, 'after_rollback', self._forget)
+        for content_type, (model, column) in self.arms.items():
+            event.listen(model, 'after_update', functools.partial(self._duration_changed, content_type, column))
+            event.listen(model, 'before_delete', functools.partial(self._content_deleted, content_type, column))
+
+    def _before_insert(self, mapper, connection, target):
+        # Entries added without a position go to the end
+        if target.position is None:
+            tails = object_session(target).info.setdefault('playlist_tails', {})
+            last = tails.get(target.playlist_id)
+            if last is None:
+                last = connection.scalar(select(func.max(self.entry.position))
+                                         .where(self.entry.playlist_id == target.playlist_id)) or 0
+            target.position = tails[target.playlist_id] = last + self.gap
+
+    def _entry_changed(self, sign, mapper, connection, target):
+        changes = object_session(target).info.setdefault('playlist_changes', [])
+        changes.append((sign, target.playlist_id, self._content_of(target)))
+
+    def _forget(self, session):
+        # Durations are known for one transaction; what a failed flush recorded never reached the database
+        for key in ('playlist_tails', 'playlist_changes', 'playlist_durations'):
+            session.info.pop(key, None)
+
+    def _after_flush(self, session, flush_context):
+        session.info.pop('playlist_tails', None)
+        changes = session.info.pop('playlist_changes', None)
+        # Durations looked up earlier in the transaction, including those of content since deleted
+        durations = session.info.setdefault('playlist_durations', {})
+        if not changes:
+            return
+        connection = session.connection()
+        wanted = defaultdict(set)
+        for _, _, (content_type, content_id) in changes:
+            if (content_type, content_id) not in durations:
+                wanted[content_type].add(content_id)
+        for content_type, ids in wanted.items():
+            model = self.arms[content_type][0]
+            durations.update(((content_type, content_id), duration or 0) for content_id, duration in
+                             connection.execute(select(model.id, model.duration).where(model.id.in_(ids))))
+        deltas = defaultdict(lambda: [0, 0])
+        for sign, playlist_id, content in changes:
+            deltas[playlist_id][0] += sign
+            deltas[playlist_id][1] += sign * durations.get(content, 0)
+        playlist = self.playlist.__table__
+        for playlist_id, (count, duration) in deltas.items():
+            if count or duration:
+                connection.execute(update(playlist).where(playlist.c.id == playlist_id).values(
+                    item_count=playlist.c.item_count + count, total_duration=playlist.c.total_duration + duration))
+
+    def _duration_changed(self, content_type, column, mapper, connection, target):
+        history = inspect(target).attrs.duration.history
+        if not history.has_changes():
+            return
+        durations = object_session(target).info.setdefault('playlist_durations', {})
+        durations[content_type, target.id] = target.duration or 0
+        delta = (target.duration or 0) - ((history.deleted or [None])[0] or 0)
+        if delta:
+            playlist = self.playlist.__table__
+            connection.execute(update(playlist).where(playlist.c.id.in_(
+                select(self.entry.playlist_id).where(column == target.id))).values(
+                total_duration=playlist.c.total_duration + delta))
+
+    def _content_deleted(self, content_type, column, mapper, connection, target):
+        # Deleting content cascades to its entries in the database, out of sight of the mapper events
+        playlist = self.playlist.__table__
+        connection.execute(update(playlist).where(playlist.c.id.in_(
+            select(self.entry.playlist_id).where(column == target.id))).values(
+            item_count=playlist.c.item_count - 1, total_duration=playlist.c.total_duration - (target.duration or 0)))
+        durations = object_session(target).info.setdefault('playlist_durations', {})
+        durations[content_type, target.id] = target.duration or 0
+
+
+def _id(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise PlaylistError(f'{name} must be an integer')
+    return value
@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(engine):
+    """Record every statement sent to the database inside the block.
+
+        with count_queries(db.engine) as queries:
+            client.get('/playlists/1/tracks')
+        assert queries.count == 1
+    """
+    counter = QueryCounter()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+        counter.parameters.append(parameters)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,327 @@
+"""Item-to-item recommendations from co-occurrence in playlists and
+listening histories, held in memory in every process.
+
+Memory is bounded per item rather than per pair: each item keeps counts for
+at most max_pairs partners (RECOMMENDATIONS_MAX_PAIRS, the ones it scores
+highest with when the index is built; incremental adds may grow a list to
+twice that before it is trimmed) and a top_k neighbour list. So an index
+over I items and B baskets holds about I * (2 * max_pairs + top_k) entries
+plus B * basket_size basket members, whatever the number of distinct pairs.
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+TOP_K = int(os.getenv('RECOMMENDATIONS_TOP_K', 50))
+BASKET_SIZE = int(os.getenv('RECOMMENDATIONS_BASKET_SIZE', 50))
+MAX_PAIRS = int(os.getenv('RECOMMENDATIONS_MAX_PAIRS', TOP_K * 10))
+REBUILD_SECONDS = float(os.getenv('RECOMMENDATIONS_REBUILD_SECONDS', 3600))
+# A user's recommendations start from this many of their latest plays
+HISTORY_ITEMS = 20
+
+logger = logging.getLogger(__name__)
+
+
+class CooccurrenceIndex:
+    """Sparse item-item co-occurrence counts over baskets (a playlist, a
+    user's listening history) and the top_k neighbours of every item by
+    cosine similarity, count(i, j) / sqrt(count(i) * count(j)).
+
+    A basket keeps its basket_size most recent items; adding one more drops
+    the oldest and its counts. Each item counts at most max_pairs partners,
+    its best-scoring ones at build time; a pair dropped from that list and
+    seen again starts counting from one until the next build(). Adding or
+    removing an item marks it for refresh(), which recomputes its neighbour
+    list. The lists of the other items in its basket are patched in
+    O(top_k) for the one pair that changed; scores drifting from changed
+    counts elsewhere are corrected by the next build(). A neighbour list is a pair of arrays replaced whole,
+    so readers need no lock.
+    """
+
+    def __init__(self, top_k=TOP_K, basket_size=BASKET_SIZE, max_pairs=MAX_PAIRS):
+        self.top_k = top_k
+        self.basket_size = basket_size
+        self.max_pairs = max(max_pairs, top_k)
+        self.baskets = {}
+        self.counts = Counter()
+        self.pairs = defaultdict(Counter)
+        self.dirty = set()
+        self.neighbors = {}
+        self.popular = array('i')
+
+    @classmethod
+    def build(cls, rows, top_k=TOP_K, basket_size=BASKET_SIZE, max_pairs=MAX_PAIRS):
+        """Index (basket, item) rows, oldest first within each basket."""
+        index = cls(top_k, basket_size, max_pairs)
+        for basket, item in rows:
+            items = index.baskets.setdefault(basket, OrderedDict())
+            items.pop(item, None)
+            items[item] = None
+            if len(items) > basket_size:
+                items.popitem(last=False)
+        containing = defaultdict(list)
+        for items in index.baskets.values():
+            items = list(items)
+            for item in items:
+                containing[item].append(items)
+        index.counts.update({item: len(baskets) for item, baskets in containing.items()})
+        # One item's full counts at a time, cut to its max_pairs before the next
+        for item, baskets in containing.items():
+            together = Counter()
+            for items in baskets:
+                # Whole baskets at once: Counter.update() does the inner loop in C
+                together.update(items)
+            del together[item]
+            index.pairs[item] = index._best(item, together)
+        index.dirty.update(index.counts)
+        index.refresh()
+        return index
+
+    def add(self, basket, item):
+        items = self.baskets.setdefault(basket, OrderedDict())
+        if item in items:
+            items.move_to_end(item)
+            return
+        for other in items:
+            self.pairs[other][item] += 1
+        self.pairs[item].update(items.keys())
+        self.counts[item] += 1
+        for other in items:
+            self._patch(other, item)
+            self._trim(other)
+        self._trim(item)
+        self.dirty.add(item)
+        items[item] = None
+        if len(items) > self.basket_size:
+            self.remove(basket, next(iter(items)))
+
+    def remove(self, basket, item):
+        items = self.baskets.get(basket)
+        if not items or item not in items:
+            return
+        del items[item]
+        for other in items:
+            self._uncount(item, other)
+            self._uncount(other, item)
+        self.counts[item] -= 1
+        if not self.counts[item]:
+            del self.counts[item]
+            self.pairs.pop(item, None)
+        for other in items:
+            self._patch(other, item)
+        self.dirty.add(item)
+        if not items:
+            del self.baskets[basket]
+
+    def _uncount(self, item, other):
+        # Either side may have dropped the pair when its list was cut
+        pairs = self.pairs.get(item)
+        if pairs and other in pairs:
+            pairs[other] -= 1
+            if not pairs[other]:
+                del pairs[other]
+
+    def _best(self, item, together):
+        """The max_pairs partners of item in together with the highest cosine."""
+        if len(together) <= self.max_pairs:
+            return together
+        counts, count = self.counts, self.counts[item]
+        # Ranked as refresh() ranks neighbours, ties included, so the top_k survive a cut
+        return Counter(dict(heapq.nlargest(self.max_pairs, together.items(), key=lambda pair: (
+            pair[1] / math.sqrt(count * counts[pair[0]]), pair[0]))))
+
+    def _trim(self, item):
+        pairs = self.pairs[item]
+        if len(pairs) > 2 * self.max_pairs:
+            self.pairs[item] = self._best(item, pairs)
+
+    def _patch(self, item, other):
+        ids, scores = self.neighbors.get(item, ((), ()))
+        together = self.pairs[item].get(other, 0)
+        score = together / math.sqrt(self.counts[item] * self.counts[other]) if together else 0.0
+        if other not in ids and (not score or (len(ids) >= self.top_k and score <= scores[-1])):
+            return
+        entries = [(s, i) for s, i in zip(scores, ids) if i != other]
+        if score:
+            entries.append((score, other))
+        entries.sort(reverse=True)
+        del entries[self.top_k:]
+        self.neighbors[item] = (array('i', [i for _, i in entries]), array('f', [s for s, _ in entries]))
+
+    def refresh(self):
+        dirty, self.dirty = self.dirty, set()
+        counts, top_k = self.counts, self.top_k
+        for item in dirty:
+            count = counts.get(item)
+            if not count:
+                self.neighbors.pop(item, None)
+                continue
+            scored = heapq.nlargest(top_k, (
+                (together / math.sqrt(count * counts[other]), other)
+                for other, together in self.pairs[item].items()
+            ))
+            self.neighbors[item] = (array('i', [other for _, other in scored]),
+                                    array('f', [score for score, _ in scored]))
+        if dirty:
+            self.popular = array('i', [item for item, _ in counts.most_common(top_k)])
+        return len(dirty)
+
+    def similar(self, item, limit=10):
+        ids, scores = self.neighbors.get(item, (array('i'), array('f')))
+        return list(zip(ids[:limit], scores[:limit]))
+
+    def recommend(self, basket, limit=10):
+        """Items most similar to the basket's latest HISTORY_ITEMS, leaving
+        out what it already holds. Falls back to the most common items."""
+        # list() copies the basket in one step, safe against concurrent add()
+        heard = list(self.baskets.get(basket, ()))
+        recent = heard[-HISTORY_ITEMS:]
+        heard = set(heard)
+        totals = Counter()
+        for weight, item in enumerate(recent, 1):
+            ids, scores = self.neighbors.get(item, ((), ()))
+            for other, score in zip(ids, scores):
+                if other not in heard:
+                    # Later plays count for more
+                    totals[other] += score * weight / len(recent)
+        ranked = [(other, round(score, 4)) for other, score in totals.most_common(limit)]
+        if len(ranked) < limit:
+            seen = heard | {other for other, _ in ranked}
+            ranked += [(other, 0.0) for other in self.popular if other not in seen][:limit - len(ranked)]
+        return ranked
+
+    def stats(self):
+        return {'items': len(self.counts), 'baskets': len(self.baskets),
+                'pairs': sum(len(others) for others in self.pairs.values()), 'dirty': len(self.dirty)}
+
+
+class Recommender:
+    """Serves a CooccurrenceIndex built from load_rows() and keeps it current.
+
+    The index is built on first use and rebuilt from scratch every
+    rebuild_seconds on a background thread, which picks up changes made by
+    other processes. Changes seen in this process are applied as they
+    happen. Those made while a rebuild is running are replayed onto the new
+    index before it replaces the old one.
+    """
+
+    def __init__(self, load_rows, rebuild_seconds=REBUILD_SECONDS, top_k=TOP_K, basket_size=BASKET_SIZE,
+                 max_pairs=MAX_PAIRS):
+        self.load_rows = load_rows
+        self.rebuild_seconds = rebuild_seconds
+        self.top_k = top_k
+        self.basket_size = basket_size
+        self.max_pairs = max_pairs
+        self._index = None
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.RLock()
+        self.backlog = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.rebuilt_at = None
+        self.build_seconds = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self.rebuild_lock:
+                if self._index is None:
+                    self.rebuild()
+            self._start()
+        return self._index
+
+    def rebuild(self):
+        with self.rebuild_lock:
+            with self.lock:
+                self.backlog = []
+            start = time.monotonic()
+            try:
+                index = CooccurrenceIndex.build(self.load_rows(), self.top_k, self.basket_size, self.max_pairs)
+            except Exception:
+                with self.lock:
+                    self.backlog = None
+                raise
+            with self.lock:
+                for kind, basket, item in self.backlog:
+                    getattr(index, kind)(basket, item)
+                index.refresh()
+                self._index, self.backlog = index, None
+            self.build_seconds = time.monotonic() - start
+            self.rebuilt_at = time.time()
+            return index
+
+    def _apply(self, changes):
+        # changes are (method name, basket, item)
+        with self.lock:
+            if self.backlog is not None:
+                self.backlog.extend(changes)
+            if self._index is not None:
+                for kind, basket, item in changes:
+                    getattr(self._index, kind)(basket, item)
+                self._index.refresh()
+
+    def add(self, pairs):
+        """Record (basket, item) pairs, e.g. from plays just written."""
+        self._apply([('add', basket, item) for basket, item in pairs])
+
+    def remove(self, pairs):
+        self._apply([('remove', basket, item) for basket, item in pairs])
+
+    def watch(self, model, basket_of, item_of):
+        """Apply inserts and deletes of model rows once their transaction
+        commits. basket_of(row) and item_of(row) give the pair a row stands
+        for; rows whose item is None are skipped. Bulk statements and
+        database cascades skip these events and wait for the next rebuild."""
+        def changed(kind):
+            def record(mapper, connection, target):
+                item = item_of(target)
+                if item is not None:
+                    changes = object_session(target).info.setdefault('basket_changes', [])
+                    changes.append((kind, basket_of(target), item))
+            return record
+
+        event.listen(model, 'after_insert', changed('add'))
+        event.listen(model, 'after_delete', changed('remove'))
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _after_commit(self, session):
+        changes = session.info.pop('basket_changes', None)
+        if changes:
+            self._apply(changes)
+
+    def _after_rollback(self, session):
+        session.info.pop('basket_changes', None)
+
+    def similar(self, item, limit=10):
+        return self.index.similar(item, limit)
+
+    def recommend(self, basket, limit=10):
+        return self.index.recommend(basket, limit)
+
+    def _start(self):
+        if self.thread is None and self.rebuild_seconds > 0:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='recommendations', daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.rebuild_seconds):
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('Rebuilding recommendations failed; keeping the previous index')
+
+    def stats(self):
+        stats = self._index.stats() if self._index is not None else {}
+        return dict(stats, build_seconds=self.build_seconds and round(self.build_seconds, 3),
+                    rebuilt_at=self.rebuilt_at)
@@ -0,0 +1,346 @@
+import hashlib
+import logging
+import mimetypes
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+
+from seek_index import seek_table_path
+
+RENDITION_ENCODER = os.getenv('RENDITION_ENCODER', 'auto')
+RENDITION_WORKERS = int(os.getenv('RENDITION_WORKERS', 1))
+RENDITION_CACHE_BYTES = int(os.getenv('RENDITION_CACHE_BYTES', 2 * 1024 ** 3))
+RENDITION_NICE = int(os.getenv('RENDITION_NICE', 10))
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+# Quality served when Accept rules out the uploaded format
+NEGOTIATED_QUALITY = os.getenv('RENDITION_NEGOTIATED_QUALITY', 'high')
+# Forking a worker that already runs request threads can copy a lock another thread holds and
+# deadlock; a forkserver child starts clean. Entry scripts guard __main__, so re-importing is safe.
+START_METHOD = os.getenv('RENDITION_START_METHOD',
+                         'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+# Uploads without a known duration are only transcoded if they are lossless
+LOSSLESS_EXTENSIONS = ('.wav', '.flac')
+
+Quality = namedtuple('Quality', 'name bitrate sample_rate channels')
+
+QUALITIES = {
+    'low': Quality('low', 64, 22050, 1),
+    'medium': Quality('medium', 128, 44100, 2),
+    'high': Quality('high', 192, 44100, 2),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class WavDownsampler:
+    """Pure-Python encoder: PCM WAV in, 16-bit PCM WAV out at the quality's
+    sample rate and channel count. Each output sample is the mean of the
+    input samples it covers."""
+
+    name = 'wav'
+    version = 1
+    extension = '.wav'
+    mimetype = 'audio/wav'
+    block_frames = 64 * 1024
+
+    def supports(self, path):
+        return path.lower().endswith('.wav')
+
+    def bitrate(self, quality):
+        return quality.sample_rate * quality.channels * 16 // 1000
+
+    def encode(self, source, destination, quality):
+        with wave.open(source, 'rb') as reader, wave.open(destination, 'wb') as writer:
+            channels, width, rate = reader.getnchannels(), reader.getsampwidth(), reader.getframerate()
+            out_channels = min(channels, quality.channels)
+            out_rate = min(rate, quality.sample_rate)
+            writer.setnchannels(out_channels)
+            writer.setsampwidth(2)
+            writer.setframerate(out_rate)
+
+            # A block of ratio.numerator input frames makes exactly ratio.denominator output frames
+            ratio = Fraction(rate, out_rate)
+            block = ratio.numerator * max(1, self.block_frames // ratio.numerator)
+            bounds = _bounds(ratio, block) if ratio != 1 else None
+            while True:
+                data = reader.readframes(block)
+                if not data:
+                    break
+                samples = _to_int16(data, width)
+                frames = len(samples) // channels
+                if frames < block and bounds is not None:
+                    bounds = _bounds(ratio, frames)
+                writer.writeframes(_downmix(samples, channels, out_channels, bounds).tobytes())
+
+
+def _bounds(ratio, frames):
+    bounds = []
+    start = 0
+    for index in range(1, int(frames / ratio) + 1):
+        stop = int(index * ratio)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _to_int16(data, width):
+    if width == 1:
+        return array('h', ((b - 128) << 8 for b in data))
+    if width == 2:
+        samples = array('h', data)
+    else:
+        # Keep the two most significant bytes of each little-endian sample
+        wide = bytearray(len(data) // width * 2)
+        wide[0::2] = data[width - 2::width]
+        wide[1::2] = data[width - 1::width]
+        samples = array('h', bytes(wide))
+    if sys.byteorder != 'little':
+        samples.byteswap()
+    return samples
+
+
+def _downmix(samples, channels, out_channels, bounds):
+    if bounds is None:
+        # Same sample rate: only the sample width and channels change
+        if out_channels == channels:
+            out = samples
+        elif out_channels == 1:
+            planes = [samples[c::channels] for c in range(channels)]
+            out = array('h', (sum(frame) // channels for frame in zip(*planes)))
+        else:
+            out = array('h', bytes(2 * out_channels * (len(samples) // channels)))
+            for c in range(out_channels):
+                out[c::out_channels] = samples[c::channels]
+        if sys.byteorder != 'little':
+            out.byteswap()
+        return out
+
+    planes = [samples[c::channels] for c in range(channels)]
+    if out_channels == 1 and channels > 1:
+        out = array('h', (sum(sum(p[a:b]) for p in planes) // ((b - a) * channels) for a, b in bounds))
+    else:
+        out_planes = [array('h', (sum(p[a:b]) // (b - a) for a, b in bounds)) for p in planes[:out_channels]]
+        if out_channels == 1:
+            out = out_planes[0]
+        else:
+            out = array('h', bytes(2 * out_channels * len(bounds)))
+            for c, plane in enumerate(out_planes):
+                out[c::out_channels] = plane
+    if sys.byteorder != 'little':
+        out.byteswap()
+    return out
+
+
+class FfmpegEncoder:
+    """MP3 renditions from any format ffmpeg can read."""
+
+    name = 'ffmpeg-mp3'
+    version = 1
+    extension = '.mp3'
+    mimetype = 'audio/mpeg'
+
+    def __init__(self, binary=FFMPEG_BINARY):
+        self.binary = binary
+
+    def supports(self, path):
+        return True
+
+    def bitrate(self, quality):
+        return quality.bitrate
+
+    def encode(self, source, destination, quality):
+        subprocess.run([
+            self.binary, '-nostdin', '-v', 'error', '-y', '-i', source, '-vn',
+            '-ac', str(quality.channels), '-ar', str(quality.sample_rate), '-b:a', f'{quality.bitrate}k',
+            '-f', 'mp3', destination,
+        ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def default_encoder(name=RENDITION_ENCODER):
+    if name == 'ffmpeg' or (name == 'auto' and shutil.which(FFMPEG_BINARY)):
+        return FfmpegEncoder()
+    return WavDownsampler()
+
+
+def _lower_priority(nice):
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+
+
+def _encode(encoder, source, path, quality):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    os.close(fd)
+    try:
+        encoder.encode(source, tmp_path, quality)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RenditionCache:
+    """Lower-bitrate copies of uploads, made by encoder in a background
+    process pool and kept in directory up to max_bytes.
+
+    Renditions are named by a hash of the source file's name, size and mtime
+    (uploads are stored under their checksum) plus the encoder and quality,
+    so a changed source or encoder never serves a stale copy. Serving one
+    bumps its atime; once the directory is over max_bytes the least recently
+    served renditions are deleted. With workers=0 renditions are made on the
+    calling thread.
+    """
+
+    def __init__(self, directory=None, encoder=None, max_bytes=RENDITION_CACHE_BYTES, workers=RENDITION_WORKERS,
+                 nice=RENDITION_NICE, start_method=START_METHOD):
+        self.encoder = encoder or default_encoder()
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.nice = nice
+        self.start_method = start_method
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.generated = 0
+        self.failed = 0
+        self.evicted = 0
+        if directory is not None:
+            self.use_directory(directory)
+
+    def use_directory(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, source, quality):
+        stat = os.stat(source)
+        key = (f'{os.path.basename(source)}:{stat.st_size}:{stat.st_mtime_ns}:'
+               f'{self.encoder.name}:{self.encoder.version}:{quality}')
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest()[:32] + self.encoder.extension)
+
+    def worthwhile(self, source, quality, duration=None):
+        """Whether the rendition would be meaningfully smaller than source."""
+        if quality not in QUALITIES or not self.encoder.supports(source):
+            return False
+        if not duration:
+            return source.lower().endswith(LOSSLESS_EXTENSIONS)
+        source_kbps = os.path.getsize(source) * 8 / duration / 1000
+        return self.encoder.bitrate(QUALITIES[quality]) < source_kbps * 0.8
+
+    def prepare(self, source, duration=None, qualities=QUALITIES):
+        """Queue every worthwhile rendition of source that isn't cached yet."""
+        for quality in qualities:
+            if self.worthwhile(source, quality, duration):
+                self.submit(source, quality)
+
+    def submit(self, source, quality):
+        path = self.path_for(source, quality)
+        with self.lock:
+            if path in self.pending or os.path.exists(path):
+                return
+            self.pending.add(path)
+        if not self.workers:
+            try:
+                _encode(self.encoder, source, path, QUALITIES[quality])
+            except Exception:
+                logger.exception('Encoding %s rendition of %s failed', quality, source)
+                self._finished(path, failed=True)
+            else:
+                self._finished(path)
+            return
+        future = self._pool().submit(_encode, self.encoder, source, path, QUALITIES[quality])
+        future.add_done_callback(lambda f: self._done(f, source, path, quality))
+
+    def _pool(self):
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver':
+                    context.set_forkserver_preload(['renditions'])
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=context,
+                                                    initializer=_lower_priority, initargs=(self.nice,))
+                self.pid = os.getpid()
+            return self.executor
+
+    def _done(self, future, source, path, quality):
+        error = future.exception()
+        if error is not None:
+            logger.error('Encoding %s rendition of %s failed: %s', quality, source, error)
+        self._finished(path, failed=error is not None)
+
+    def _finished(self, path, failed=False):
+        with self.lock:
+            self.pending.discard(path)
+            if failed:
+                self.failed += 1
+            else:
+                self.generated += 1
+        if not failed:
+            self.evict()
+
+    def get(self, source, quality, duration=None):
+        """Path of the cached quality rendition of source, queueing it if it
+        is worth making. None means serve the source for now."""
+        if not self.worthwhile(source, quality, duration):
+            return None
+        path = self.path_for(source, quality)
+        if not os.path.exists(path):
+            self.submit(source, quality)
+            if not os.path.exists(path):
+                return None
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            return None
+        return path
+
+    def negotiate(self, source, accept):
+        """The quality to serve when the client's Accept header rules out
+        the source's format but allows the encoder's, else None."""
+        source_mimetype = mimetypes.guess_type(source)[0]
+        if (not accept.provided or not source_mimetype or accept.quality(source_mimetype)
+                or not accept.quality(self.encoder.mimetype)):
+            return None
+        return NEGOTIATED_QUALITY
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_atime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for stale in (path, seek_table_path(path)):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.evicted += 1
+        return total
+
+    def stats(self):
+        entries = self._entries()
+        return {'encoder': self.encoder.name, 'entries': len(entries), 'bytes': sum(e[1] for e in entries),
+                'max_bytes': self.max_bytes, 'pending': len(self.pending), 'generated': self.generated,
+                'failed': self.failed, 'evicted': self.evicted}
@@ -0,0 +1,229 @@
+import functools
+import itertools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import request, make_response, Response
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+# Response headers that belong to the cached representation
+CACHED_HEADERS = ('X-Next-Cursor',)
+
+# Streamed bodies larger than this are passed through uncached
+MAX_ENTRY_BYTES = int(os.getenv('CACHE_MAX_ENTRY_BYTES', 4 * 1024 * 1024))
+
+
+class CacheEntry:
+    __slots__ = ('etag', 'mimetype', 'headers', 'body')
+
+    def __init__(self, etag, mimetype, headers, body):
+        self.etag = etag
+        self.mimetype = mimetype
+        self.headers = headers
+        self.body = body
+
+    def dumps(self):
+        meta = json.dumps({'etag': self.etag, 'mimetype': self.mimetype, 'headers': self.headers})
+        return meta.encode() + b'\n' + self.body
+
+    @classmethod
+    def loads(cls, raw):
+        meta, body = raw.split(b'\n', 1)
+        meta = json.loads(meta)
+        return cls(meta['etag'], meta['mimetype'], meta['headers'], body)
+
+
+class MemoryBackend:
+    """LRU bounded by entry count and total body bytes, with a TTL."""
+
+    def __init__(self, ttl=60, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires < time.monotonic():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, entry)
+            self.size += len(entry.body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        expires, entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+
+    def version(self, namespace):
+        return self.versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self.lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+
+    def info(self):
+        return {'entries': len(self.entries), 'bytes': self.size, 'evictions': self.evictions}
+
+
+class RedisBackend:
+    """Shares entries and version counters between workers through any
+    client with Redis' get/set/incr commands."""
+
+    def __init__(self, client, ttl=60, prefix='music-app:cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return CacheEntry.loads(raw) if raw is not None else None
+
+    def set(self, key, entry):
+        self.client.set(self.prefix + key, entry.dumps(), ex=self.ttl)
+
+    def version(self, namespace):
+        return int(self.client.get(f'{self.prefix}version:{namespace}') or 0)
+
+    def bump(self, namespace):
+        self.client.incr(f'{self.prefix}version:{namespace}')
+
+    def info(self):
+        return {}
+
+
+def backend_from_env():
+    ttl = int(os.getenv('CACHE_TTL', 60))
+    if os.getenv('CACHE_BACKEND', 'memory') == 'redis':
+        import redis
+        return RedisBackend(redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6379/0')), ttl)
+    return MemoryBackend(ttl, int(os.getenv('CACHE_MAX_ENTRIES', 1024)),
+                         int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+
+class ResponseCache:
+    def __init__(self, backend=None):
+        self.backend = backend or backend_from_env()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._session_hooks = False
+
+    def watch(self, model, namespace):
+        """Bump namespace once a transaction that wrote a model row commits."""
+        def mark(mapper, connection, target):
+            self.mark(object_session(target), namespace)
+
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, mark)
+
+        if not self._session_hooks:
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_rollback', self._after_rollback)
+            self._session_hooks = True
+
+    def mark(self, session, namespace):
+        """Bump namespace when session's current transaction commits."""
+        session.info.setdefault('cache_namespaces', set()).add(namespace)
+
+    def _after_commit(self, session):
+        for namespace in session.info.pop('cache_namespaces', ()):
+            self.backend.bump(namespace)
+
+    def _after_rollback(self, session):
+        session.info.pop('cache_namespaces', None)
+
+    def key(self, namespaces):
+        versions = ','.join(f'{n}={self.backend.version(n)}' for n in namespaces)
+        args = urlencode(sorted(request.args.items(multi=True)))
+        return f'{request.path}?{args}|{versions}'
+
+    def cached(self, *namespaces):
+        """Cache successful GET responses until a write to one of the
+        namespaces commits, and answer matching If-None-Match with 304."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = self.key(namespaces)
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = self._buffer(response)
+                    if body is None:
+                        return response
+                    entry = CacheEntry(
+                        hashlib.sha256(body).hexdigest()[:32],
+                        response.mimetype,
+                        {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers},
+                        body
+                    )
+                    self.backend.set(key, entry)
+                return self.respond(entry)
+            return wrapper
+        return decorator
+
+    def _buffer(self, response):
+        if not response.is_streamed:
+            return response.get_data()
+        chunks = []
+        size = 0
+        body = iter(response.response)
+        for chunk in body:
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > MAX_ENTRY_BYTES:
+                response.response = itertools.chain(chunks, body)
+                return None
+        return b''.join(chunks)
+
+    def respond(self, entry):
+        if request.if_none_match.contains(entry.etag):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(entry.body, mimetype=entry.mimetype, headers=entry.headers)
+        response.set_etag(entry.etag)
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': 0,
+        }
+        stats.update(self.backend.info())
+        return stats
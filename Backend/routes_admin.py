@@ -0,0 +1,127 @@
+import os
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from werkzeug.utils import secure_filename
+
+from bulk import export_rows
+from db_config import pool_stats
+from extensions import (admin_required, import_catalog, ingest_queue, recommender, renditions, response_cache,
+                        role_cache)
+from ingest import store_upload
+from models import db, CATALOG_MODELS, Podcast, Track
+
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+@bp.route('/upload', methods=['POST'])
+@admin_required()
+def upload_file():
+    if 'file' not in request.files:
+        return jsonify({'message': 'No file provided'}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'message': 'No file selected'}), 400
+
+    filename = secure_filename(file.filename)
+    folder = current_app.config['UPLOAD_FOLDER']
+    stored = store_upload(file, folder, filename)
+    job = ingest_queue.submit(stored)
+    file_path = os.path.join(folder, stored.filename)
+
+    return jsonify({
+        'message': 'File uploaded',
+        'file_path': file_path,
+        'checksum': stored.checksum,
+        'duplicate': stored.duplicate,
+        'job_id': job['id']
+    }), 201
+
+@bp.route('/jobs/<job_id>')
+@admin_required()
+def ingest_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job)
+
+@bp.route('/tracks', methods=['POST'])
+@admin_required()
+def add_track():
+    data = request.get_json()
+    # Fields the admin leaves out come from the upload's parsed headers
+    metadata = ingest_queue.metadata_for(data['file_path']) or {}
+    title = data.get('title') or metadata.get('title')
+    artist = data.get('artist') or metadata.get('artist')
+    if not title or not artist:
+        return jsonify({'message': 'Title and artist are required'}), 400
+    duration = data.get('duration') or metadata.get('duration', 0)
+
+    if data.get('is_podcast'):
+        content = Podcast(
+            title=title,
+            host=artist,
+            file_path=data['file_path'],
+            duration=duration,
+            podcast_name=data.get('podcast_name', ''),
+            category=data.get('category')
+        )
+    else:
+        content = Track(
+            title=title,
+            artist=artist,
+            file_path=data['file_path'],
+            duration=duration,
+            category=data.get('category')
+        )
+
+    db.session.add(content)
+    db.session.commit()
+
+    return jsonify({'message': 'Content added', 'id': content.id}), 201
+
+@bp.route('/content/<content_type>/<int:content_id>', methods=['DELETE'])
+@admin_required()
+def delete_content(content_type, content_id):
+    if content_type == 'track':
+        content = Track.query.get_or_404(content_id)
+    else:
+        content = Podcast.query.get_or_404(content_id)
+
+    db.session.delete(content)
+    db.session.commit()
+    return jsonify({'message': 'Content deleted'})
+
+@bp.route('/import', methods=['POST'])
+@admin_required()
+def bulk_import():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'message': 'format must be ndjson or csv'}), 400
+    stream = request.files['file'].stream if 'file' in request.files else request.stream
+    batch_size = min(max(request.args.get('batch_size', 1000, type=int), 1), 10000)
+    return jsonify(import_catalog(stream, fmt, batch_size))
+
+@bp.route('/export')
+@admin_required()
+def bulk_export():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'message': 'format must be ndjson or csv'}), 400
+    content_type = request.args.get('type')
+    if content_type and content_type not in CATALOG_MODELS:
+        return jsonify({'message': 'type must be track or podcast'}), 400
+
+    rows = export_rows(db.session, CATALOG_MODELS, fmt, [content_type] if content_type else None)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(rows), mimetype=mimetype)
+
+@bp.route('/cache/stats')
+@admin_required()
+def cache_stats():
+    return jsonify(dict(response_cache.stats(), roles=role_cache.stats(), renditions=renditions.stats(),
+                        recommendations=recommender.stats()))
+
+@bp.route('/db/stats')
+@admin_required()
+def db_stats():
+    return jsonify({key or 'primary': pool_stats(engine) for key, engine in db.engines.items()})
@@ -0,0 +1,41 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import create_access_token
+
+from extensions import password_hasher
+from models import db, User
+from passwords import HasherBusy
+
+bp = Blueprint('auth', __name__)
+
+@bp.app_errorhandler(HasherBusy)
+def hasher_busy(e):
+    return jsonify({'message': 'Too many login attempts in progress, try again shortly'}), 429, {
+        'Retry-After': str(e.retry_after)}
+
+@bp.route('/register', methods=['POST'])
+def register():
+    data = request.get_json()
+    if User.query.filter_by(username=data['username']).first():
+        return jsonify({'message': 'Username already exists'}), 400
+
+    # Hashing waits on the pool; don't hold a database connection meanwhile
+    db.session.close()
+    user = User(
+        username=data['username'],
+        email=data['email'],
+        password_hash=password_hasher.hash(data['password'])
+    )
+    db.session.add(user)
+    db.session.commit()
+    return jsonify({'message': 'User created successfully'}), 201
+
+@bp.route('/login', methods=['POST'])
+def login():
+    data = request.get_json()
+    user = User.query.filter_by(username=data['username']).first()
+    db.session.close()
+
+    if user and password_hasher.check(user.password_hash, data['password']):
+        token = create_access_token(identity=str(user.id), additional_claims={'is_admin': bool(user.is_admin)})
+        return jsonify({'token': token, 'user_id': user.id, 'is_admin': user.is_admin})
+    return jsonify({'message': 'Invalid credentials'}), 401
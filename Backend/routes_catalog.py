@@ -0,0 +1,111 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from charts import WINDOWS as CHART_WINDOWS, CHART_SIZE
+from extensions import ITEM_FIELDS, catalog, catalog_search, charts, play_buffer, recommender, response_cache
+from models import db, PODCAST_FIELDS, TRACK_FIELDS, Podcast, Track
+from pagination import (DEFAULT_LIMIT, MAX_LIMIT, EXPORT_BATCH, after_cursor, encode_cursor,
+                        parse_fields, stream_json_array)
+
+bp = Blueprint('catalog', __name__)
+
+def list_catalog(model, columns, content_type):
+    # Without limit/cursor the whole catalog is streamed; otherwise one keyset page
+    # is returned with the cursor for the next one in X-Next-Cursor
+    try:
+        fields = parse_fields(request.args.get('fields'), columns)
+        stmt = db.select(*[columns[f].label(f) for f in fields], model.created_at, model.id.label('_id'))
+        if request.args.get('category'):
+            stmt = stmt.where(model.category == request.args['category'])
+        if request.args.get('cursor'):
+            stmt = stmt.where(after_cursor(model.created_at, model.id, request.args['cursor']))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    stmt = stmt.order_by(model.created_at, model.id)
+    to_dict = catalog.serializer(content_type, fields)
+
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        rows = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+        return stream_json_array(rows, to_dict)
+
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    rows = db.session.execute(stmt.limit(limit + 1)).all()
+    response = jsonify([to_dict(row) for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        response.headers['X-Next-Cursor'] = encode_cursor(last.created_at, last._id)
+    return response
+
+@bp.route('/tracks')
+@response_cache.cached('track')
+def get_tracks():
+    return list_catalog(Track, TRACK_FIELDS, 'track')
+
+@bp.route('/podcasts')
+@response_cache.cached('podcast')
+def get_podcasts():
+    return list_catalog(Podcast, PODCAST_FIELDS, 'podcast')
+
+@bp.route('/catalog')
+@response_cache.cached('track', 'podcast')
+def get_catalog():
+    # Tracks and podcasts in one listing, oldest first, one keyset page at a time
+    try:
+        fields = parse_fields(request.args.get('fields'), catalog.fields)
+        limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+        items, next_cursor = catalog.listing(fields, limit, request.args.get('cursor'), request.args.get('category'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def scored_tracks(ranked):
+    found = catalog.lookup([('track', track_id) for track_id, _ in ranked], ITEM_FIELDS)
+    return [
+        dict(found[('track', track_id)], score=round(score, 4))
+        for track_id, score in ranked if ('track', track_id) in found
+    ]
+
+@bp.route('/tracks/<int:track_id>/similar')
+def similar_tracks(track_id):
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LIMIT)
+    return jsonify(scored_tracks(recommender.similar(track_id, limit)))
+
+@bp.route('/users/me/recommendations')
+@jwt_required()
+def my_recommendations():
+    user_id = int(get_jwt_identity())
+    # Plays still in the buffer reach the index once written
+    play_buffer.sync(user_id)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LIMIT)
+    return jsonify(scored_tracks(recommender.recommend(('user', user_id), limit)))
+
+def chart_items(ranked, score_name):
+    found = catalog.lookup([key for key, _ in ranked], ITEM_FIELDS)
+    return [dict(found[key], **{score_name: score}) for key, score in ranked if key in found]
+
+@bp.route('/charts/top')
+def top_chart():
+    # Most played over the last day, week or month, from counters kept in memory
+    window = request.args.get('window', 'day')
+    if window not in CHART_WINDOWS:
+        return jsonify({'message': f'Unknown window, expected one of: {", ".join(CHART_WINDOWS)}'}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), CHART_SIZE)
+    return jsonify(chart_items(charts.top(window, request.args.get('category'), limit), 'plays'))
+
+@bp.route('/charts/trending')
+def trending_chart():
+    limit = min(max(request.args.get('limit', 50, type=int), 1), CHART_SIZE)
+    return jsonify(chart_items(charts.trending(request.args.get('category'), limit), 'score'))
+
+@bp.route('/search')
+@response_cache.cached('track', 'podcast')
+def search():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 50, type=int), 0), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    hits = catalog_search.search(query, limit, offset)
+    found = catalog.lookup(hits, ITEM_FIELDS)
+    return jsonify([found[hit] for hit in hits if hit in found])
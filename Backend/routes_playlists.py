@@ -0,0 +1,102 @@
+from datetime import datetime
+
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
+
+from db_config import use_primary
+from extensions import content_items, content_reference, play_buffer, playlist_editor
+from models import db, Playlist, PlaylistTrack, RecentlyPlayed
+from playlist_editor import PlaylistError
+
+bp = Blueprint('playlists', __name__)
+
+@bp.errorhandler(PlaylistError)
+def playlist_error(e):
+    db.session.rollback()
+    return jsonify({'message': str(e)}), e.status
+
+@bp.errorhandler(IntegrityError)
+def playlist_conflict(e):
+    # A concurrent edit added the same item first
+    db.session.rollback()
+    return jsonify({'message': 'The playlist already has that item'}), 409
+
+def own_playlist(playlist_id):
+    # Someone else's playlist can be read but not edited
+    playlist = db.get_or_404(Playlist, playlist_id)
+    if playlist.user_id != int(get_jwt_identity()):
+        return None, (jsonify({'message': 'Not your playlist'}), 403)
+    return playlist, None
+
+@bp.route('/playlists', methods=['GET', 'POST'])
+@jwt_required()
+def playlists():
+    user_id = int(get_jwt_identity())
+
+    if request.method == 'POST':
+        data = request.get_json()
+        playlist = Playlist(name=data['name'], user_id=user_id)
+        db.session.add(playlist)
+        db.session.commit()
+        return jsonify({'id': playlist.id, 'name': playlist.name}), 201
+
+    playlists = Playlist.query.filter_by(user_id=user_id).all()
+    return jsonify([{'id': p.id, 'name': p.name} for p in playlists])
+
+@bp.route('/playlists/summary')
+@jwt_required()
+def playlist_summaries():
+    # Counts and durations of many playlists in one query, as stored, not recounted
+    ids = request.args.get('ids')
+    try:
+        ids = [int(i) for i in ids.split(',')] if ids else None
+    except ValueError:
+        return jsonify({'message': 'ids must be comma separated integers'}), 400
+    return jsonify(playlist_editor.summaries(int(get_jwt_identity()), ids))
+
+@bp.route('/playlists/<int:playlist_id>/tracks', methods=['GET', 'POST', 'PATCH'])
+@jwt_required()
+def playlist_tracks(playlist_id):
+    if request.method == 'GET':
+        return jsonify(content_items(PlaylistTrack, PlaylistTrack.playlist_id == playlist_id,
+                                     order_by=(PlaylistTrack.position, PlaylistTrack.id), entry_field='entry_id'))
+
+    playlist, denied = own_playlist(playlist_id)
+    if denied:
+        return denied
+    data = request.get_json()
+    if request.method == 'POST':
+        # One item, at the end or before/after an entry
+        try:
+            track_id, podcast_id = content_reference(data)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        operation = {key: data[key] for key in ('before', 'after') if key in data}
+        operation.update(op='add', track_id=track_id, podcast_id=podcast_id)
+        result = playlist_editor.apply(playlist_id, [operation])
+        db.session.commit()
+        return jsonify({'message': 'Content added to playlist', 'entry_id': result['added'][0]}), 201
+
+    # PATCH: a batch of add, remove and move operations, applied together or not at all
+    result = playlist_editor.apply(playlist_id, (data or {}).get('operations'))
+    db.session.commit()
+    return jsonify(dict(result, item_count=playlist.item_count, total_duration=playlist.total_duration))
+
+@bp.route('/recently-played', methods=['GET', 'POST'])
+@jwt_required()
+def recently_played():
+    user_id = int(get_jwt_identity())
+
+    if request.method == 'POST':
+        try:
+            track_id, podcast_id = content_reference(request.get_json())
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        play_buffer.add(user_id, track_id, podcast_id, datetime.utcnow())
+        return jsonify({'message': 'Recently played updated'})
+
+    if play_buffer.sync(user_id):
+        use_primary()
+    return jsonify(content_items(RecentlyPlayed, RecentlyPlayed.user_id == user_id,
+                                 order_by=(RecentlyPlayed.played_at.desc(),), limit=10))
@@ -0,0 +1,71 @@
+from flask import Blueprint, Response, jsonify, request
+
+from extensions import renditions
+from hls import MANIFEST_MIMETYPE, SEGMENT_MAX_AGE, load_manifest, segment
+from models import Podcast, Track
+from renditions import QUALITIES
+from seek_index import load_seek_table
+from streaming import send_audio, send_slice
+
+bp = Blueprint('streaming', __name__)
+
+def content_or_404(content_type, content_id):
+    if content_type == 'track':
+        return Track.query.get_or_404(content_id)
+    return Podcast.query.get_or_404(content_id)
+
+@bp.route('/stream/<content_type>/<int:content_id>')
+def stream_content(content_type, content_id):
+    content = content_or_404(content_type, content_id)
+    quality = request.args.get('quality') or renditions.negotiate(content.file_path, request.accept_mimetypes)
+    if quality is not None and quality not in QUALITIES:
+        return jsonify({'message': f'Unknown quality, expected one of: {", ".join(QUALITIES)}'}), 400
+    # Until its rendition is ready the upload itself is served
+    rendition = renditions.get(content.file_path, quality, content.duration) if quality else None
+    path, mimetype = (rendition, renditions.encoder.mimetype) if rendition else (content.file_path, None)
+
+    seconds = request.args.get('t', type=float)
+    if seconds is None:
+        response = send_audio(path, mimetype)
+    else:
+        table = load_seek_table(path)
+        if table is None:
+            return jsonify({'message': 'Seeking is only supported for MP3 files'}), 400
+        offset, at = table.offset_for(seconds)
+        response = send_audio(path, mimetype, start=offset)
+        response.headers['X-Seek-Time'] = f'{at:.3f}'
+    response.headers['X-Rendition'] = quality if rendition else 'original'
+    response.vary.add('Accept')
+    return response
+
+@bp.route('/stream/<content_type>/<int:content_id>/seek-map')
+def stream_seek_map(content_type, content_id):
+    content = content_or_404(content_type, content_id)
+    table = load_seek_table(content.file_path)
+    if table is None:
+        return jsonify({'message': 'Seeking is only supported for MP3 files'}), 400
+    response = jsonify(table.to_dict())
+    response.set_etag(f'{table.mtime_ns:x}-{table.size:x}-{table.interval}')
+    return response.make_conditional(request)
+
+@bp.route('/stream/<content_type>/<int:content_id>/playlist.m3u8')
+def stream_playlist(content_type, content_id):
+    content = content_or_404(content_type, content_id)
+    segmented = segment(content.file_path)
+    if segmented is None:
+        return jsonify({'message': 'Segmented playback is only supported for MP3 files'}), 400
+    response = Response(load_manifest(content.file_path, segmented), mimetype=MANIFEST_MIMETYPE)
+    response.set_etag(f'{segmented.version}-{segmented.segment_seconds:g}')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@bp.route('/stream/<content_type>/<int:content_id>/segments/<version>/<int:index>.mp3')
+def stream_segment(content_type, content_id, version, index):
+    content = content_or_404(content_type, content_id)
+    segmented = segment(content.file_path)
+    # A stale version means the file was replaced: the client has to reload the playlist
+    if segmented is None or version != segmented.version or index >= len(segmented):
+        return jsonify({'message': 'Segment not found'}), 404
+    start, stop = segmented.byte_range(index)
+    return send_slice(content.file_path, start, stop, 'audio/mpeg', etag=f'"{version}-{index}"',
+                      max_age=SEGMENT_MAX_AGE)
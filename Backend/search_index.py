@@ -0,0 +1,306 @@
+import bisect
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session, object_session
+
+REFRESH_SECONDS = int(os.getenv('SEARCH_REFRESH_SECONDS', 30))
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(value):
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return TOKEN_RE.findall(value.lower())
+
+
+class FtsBackend:
+    """SQLite FTS5 table kept in the same transaction as the catalog rows.
+
+    The rowid packs the content id and its type so deletes need no lookup.
+    """
+
+    table = 'content_fts'
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.ready = False
+
+    def rowid(self, content_type, content_id):
+        return content_id * len(self.catalog.sources) + self.catalog.type_index[content_type]
+
+    def exists(self, connection):
+        return connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': self.table}
+        ).first() is not None
+
+    def ensure(self, connection):
+        if self.ready:
+            return
+        if not self.exists(connection):
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+                "title, creator, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            ))
+            self.populate(connection)
+        self.ready = True
+
+    def populate(self, connection):
+        width = len(self.catalog.sources)
+        for index, (content_type, model, creator) in enumerate(self.catalog.sources):
+            table = model.__table__
+            connection.execute(text(
+                f"INSERT INTO {self.table} (rowid, title, creator) "
+                f"SELECT id * {width} + {index}, title, {table.c[creator].name} FROM {table.name}"
+            ))
+
+    def rebuild(self, connection):
+        self.ensure(connection)
+        connection.execute(text(f"DELETE FROM {self.table}"))
+        self.populate(connection)
+
+    def add(self, connection, content_type, content_id, title, creator):
+        self.ensure(connection)
+        rowid = self.rowid(content_type, content_id)
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"), {'rowid': rowid})
+        connection.execute(
+            text(f"INSERT INTO {self.table} (rowid, title, creator) VALUES (:rowid, :title, :creator)"),
+            {'rowid': rowid, 'title': title, 'creator': creator}
+        )
+
+    def add_many(self, connection, content_type, rows):
+        self.ensure(connection)
+        params = [{'rowid': self.rowid(content_type, content_id), 'title': title, 'creator': creator}
+                  for content_id, title, creator in rows]
+        # ensure() may have just populated the table with these very rows
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"), params)
+        connection.execute(
+            text(f"INSERT INTO {self.table} (rowid, title, creator) VALUES (:rowid, :title, :creator)"),
+            params
+        )
+
+    def remove(self, connection, content_type, content_id):
+        self.ensure(connection)
+        connection.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"),
+                           {'rowid': self.rowid(content_type, content_id)})
+
+    def search(self, connection, terms, limit, offset):
+        self.ensure(connection)
+        match = ' '.join(f'"{term}"*' for term in terms)
+        try:
+            rows = connection.execute(
+                text(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH :match "
+                     f"ORDER BY bm25({self.table}, 2.0, 1.0) LIMIT :limit OFFSET :offset"),
+                {'match': match, 'limit': limit, 'offset': offset}
+            )
+        except OperationalError:
+            # A write that created the table has not committed yet: other
+            # connections see no table, so there is nothing to find
+            if self.exists(connection):
+                raise
+            return []
+        width = len(self.catalog.sources)
+        return [(self.catalog.sources[rowid % width][0], rowid // width) for (rowid,) in rows]
+
+
+class MemoryBackend:
+    """Per-process inverted index used when the database has no FTS.
+
+    A sorted vocabulary answers prefix lookups with two bisects. Writes are
+    applied once their transaction commits (see CatalogSearch); writes from
+    other workers are picked up by a periodic (count, max id) check.
+    """
+
+    TITLE_WEIGHT = 2.0
+    CREATOR_WEIGHT = 1.0
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.postings = {}
+        self.vocabulary = []
+        self.documents = {}
+        self.snapshot = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _state(self, connection):
+        return tuple(
+            tuple(connection.execute(select(func.count(model.id), func.max(model.id))).one())
+            for content_type, model, creator in self.catalog.sources
+        )
+
+    def ensure(self, connection):
+        now = time.monotonic()
+        if self.snapshot is not None and now - self.checked_at < REFRESH_SECONDS:
+            return
+        self.checked_at = now
+        state = self._state(connection)
+        if state != self.snapshot:
+            self.rebuild(connection)
+            self.snapshot = state
+
+    def rebuild(self, connection):
+        rows = [((content_type, content_id), title, creator_value)
+                for content_type, model, creator in self.catalog.sources
+                for content_id, title, creator_value in
+                connection.execute(select(model.id, model.title, getattr(model, creator)))]
+        with self.lock:
+            self.postings = {}
+            self.vocabulary = []
+            self.documents = {}
+            for key, title, creator in rows:
+                self.vocabulary.extend(self._index(key, title, creator))
+            self.vocabulary.sort()
+
+    def _index(self, key, title, creator):
+        weights = {}
+        for token in tokenize(title):
+            weights[token] = weights.get(token, 0.0) + self.TITLE_WEIGHT
+        for token in tokenize(creator):
+            weights[token] = weights.get(token, 0.0) + self.CREATOR_WEIGHT
+        new_tokens = []
+        for token, weight in weights.items():
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+                new_tokens.append(token)
+            docs[key] = weight
+        self.documents[key] = list(weights)
+        return new_tokens
+
+    def add(self, connection, content_type, content_id, title, creator):
+        self.add_many(connection, content_type, [(content_id, title, creator)])
+
+    def add_many(self, connection, content_type, rows):
+        with self.lock:
+            for content_id, title, creator in rows:
+                self._remove((content_type, content_id))
+                for token in self._index((content_type, content_id), title, creator):
+                    bisect.insort(self.vocabulary, token)
+
+    def remove(self, connection, content_type, content_id):
+        with self.lock:
+            self._remove((content_type, content_id))
+
+    def _remove(self, key):
+        for token in self.documents.pop(key, ()):
+            docs = self.postings[token]
+            docs.pop(key, None)
+            if not docs:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def _matches(self, term):
+        scores = {}
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + '\uffff', lo=start)
+        for token in self.vocabulary[start:end]:
+            # Whole-word hits outrank prefix hits; rarer tokens outrank common ones
+            boost = (1.0 if token == term else 0.5) / len(self.postings[token]) ** 0.5
+            for key, weight in self.postings[token].items():
+                scores[key] = scores.get(key, 0.0) + weight * boost
+        return scores
+
+    def search(self, connection, terms, limit, offset):
+        self.ensure(connection)
+        scores = None
+        with self.lock:
+            for term in terms:
+                matches = self._matches(term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {key: score + matches[key] for key, score in scores.items() if key in matches}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [key for key, score in ranked[offset:offset + limit]]
+
+
+class CatalogSearch:
+    def __init__(self, db):
+        self.db = db
+        self.sources = []
+        self.type_index = {}
+        self._backend = None
+
+    def register(self, content_type, model, creator):
+        self.type_index[content_type] = len(self.sources)
+        self.sources.append((content_type, model, creator))
+
+        def after_write(mapper, connection, target):
+            self._write(object_session(target), connection, 'add', content_type, target.id, target.title,
+                        getattr(target, creator))
+
+        def after_delete(mapper, connection, target):
+            self._write(object_session(target), connection, 'remove', content_type, target.id)
+
+        event.listen(model, 'after_insert', after_write)
+        event.listen(model, 'after_update', after_write)
+        event.listen(model, 'after_delete', after_delete)
+        if len(self.sources) == 1:
+            event.listen(Session, 'after_commit', self._after_commit)
+            event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _write(self, session, connection, method, *args):
+        # The FTS table changes inside the writing transaction; the in-memory
+        # index only once that transaction commits
+        if isinstance(self.backend, FtsBackend):
+            getattr(self.backend, method)(connection, *args)
+        else:
+            session.info.setdefault('search_changes', []).append((method, args))
+
+    def _after_commit(self, session):
+        for method, args in session.info.pop('search_changes', ()):
+            getattr(self._backend, method)(None, *args)
+
+    def _after_rollback(self, session):
+        session.info.pop('search_changes', None)
+        # The FTS table may have been created inside the rolled back transaction
+        if isinstance(self._backend, FtsBackend):
+            self._backend.ready = False
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            engine = self.db.engine
+            if engine.dialect.name == 'sqlite' and self._has_fts5(engine):
+                self._backend = FtsBackend(self)
+            else:
+                self._backend = MemoryBackend(self)
+        return self._backend
+
+    def _has_fts5(self, engine):
+        try:
+            with engine.begin() as connection:
+                connection.execute(text('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)'))
+                connection.execute(text('DROP TABLE temp.fts5_probe'))
+        except Exception:
+            return False
+        return True
+
+    def index_many(self, session, content_type, rows):
+        """Index rows session wrote with bulk inserts, which skip the mapper events."""
+        model, creator = self.sources[self.type_index[content_type]][1:]
+        self._write(session, session.connection(), 'add_many', content_type,
+                    [(row['id'], row['title'], row[creator]) for row in rows])
+
+    def rebuild(self):
+        with self.db.engine.begin() as connection:
+            self.backend.rebuild(connection)
+
+    def search(self, query, limit=50, offset=0):
+        """Return (content_type, id) pairs, best match first. Every query
+        term must match a title or creator word, either whole or as a prefix."""
+        terms = tokenize(query)
+        if not terms or limit <= 0:
+            return []
+        with self.db.engine.begin() as connection:
+            return self.backend.search(connection, terms, limit, offset)
@@ -0,0 +1,139 @@
+import functools
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from audio_metadata import find_mp3_frame, id3v2_size, parse_mp3_frame_header, vbr_header
+from json_store import write_atomic
+
+# Seconds between seek points: a seek lands at most one frame before the point
+SEEK_INTERVAL = float(os.getenv('SEEK_INTERVAL', 1.0))
+SEEKABLE_EXTENSIONS = ('.mp3',)
+
+_MAGIC = b'SEEK'
+_VERSION = 1
+# magic, version, offset typecode, interval ms, duration ms, file size, file mtime ns, entries
+_HEADER = struct.Struct('<4sBcIIQqI')
+
+
+class SeekTable:
+    """Byte offsets of the frame playing at every interval seconds of an
+    MP3 file, so a seek is one index instead of a scan. VBR files need this:
+    their offsets don't grow linearly with time."""
+
+    def __init__(self, interval, offsets, duration, size=0, mtime_ns=0):
+        self.interval = interval
+        self.offsets = offsets
+        self.duration = duration
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def offset_for(self, seconds):
+        """(byte offset, seek point time) for the seek point at or before
+        seconds, clamped to the file."""
+        index = min(max(int(seconds / self.interval), 0), len(self.offsets) - 1)
+        return self.offsets[index], index * self.interval
+
+    def to_bytes(self):
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = array(offsets.typecode, offsets)
+            offsets.byteswap()
+        header = _HEADER.pack(_MAGIC, _VERSION, offsets.typecode.encode(), round(self.interval * 1000),
+                              round(self.duration * 1000), self.size, self.mtime_ns, len(offsets))
+        return header + offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, typecode, interval_ms, duration_ms, size, mtime_ns, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Not a seek table')
+        offsets = array(typecode.decode())
+        offsets.frombytes(data[_HEADER.size:_HEADER.size + count * offsets.itemsize])
+        if len(offsets) != count:
+            raise ValueError('Truncated seek table')
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        return cls(interval_ms / 1000, offsets, duration_ms / 1000, size, mtime_ns)
+
+    def to_dict(self):
+        return {'interval': self.interval, 'duration': round(self.duration, 3), 'size': self.size,
+                'offsets': self.offsets.tolist()}
+
+
+def scan_mp3(data, interval=SEEK_INTERVAL):
+    """Walk every frame of the MP3 in data (bytes or an mmap) once and
+    return a SeekTable, or None if no frames are found."""
+    size = len(data)
+    end = size - 128 if size >= 128 and data[size - 128:size - 125] == b'TAG' else size
+    pos, frame = find_mp3_frame(data, id3v2_size(data[:10]))
+    if pos is None:
+        return None
+
+    offsets = array('I' if size < 2 ** 32 else 'Q')
+    elapsed = 0.0
+    # A Xing/Info/VBRI frame holds no audio: seeks start after it
+    if vbr_header(data, pos, frame)[0]:
+        pos += frame.length
+    while pos + 4 <= end:
+        frame = parse_mp3_frame_header(data[pos:pos + 4])
+        if frame is None:
+            # Lost sync on junk between frames: find the next real frame
+            pos, frame = find_mp3_frame(data, pos + 1)
+            if pos is None or pos >= end:
+                break
+        playing_until = elapsed + frame.samples / frame.sample_rate
+        while len(offsets) * interval < playing_until:
+            offsets.append(pos)
+        elapsed = playing_until
+        pos += frame.length
+
+    if not offsets:
+        return None
+    return SeekTable(interval, offsets, elapsed, size)
+
+
+def seek_table_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.seek', name + '.seek')
+
+
+def build_seek_table(path, interval=SEEK_INTERVAL):
+    """Scan path and store its seek table next to it. Returns the table,
+    or None for files that can't be indexed."""
+    if not path.lower().endswith(SEEKABLE_EXTENSIONS):
+        return None
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if not stat.st_size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            table = scan_mp3(data, interval)
+    if table is None:
+        return None
+    table.mtime_ns = stat.st_mtime_ns
+    os.makedirs(os.path.dirname(seek_table_path(path)), exist_ok=True)
+    write_atomic(seek_table_path(path), table.to_bytes())
+    return table
+
+
+@functools.lru_cache(maxsize=256)
+def _load(path, size, mtime_ns, interval):
+    try:
+        with open(seek_table_path(path), 'rb') as f:
+            table = SeekTable.from_bytes(f.read())
+        if (table.size, table.mtime_ns, table.interval) == (size, mtime_ns, interval):
+            return table
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+    # Missing, or left over from an earlier version of the file
+    return build_seek_table(path, interval)
+
+
+def load_seek_table(path, interval=SEEK_INTERVAL):
+    """The seek table for path, built on first use if the upload hook hasn't
+    made one yet. None for files that can't be indexed."""
+    stat = os.stat(path)
+    return _load(path, stat.st_size, stat.st_mtime_ns, round(interval, 3))
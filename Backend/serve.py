@@ -0,0 +1,91 @@
+"""Production launcher.
+
+    python serve.py                                  # ASGI, one worker
+    CACHE_BACKEND=redis python serve.py --server asgi --workers 4 --threads 16
+    python serve.py --server wsgi --threads 8        # thread-per-request baseline
+    python serve.py --app simple_app --port 5000
+
+asgi runs the app behind asgi.WsgiBridge under uvicorn, so audio streams
+don't hold threads. wsgi runs werkzeug's server with a fixed pool of
+--threads handler threads, each busy for the whole of a response.
+
+Several workers need CACHE_BACKEND=redis: with the default in-process
+cache a worker keeps serving listings that another worker's write made
+stale. Other state stays per process even then: charts, recommendations,
+the role cache and the in-memory search index catch up on their refresh
+intervals, and /admin/jobs only knows the uploads its own worker took.
+"""
+import argparse
+import importlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug's server handling requests on a fixed-size thread pool."""
+
+    def __init__(self, *args, threads=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='wsgi')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def prepare(module_name):
+    module = importlib.import_module(module_name)
+    if hasattr(module, 'db'):
+        # Upgrade once here rather than racing in every worker
+        from migrations import upgrade
+        with module.app.app_context():
+            upgrade(module.db.engine, module.db.metadata)
+    return module
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the music backend.')
+    parser.add_argument('--app', default=os.getenv('WSGI_APP', 'app'), help='module holding the Flask app')
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default=os.getenv('SERVER_MODE', 'asgi'))
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', 1)),
+                        help='processes (asgi only); more than one needs CACHE_BACKEND=redis')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', 16)),
+                        help='request handler threads per process')
+    parser.add_argument('--log-level', default=os.getenv('LOG_LEVEL', 'warning'))
+    args = parser.parse_args(argv)
+    if args.workers > 1 and os.getenv('CACHE_BACKEND', 'memory') != 'redis':
+        parser.error('--workers above 1 needs CACHE_BACKEND=redis: an in-process cache goes stale across workers')
+
+    module = prepare(args.app)
+    if args.server == 'wsgi':
+        server = PooledWSGIServer(args.host, args.port, module.app, threads=args.threads)
+        print(f'WSGI on http://{args.host}:{args.port} with {args.threads} threads', file=sys.stderr)
+        server.serve_forever()
+        return
+
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('The asgi server needs uvicorn: pip install -r requirements.txt')
+    # Workers are spawned processes: settings reach asgi.create_application() through the environment
+    os.environ['WSGI_APP'] = args.app
+    os.environ['ASGI_THREADS'] = str(args.threads)
+    uvicorn.run('asgi:create_application', factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level=args.log_level, http='h11', loop='asyncio',
+                lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
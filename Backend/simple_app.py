@@ -1,82 +1,98 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import json
+import logging
 import os
 
+from ingest import IngestQueue, UploadRequest, store_upload
+from json_store import JsonStore, KeyIndex, GroupIndex, IdAllocator
+from metrics import Metrics
+from streaming import send_audio
+from structured_log import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
+metrics = Metrics()
+metrics.instrument(app)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 
 # Create uploads directory
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+ingest_queue = IngestQueue(app.config['UPLOAD_FOLDER'])
+
 # Simple file-based storage
 USERS_FILE = 'users.json'
 CONTENT_FILE = 'content.json'
 
+users_store = JsonStore(USERS_FILE, [{'id': 1, 'username': 'admin', 'email': 'admin@test.com', 'password': 'admin123', 'is_admin': True}])
+content_store = JsonStore(CONTENT_FILE, {
+    'tracks': [],
+    'podcasts': [],
+    'favorites': {}
+})
+
+# Indexes kept in step with the stores so lookups never scan the lists
+users_by_name = users_store.add_index(KeyIndex([], 'username'))
+users_by_email = users_store.add_index(KeyIndex([], 'email'))
+user_ids = users_store.add_index(IdAllocator([]))
+tracks_by_id = content_store.add_index(KeyIndex(['tracks'], 'id'))
+track_ids = content_store.add_index(IdAllocator(['tracks']))
+favorite_ids = content_store.add_index(GroupIndex(['favorites']))
+
 # Load or create users
 def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return [{'id': 1, 'username': 'admin', 'email': 'admin@test.com', 'password': 'admin123', 'is_admin': True}]
+    return users_store.load()
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f)
+    users_store.save(users)
 
 # Load or create content
 def load_content():
-    if os.path.exists(CONTENT_FILE):
-        with open(CONTENT_FILE, 'r') as f:
-            return json.load(f)
-    return {
-        'tracks': [],
-        'podcasts': [],
-        'favorites': {}
-    }
+    return content_store.load()
 
 def save_content(content):
-    with open(CONTENT_FILE, 'w') as f:
-        json.dump(content, f)
+    content_store.save(content)
 
 @app.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
-    users = load_users()
-    
-    # Check if username already exists
-    if any(u['username'] == data['username'] for u in users):
-        return jsonify({'message': 'Username already exists'}), 400
     
-    # Check if email already exists
-    if any(u['email'] == data['email'] for u in users):
-        return jsonify({'message': 'Email already exists'}), 400
-    
-    # Create new user
-    new_user = {
-        'id': len(users) + 1,
-        'username': data['username'],
-        'email': data['email'],
-        'password': data['password'],
-        'is_admin': False
-    }
-    
-    users.append(new_user)
-    save_users(users)
+    with users_store.locked():
+        # Check if username already exists
+        if users_by_name.get(data['username']):
+            return jsonify({'message': 'Username already exists'}), 400
+        
+        # Check if email already exists
+        if users_by_email.get(data['email']):
+            return jsonify({'message': 'Email already exists'}), 400
+        
+        # Create new user
+        new_user = {
+            'id': user_ids.next_id(),
+            'username': data['username'],
+            'email': data['email'],
+            'password': data['password'],
+            'is_admin': False
+        }
+        
+        users_store.append([], new_user)
     
     return jsonify({'message': 'User registered successfully'}), 201
 
 @app.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
-    users = load_users()
+    load_users()
     
-    user = next((u for u in users if u['username'] == data['username'] and u['password'] == data['password']), None)
+    user = users_by_name.get(data['username'])
     
-    if user:
+    if user and user['password'] == data['password']:
         return jsonify({
             'token': f'token-{user["id"]}',
             'user_id': user['id'],
@@ -89,10 +105,10 @@ def login():
 def get_tracks():
     try:
         content = load_content()
-        print(f"Loading tracks - found {len(content['tracks'])} tracks")  # Debug
+        logger.debug('Loaded tracks', extra={'count': len(content['tracks'])})
         return jsonify(content['tracks'])
-    except Exception as e:
-        print(f"Error loading tracks: {str(e)}")
+    except Exception:
+        logger.exception('Loading tracks failed')
         return jsonify([]), 500
 
 @app.route('/podcasts')
@@ -102,33 +118,24 @@ def get_podcasts():
 
 @app.route('/favorites/<int:user_id>', methods=['GET', 'POST'])
 def favorites(user_id):
-    content = load_content()
-    
-    if 'favorites' not in content:
-        content['favorites'] = {}
-    
     user_key = str(user_id)
     
     if request.method == 'POST':
         data = request.get_json()
         track_id = data['track_id']
         
-        if user_key not in content['favorites']:
-            content['favorites'][user_key] = []
-        
-        if track_id not in content['favorites'][user_key]:
-            content['favorites'][user_key].append(track_id)
-            save_content(content)
-            return jsonify({'message': 'Added to favorites'})
-        else:
-            content['favorites'][user_key].remove(track_id)
-            save_content(content)
-            return jsonify({'message': 'Removed from favorites'})
-    
+        with content_store.locked():
+            if track_id not in favorite_ids.get(user_key):
+                content_store.append(['favorites', user_key], track_id)
+                return jsonify({'message': 'Added to favorites'})
+            else:
+                content_store.remove(['favorites', user_key], track_id)
+                return jsonify({'message': 'Removed from favorites'})
+    
+    load_content()
     # GET favorites
-    user_favorites = content['favorites'].get(user_key, [])
-    favorite_tracks = [track for track in content['tracks'] if track['id'] in user_favorites]
-    return jsonify(favorite_tracks)
+    favorite_tracks = [tracks_by_id.get(track_id) for track_id in favorite_ids.get(user_key)]
+    return jsonify([track for track in favorite_tracks if track])
 
 @app.route('/admin/upload', methods=['POST'])
 def upload_file():
@@ -141,38 +148,53 @@ def upload_file():
     
     if file and file.filename.lower().endswith(('.mp3', '.wav', '.m4a', '.flac')):
         filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        return jsonify({'message': 'File uploaded successfully', 'file_path': filename}), 201
+        stored = store_upload(file, app.config['UPLOAD_FOLDER'], filename)
+        job = ingest_queue.submit(stored)
+        return jsonify({
+            'message': 'File uploaded successfully',
+            'file_path': stored.filename,
+            'checksum': stored.checksum,
+            'duplicate': stored.duplicate,
+            'job_id': job['id']
+        }), 201
     
     return jsonify({'message': 'Invalid file type. Only audio files allowed.'}), 400
 
+@app.route('/admin/jobs/<job_id>')
+def ingest_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job)
+
 @app.route('/admin/tracks', methods=['POST'])
 def add_track():
     try:
         data = request.get_json()
-        print(f"Received track data: {data}")  # Debug
         
-        content = load_content()
-        print(f"Current tracks count: {len(content['tracks'])}")  # Debug
-        
-        # Generate proper ID
-        max_id = max([t['id'] for t in content['tracks']], default=0)
-        
-        new_item = {
-            'id': max_id + 1,
-            'title': data['title'],
-            'artist': data['artist'],
-            'type': 'track',
-            'category': data.get('category', ''),
-            'file_path': data['file_path']
-        }
+        # Anything the admin leaves blank comes from the upload's parsed headers
+        metadata = ingest_queue.metadata_for(data['file_path']) or {}
+        title = data.get('title') or metadata.get('title')
+        artist = data.get('artist') or metadata.get('artist')
+        if not title or not artist:
+            return jsonify({'message': 'Title and artist are required'}), 400
         
-        content['tracks'].append(new_item)
-        save_content(content)
+        with content_store.locked() as content:
+            # Generate proper ID
+            new_item = {
+                'id': track_ids.next_id(),
+                'title': title,
+                'artist': artist,
+                'duration': data.get('duration') or metadata.get('duration', 0),
+                'type': 'track',
+                'category': data.get('category', ''),
+                'file_path': data['file_path']
+            }
+            
+            content_store.append(['tracks'], new_item)
         
-        print(f"Track added successfully: {new_item}")  # Debug
-        print(f"New tracks count: {len(content['tracks'])}")  # Debug
+        logger.info('Track added', extra={'track_id': new_item['id'], 'file_path': new_item['file_path'],
+                                          'count': len(content['tracks'])})
         
         return jsonify({
             'message': 'Track added successfully', 
@@ -181,13 +203,11 @@ def add_track():
         }), 201
         
     except Exception as e:
-        print(f"Error adding track: {str(e)}")  # Debug
+        logger.exception('Adding track failed')
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
 @app.route('/test/add-track')
 def test_add_track():
-    content = load_content()
-    
     test_track = {
         'id': 999,
         'title': 'Test Song',
@@ -197,8 +217,8 @@ def test_add_track():
         'file_path': 'test.mp3'
     }
     
-    content['tracks'].append(test_track)
-    save_content(content)
+    with content_store.locked():
+        content_store.append(['tracks'], test_track)
     
     return jsonify({'message': 'Test track added', 'track': test_track})
 
@@ -206,20 +226,20 @@ def test_add_track():
 def stream_file(filename):
     try:
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        return send_file(file_path)
+        return send_audio(file_path)
     except:
         return jsonify({'message': 'File not found'}), 404
 
 @app.route('/stream/<content_type>/<int:content_id>')
 def stream_content(content_type, content_id):
-    content = load_content()
+    load_content()
     
     if content_type == 'track':
-        track = next((t for t in content['tracks'] if t['id'] == content_id), None)
+        track = tracks_by_id.get(content_id)
         if track and 'file_path' in track:
             try:
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], track['file_path'])
-                return send_file(file_path)
+                return send_audio(file_path)
             except:
                 pass
     
@@ -0,0 +1,223 @@
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import request, Response
+from werkzeug.http import parse_range_header
+from werkzeug.wsgi import wrap_file
+
+# Size of the blocks read from disk for every response body
+CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 64 * 1024))
+
+mimetypes.add_type('audio/mpeg', '.mp3')
+mimetypes.add_type('audio/flac', '.flac')
+mimetypes.add_type('audio/mp4', '.m4a')
+mimetypes.add_type('audio/wav', '.wav')
+
+
+def file_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(tag.strip() == etag for tag in header.split(','))
+
+
+def _not_modified(stat, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat.st_mtime) <= since
+    return False
+
+
+def _range_applies(stat, etag):
+    # A stale If-Range means the client has an old copy: send the whole file
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    try:
+        return int(stat.st_mtime) == int(parsedate_to_datetime(if_range).timestamp())
+    except (TypeError, ValueError):
+        return False
+
+
+def resolve_ranges(header, size):
+    """Turn a Range header into sorted, merged (start, end) pairs with an
+    exclusive end. Returns None when the header should be ignored and an
+    empty list when no range is satisfiable."""
+    rng = parse_range_header(header)
+    if rng is None or rng.units != 'bytes':
+        return None
+
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start = max(size + start, 0)
+            stop = size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+if hasattr(os, 'pread'):
+    def read_at(file, size, offset):
+        return os.pread(file.fileno(), size, offset)
+else:
+    def read_at(file, size, offset):
+        # No pread on Windows: each response opens its own file, so seeking it is safe
+        file.seek(offset)
+        return file.read(size)
+
+
+def read_blocks(file, start, stop):
+    offset = start
+    while offset < stop:
+        data = read_at(file, min(CHUNK_SIZE, stop - offset), offset)
+        if not data:
+            break
+        offset += len(data)
+        yield data
+
+
+class FileBody:
+    """Response body made of byte ranges of an open file, with optional
+    multipart boundaries between them. WSGI servers iterate it; the ASGI
+    bridge recognises it and reads the ranges without holding a thread."""
+
+    def __init__(self, file, ranges, parts=None):
+        self.file = file
+        self.ranges = ranges
+        self.parts = parts
+        self.sent = 0
+        # Called with the body once it is closed, e.g. to count self.sent
+        self.on_close = None
+
+    def pieces(self):
+        """Boundary bytes and (start, stop) ranges in response order."""
+        for index, byte_range in enumerate(self.ranges):
+            if self.parts:
+                yield self.parts[index]
+            yield byte_range
+            if self.parts:
+                yield b'\r\n'
+        if self.parts:
+            yield self.parts[-1]
+
+    def __iter__(self):
+        for piece in self.pieces():
+            if isinstance(piece, bytes):
+                yield piece
+            else:
+                for block in read_blocks(self.file, *piece):
+                    self.sent += len(block)
+                    yield block
+
+    def close(self):
+        self.file.close()
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(self)
+
+
+def _range_body(path, ranges, parts=None):
+    return FileBody(open(path, 'rb'), ranges, parts)
+
+
+def send_audio(path, mimetype=None, start=None):
+    """Serve an audio file with conditional GET and single or multi-part
+    byte range support. A start offset answers with the rest of the file
+    from there, as if it had been requested with Range: bytes=start-."""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(stat)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+    }
+
+    if _not_modified(stat, etag):
+        return Response(status=304, headers=headers)
+
+    range_header = request.headers.get('Range')
+    ranges = None
+    if start is not None:
+        ranges = [(start, size)] if start < size else []
+    elif range_header and _range_applies(stat, etag):
+        ranges = resolve_ranges(range_header, size)
+
+    if ranges == []:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if not ranges:
+        # Whole file: let the WSGI server use sendfile() when it offers it
+        headers['Content-Length'] = str(size)
+        body = wrap_file(request.environ, open(path, 'rb'), CHUNK_SIZE)
+        return Response(body, 200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(_range_body(path, ranges), 206, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    parts.append(f'--{boundary}--\r\n'.encode())
+    length = sum(len(p) for p in parts) + sum(stop - start + 2 for start, stop in ranges)
+    headers['Content-Length'] = str(length)
+    return Response(_range_body(path, ranges, parts), 206, headers=headers,
+                    content_type=f'multipart/byteranges; boundary={boundary}',
+                    direct_passthrough=True)
+
+
+def send_slice(path, start, stop, mimetype=None, etag=None, max_age=None):
+    """Serve bytes [start, stop) of a file as a resource of its own, e.g. a
+    segment cut at frame boundaries. With max_age the response is marked
+    immutable: its URL must change whenever the bytes do."""
+    stat = os.stat(path)
+    etag = etag or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{start:x}-{stop:x}"'
+    headers = {'ETag': etag, 'Last-Modified': formatdate(stat.st_mtime, usegmt=True)}
+    if max_age is not None:
+        headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=headers)
+
+    stop = min(stop, stat.st_size)
+    headers['Content-Length'] = str(max(stop - start, 0))
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return Response(_range_body(path, [(start, stop)]), 200, headers=headers,
+                    mimetype=mimetype, direct_passthrough=True)
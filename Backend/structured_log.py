@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Each message template may be logged this many times per window before being suppressed
+LOG_RATE = int(os.getenv('LOG_RATE', 20))
+LOG_RATE_WINDOW = float(os.getenv('LOG_RATE_WINDOW', 10))
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any
+    fields passed with extra=."""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets each (logger, message template) through at most `rate` times per
+    `window` seconds. The first record after a quiet spell carries the
+    number dropped in the field `suppressed`."""
+
+    def __init__(self, rate=LOG_RATE, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.rate = rate
+        self.window = window
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            started, count, dropped = self.buckets.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.rate:
+                self.buckets[key] = (started, count, dropped + 1)
+                return False
+            self.buckets[key] = (started, count + 1, 0)
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+
+def configure_logging(level=LOG_LEVEL, stream=None):
+    """Send the root logger's records to stderr as rate-limited JSON lines.
+    Leaves logging alone if the host (a server, a test runner) set it up."""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RateLimitFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
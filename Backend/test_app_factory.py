@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter: building an app here would rebind the services the other tests use
+CHILD = """
+import json, os, sys
+import app as module
+folder = sys.argv[1]
+result = {'built_on_import': 'app' in vars(module), 'folder_on_import': os.path.exists(folder),
+          'loaded_on_import': [name for name in ('dotenv', 'sqlalchemy.dialects.postgresql') if name in sys.modules]}
+app = module.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(folder, 'factory.db'),
+                         'UPLOAD_FOLDER': folder})
+with app.app_context():
+    module.upgrade(module.db.engine, module.db.metadata, echo=lambda message: None)
+    from commands import seed_sample_data
+    result['seeded'] = [seed_sample_data(), seed_sample_data()]
+client = app.test_client()
+token = client.post('/login', json={'username': 'admin', 'password': 'admin123'}).get_json()['token']
+result['search'] = [item['title'] for item in client.get('/search?q=sample').get_json()]
+result['admin'] = client.get('/admin/db/stats', headers={'Authorization': 'Bearer ' + token}).status_code
+result['blueprints'] = sorted(app.blueprints)
+print(json.dumps(result))
+"""
+
+
+def test_import_builds_nothing_and_seeding_is_idempotent(tmp_path):
+    folder = str(tmp_path / 'instance')
+    env = {k: v for k, v in os.environ.items() if k not in ('DATABASE_URL', 'UPLOAD_FOLDER')}
+    run = subprocess.run([sys.executable, '-c', CHILD, folder], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, timeout=60)
+    assert run.returncode == 0, run.stderr
+    result = json.loads(run.stdout.splitlines()[-1])
+    assert not result['built_on_import'] and not result['folder_on_import']
+    assert result['loaded_on_import'] == []
+    assert result['seeded'] == [4, 0]
+    assert result['search'] == ['Sample Song 1', 'Sample Song 2']
+    assert result['admin'] == 200
+    assert result['blueprints'] == ['admin', 'auth', 'catalog', 'playlists', 'streaming']
@@ -0,0 +1,96 @@
+import asyncio
+import os
+
+from asgi import BATCH_SIZE, WsgiBridge
+from models import db, Track
+from streaming import CHUNK_SIZE
+
+
+def call(bridge, path, headers=(), body=b'', method='GET', disconnect_after=None):
+    """Run one request through the bridge; the client hangs up after
+    disconnect_after body messages if given."""
+    async def run():
+        hang_up = asyncio.Event()
+        messages = []
+        request = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            if request:
+                return request.pop()
+            await hang_up.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+            bodies = sum(m['type'] == 'http.response.body' for m in messages)
+            if disconnect_after is not None and bodies >= disconnect_after:
+                hang_up.set()
+                # Let the bridge see the disconnect before the next send
+                await asyncio.sleep(0.01)
+
+        path_info, _, query = path.partition('?')
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method, 'path': path_info,
+                 'query_string': query.encode(), 'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+                 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234), 'scheme': 'http'}
+        await asyncio.wait_for(bridge(scope, receive, send), 10)
+        return messages
+
+    messages = asyncio.run(run())
+    start = messages[0]
+    return (start['status'], {k.decode(): v.decode() for k, v in start['headers']},
+            b''.join(m.get('body', b'') for m in messages[1:]), messages)
+
+
+def test_bridge_streams_ranges_and_serves_json(app, tmp_path):
+    data = os.urandom(3 * CHUNK_SIZE + 123)
+    path = str(tmp_path / 'track.mp3')
+    with open(path, 'wb') as f:
+        f.write(data)
+    with app.app_context():
+        track = Track(title='Bridged', artist='Test', file_path=path)
+        db.session.add(track)
+        db.session.commit()
+        track_id = track.id
+    bridge = WsgiBridge(app, threads=2, io_threads=2)
+
+    status, headers, body, _ = call(bridge, f'/stream/track/{track_id}')
+    assert status == 200 and body == data
+    assert headers['content-length'] == str(len(data))
+
+    status, headers, body, _ = call(bridge, f'/stream/track/{track_id}', [('Range', 'bytes=100-')])
+    assert status == 206 and body == data[100:]
+    assert headers['content-range'] == f'bytes 100-{len(data) - 1}/{len(data)}'
+
+    status, headers, body, _ = call(bridge, f'/stream/track/{track_id}', [('Range', 'bytes=0-9,20-29')])
+    assert status == 206 and headers['content-type'].startswith('multipart/byteranges')
+    assert data[:10] in body and data[20:30] in body
+
+    status, _, body, messages = call(bridge, f'/stream/track/{track_id}', disconnect_after=1)
+    assert status == 200 and len(body) < len(data)
+    assert messages[-1].get('more_body')
+
+    status, headers, body, _ = call(bridge, '/tracks?limit=100')
+    assert status == 200 and headers['content-type'] == 'application/json'
+    assert b'Bridged' in body
+
+    status, _, body, _ = call(bridge, '/login', [('Content-Type', 'application/json')],
+                              body=b'{"username": "nobody", "password": "x"}', method='POST')
+    assert status == 401
+
+
+def test_bridge_batches_small_chunks():
+    def many_chunks(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return (b'x' * 100 for _ in range(2000))
+
+    def one_chunk(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'small']
+
+    status, _, body, messages = call(WsgiBridge(many_chunks, threads=1, io_threads=1), '/')
+    assert status == 200 and body == b'x' * 200000
+    assert len(messages) - 1 == 200000 // BATCH_SIZE + 1
+    assert all(len(m['body']) >= BATCH_SIZE for m in messages[1:-1])
+
+    _, _, body, messages = call(WsgiBridge(one_chunk, threads=1, io_threads=1), '/')
+    assert body == b'small' and len(messages) == 2 and not messages[1].get('more_body')
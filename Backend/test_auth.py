@@ -0,0 +1,115 @@
+import itertools
+import time
+from datetime import timedelta
+
+from flask_jwt_extended import create_access_token
+
+from auth import RoleCache
+from extensions import jwt, role_cache
+from models import db, User
+
+
+USER_NUMBERS = itertools.count()
+
+
+def make_user(app, is_admin=True, claim=None):
+    """A user and auth headers for a token carrying claim as its is_admin claim, if given."""
+    n = next(USER_NUMBERS)
+    with app.app_context():
+        user = User(username=f'auth{n}', email=f'auth{n}@test.com', password_hash='x', is_admin=is_admin)
+        db.session.add(user)
+        db.session.commit()
+        claims = {} if claim is None else {'is_admin': claim}
+        token = create_access_token(identity=str(user.id), additional_claims=claims)
+        return user.id, {'Authorization': f'Bearer {token}'}
+
+
+def admin_status(app, headers):
+    return app.test_client().get('/admin/cache/stats', headers=headers).status_code
+
+
+def test_demotion_applies_once_committed(app):
+    user_id, headers = make_user(app, is_admin=True, claim=True)
+    assert admin_status(app, headers) == 200
+    with app.app_context():
+        db.session.get(User, user_id).is_admin = False
+        db.session.flush()
+        # Not yet: the change may still roll back
+        assert role_cache.is_admin(user_id)
+        db.session.commit()
+    assert admin_status(app, headers) == 403
+
+
+def test_bulk_updates_apply_after_invalidate(app):
+    user_id, headers = make_user(app, is_admin=True)
+    assert admin_status(app, headers) == 200
+    with app.app_context():
+        User.query.filter_by(id=user_id).update({'is_admin': False})
+        db.session.commit()
+    # query.update() skips the mapper events: the cached role stands until dropped
+    assert admin_status(app, headers) == 200
+    role_cache.invalidate(user_id)
+    assert admin_status(app, headers) == 403
+
+
+def test_token_claims_never_grant_admin(app):
+    # A stale claim from before a demotion is checked against the database
+    _, stale = make_user(app, is_admin=False, claim=True)
+    assert admin_status(app, stale) == 403
+    # A false claim is trusted without a lookup: a promoted user logs in again
+    _, old = make_user(app, is_admin=True, claim=False)
+    assert admin_status(app, old) == 403
+    _, unclaimed = make_user(app, is_admin=True)
+    assert admin_status(app, unclaimed) == 200
+    assert app.test_client().get('/admin/cache/stats').status_code == 401
+
+
+def test_deleted_user_loses_admin(app):
+    user_id, headers = make_user(app, is_admin=True)
+    assert admin_status(app, headers) == 200
+    with app.app_context():
+        db.session.delete(db.session.get(User, user_id))
+        db.session.commit()
+    assert admin_status(app, headers) == 403
+
+
+def test_role_cache_expires_and_stays_bounded():
+    loads = []
+    roles = {1: True, 2: False, 3: True}
+
+    def load(user_id):
+        loads.append(user_id)
+        return roles.get(user_id)
+
+    cache = RoleCache(load, ttl=0.05, max_entries=2)
+    assert [cache.is_admin(1), cache.is_admin(1), cache.is_admin(2)] == [True, True, False]
+    assert loads == [1, 2] and cache.stats() == {'entries': 2, 'hits': 1, 'misses': 2}
+    roles[1] = False
+    time.sleep(0.06)
+    assert cache.is_admin(1) is False and loads == [1, 2, 1]
+    # Full: expired entries make room
+    assert cache.is_admin(3) and set(cache.entries) == {1, 3}
+    assert cache.is_admin(4) is False
+
+
+def test_verified_tokens_are_cached_until_they_expire(app, monkeypatch):
+    monkeypatch.setattr(jwt, 'max_tokens', 2)
+    jwt.tokens.clear()
+    user_ids = []
+    for _ in range(3):
+        user_id, headers = make_user(app, is_admin=True)
+        user_ids.append(user_id)
+        assert admin_status(app, headers) == 200
+    # Only the newest tokens are kept
+    assert len(jwt.tokens) == 2
+    token = next(iter(jwt.tokens))[0]
+    assert admin_status(app, {'Authorization': f'Bearer {token}'}) == 200
+
+    with app.app_context():
+        short = create_access_token(identity=str(user_ids[0]), expires_delta=timedelta(seconds=1))
+    headers = {'Authorization': f'Bearer {short}'}
+    assert admin_status(app, headers) == 200
+    assert (short, None) in jwt.tokens
+    time.sleep(1.1)
+    # The cached claims are not used past their exp
+    assert admin_status(app, headers) == 401
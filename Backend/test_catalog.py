@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy.exc import IntegrityError
+
+from models import db, PlaylistTrack, Podcast, Track, User
+
+CATEGORY = 'catalog-test'
+
+
+@pytest.fixture
+def content(app):
+    # Shared ids and timestamps across the two tables, so only the type breaks ties
+    first, second = datetime(2024, 5, 1), datetime(2024, 5, 2)
+    with app.app_context():
+        tracks = [Track(id=n + 1, title=f'Track {n}', artist='Catalog', file_path=f'c{n}.mp3',
+                        category=CATEGORY if n < 5 else 'other', created_at=first if n % 2 else second)
+                  for n in range(6)]
+        podcasts = [Podcast(id=n + 1, title=f'Episode {n}', host='Catalog', podcast_name='Show',
+                            file_path=f'e{n}.mp3', category=CATEGORY, created_at=first if n < 2 else second)
+                    for n in range(4)]
+        user = User(username='catalog-test', email='catalog@test.com', password_hash='x')
+        db.session.add_all(tracks + podcasts + [user])
+        db.session.commit()
+        expected = sorted(
+            ((item.created_at, item.id, kind) for kind, items in (('track', tracks[:5]), ('podcast', podcasts))
+             for item in items))
+        token = create_access_token(identity=str(user.id))
+    return expected, token
+
+
+def test_catalog_pages_through_ties_across_types(app, content):
+    expected, _ = content
+    client = app.test_client()
+    seen, cursor = [], None
+    while True:
+        url = f'/catalog?category={CATEGORY}&limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert len(page) <= 2
+        seen += [(item['id'], item['type']) for item in page]
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == [(item_id, kind) for _, item_id, kind in expected]
+
+    items = client.get(f'/catalog?category={CATEGORY}&fields=id,artist,host&limit=100').get_json()
+    assert all(set(item) == {'id', 'artist' if item['type'] == 'track' else 'host', 'type'} for item in items)
+    assert client.get('/catalog?cursor=garbage').status_code == 400
+
+
+def test_playlists_hold_exactly_one_item_per_entry(app, content):
+    _, token = content
+    headers = {'Authorization': f'Bearer {token}'}
+    client = app.test_client()
+    playlist_id = client.post('/playlists', json={'name': 'Mixed'}, headers=headers).get_json()['id']
+    url = f'/playlists/{playlist_id}/tracks'
+    entries = []
+    for body in ({'track_id': 2}, {'podcast_id': 2}, {'track_id': 1}):
+        response = client.post(url, json=body, headers=headers)
+        assert response.status_code == 201
+        entries.append(response.get_json()['entry_id'])
+    for body in ({}, {'track_id': 2, 'podcast_id': 2}):
+        assert client.post(url, json=body, headers=headers).status_code == 400
+    assert client.get(url, headers=headers).get_json() == [
+        {'id': 2, 'title': 'Track 1', 'artist': 'Catalog', 'type': 'track', 'entry_id': entries[0]},
+        {'id': 2, 'title': 'Episode 1', 'host': 'Catalog', 'type': 'podcast', 'entry_id': entries[1]},
+        {'id': 1, 'title': 'Track 0', 'artist': 'Catalog', 'type': 'track', 'entry_id': entries[2]},
+    ]
+
+    with app.app_context():
+        db.session.add(PlaylistTrack(playlist_id=playlist_id, track_id=2, podcast_id=2))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
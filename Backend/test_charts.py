@@ -0,0 +1,142 @@
+import random
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from charts import HOUR, Charts, PlayCounts, TopK
+from extensions import charts, play_buffer
+from models import db, PlayCount, Track, User
+
+START = datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp()
+
+
+def test_topk_matches_a_sort_of_growing_scores():
+    rng = random.Random(23)
+    chart = TopK(5)
+    scores = Counter()
+    for _ in range(2000):
+        key = rng.randrange(40) if rng.random() < 0.5 else rng.randrange(5)
+        scores[key] += rng.random()
+        chart.offer(key, scores[key])
+        assert chart.ranked() == sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:5]
+
+
+def test_windows_slide_and_trending_decays():
+    counts = PlayCounts(k=10, half_life=6 * HOUR, now=START)
+    for _ in range(10):
+        counts.add(('track', 1), 'Pop', START)
+    counts.add(('track', 2), 'Rock', START)
+    counts.add(('podcast', 1), 'Talk', START - 3 * 24 * HOUR)  # a play from before this day
+    assert counts.top('day') == [(('track', 1), 10), (('track', 2), 1)]
+    assert counts.top('week') == [(('track', 1), 10), (('podcast', 1), 1), (('track', 2), 1)]
+    assert counts.top('day', 'Rock') == [(('track', 2), 1)]
+    assert counts.top('day', 'Jazz') == []
+
+    later = START + 25 * HOUR
+    counts.advance(later)
+    for _ in range(3):
+        counts.add(('track', 2), 'Rock', later)
+    # A day on, the earlier plays have left the day window but not the week
+    assert counts.top('day') == [(('track', 2), 3)]
+    assert counts.top('week')[:2] == [(('track', 1), 10), (('track', 2), 4)]
+    # 10 plays four half-lives ago now weigh 10 / 16, under 3 fresh ones
+    trending = counts.trending(later)
+    assert [key for key, _ in trending][:2] == [('track', 2), ('track', 1)]
+    assert dict(trending)[('track', 1)] == pytest.approx(10 * 2 ** (-25 / 6), abs=1e-3)
+
+    # Rescaling the stored scores changes neither their order nor their value
+    counts.advance(START + 60 * HOUR)
+    rescaled = counts.trending(START + 60 * HOUR)
+    assert counts.landmark == START + 60 * HOUR
+    assert dict(rescaled)[('track', 2)] == pytest.approx(3 * 2 ** (-35 / 6) + 2 ** (-60 / 6), abs=1e-3)
+    assert counts.top('day') == [] and counts.top('month')[0] == (('track', 1), 10)
+
+
+class MemoryStore:
+    def __init__(self, categories):
+        self.counts = Counter()
+        self.categories = categories
+        self.plays = []
+        self.failing = False
+
+    def load(self, since_hour):
+        return [(hour, t, i, self.categories[t, i], n) for (hour, t, i), n in self.counts.items() if hour >= since_hour]
+
+    def save(self, increments, prune_before=None):
+        if self.failing:
+            raise OSError('database is locked')
+        self.counts.update(increments)
+
+    def clear(self):
+        self.counts.clear()
+
+    def history(self, since, until):
+        return [play for play in self.plays if since <= play[0] <= until]
+
+
+def test_processes_share_counts_through_the_store():
+    now = [START]
+    store = MemoryStore({('track', 1): 'Pop', ('track', 2): 'Pop'})
+    first, second = (Charts(store, persist_seconds=0, clock=lambda: now[0]) for _ in range(2))
+    played_at = datetime.utcfromtimestamp(START)
+    first.add([('track', 1, 'Pop', played_at)] * 2)
+    second.add([('track', 2, 'Pop', played_at)])
+    assert second.top() == [(('track', 2), 1)]
+
+    store.failing = True
+    assert first.persist() == 0
+    store.failing = False
+    assert first.persist() == 1 and second.persist() == 1
+    second.rebuild()
+    assert second.top('day', 'Pop') == [(('track', 1), 2), (('track', 2), 1)]
+
+    # Counts lost from the store are recounted from the play history
+    store.clear()
+    store.plays = [(played_at, 'track', 2)] * 3
+    first.rebuild(from_history=True)
+    assert first.top() == [(('track', 2), 3)]
+    assert sum(store.counts.values()) == 3
+
+
+def test_chart_routes_count_recorded_plays(app):
+    with app.app_context():
+        tracks = [Track(title=f'Charted {n}', artist='Charts', file_path=f'chart{n}.mp3', category='charts-test')
+                  for n in range(3)]
+        user = User(username='charts-test', email='charts@test.com', password_hash='x')
+        db.session.add_all(tracks + [user])
+        db.session.commit()
+        track_ids, user_id = [t.id for t in tracks], user.id
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+
+    client = app.test_client()
+    for track_id, plays in zip(track_ids, (1, 3, 2)):
+        for _ in range(plays):
+            # Repeats within one flush coalesce, so flush between them
+            client.post('/recently-played', json={'track_id': track_id}, headers=headers)
+            play_buffer.flush()
+
+    top = client.get('/charts/top?category=charts-test').get_json()
+    assert [(item['id'], item['plays']) for item in top] == [(track_ids[1], 3), (track_ids[2], 2), (track_ids[0], 1)]
+    assert top[0] == {'id': track_ids[1], 'title': 'Charted 1', 'artist': 'Charts', 'type': 'track', 'plays': 3}
+    trending = client.get('/charts/trending?category=charts-test&limit=2').get_json()
+    assert [item['id'] for item in trending] == [track_ids[1], track_ids[2]]
+    assert client.get('/charts/top?window=year').status_code == 400
+
+    # Saved counts survive a rebuild
+    charts.rebuild()
+    with app.app_context():
+        saved = db.session.query(PlayCount).filter(PlayCount.content_id.in_(track_ids),
+                                                   PlayCount.content_type == 'track').all()
+        assert sum(row.plays for row in saved) == 6
+    assert client.get('/charts/top?window=month&category=charts-test').get_json() == top
+
+    # A deleted track leaves the charts, and its counts can't pass to a track reusing its id
+    with app.app_context():
+        db.session.delete(db.session.get(Track, track_ids[1]))
+        db.session.commit()
+        assert not db.session.query(PlayCount).filter_by(content_type='track', content_id=track_ids[1]).count()
+    track_ids.pop(1)
+    top = client.get('/charts/top?category=charts-test').get_json()
+    assert [item['id'] for item in top] == [track_ids[1], track_ids[0]]
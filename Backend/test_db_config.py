@@ -0,0 +1,84 @@
+import logging
+import threading
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from db_config import MeteredQueuePool, configure_engine, engine_options, pool_stats, use_primary
+from models import db, Track
+
+
+@pytest.fixture
+def replica(app, tmp_path, monkeypatch):
+    engine = create_engine('sqlite:///' + str(tmp_path / 'replica.db'))
+    db.metadata.create_all(engine, tables=[Track.__table__])
+    with engine.begin() as connection:
+        connection.execute(Track.__table__.insert().values(title='On replica', artist='A', file_path='r.mp3'))
+    with app.app_context():
+        db.session.add(Track(title='On primary', artist='A', file_path='p.mp3'))
+        db.session.commit()
+        monkeypatch.setitem(db.engines, 'replica', engine)
+    yield engine
+    engine.dispose()
+
+
+def titles():
+    return db.session.scalars(select(Track.title)).all()
+
+
+def test_reads_in_get_requests_use_the_replica(app, replica):
+    with app.test_request_context('/tracks', method='GET'):
+        assert titles() == ['On replica']
+        # Writes go to the primary even while handling a GET
+        db.session.add(Track(title='Written in GET', artist='A', file_path='w.mp3'))
+        db.session.commit()
+        assert titles() == ['On replica']
+        use_primary()
+        assert titles() == ['On primary', 'Written in GET']
+    with app.test_request_context('/tracks', method='HEAD'):
+        assert titles() == ['On replica']
+    with app.test_request_context('/tracks', method='POST'):
+        assert titles() == ['On primary', 'Written in GET']
+    with app.app_context():
+        assert titles() == ['On primary', 'Written in GET']
+
+
+def test_pool_metrics_count_waits_and_timeouts(tmp_path):
+    options = dict(engine_options('sqlite:///' + str(tmp_path / 'pool.db')), pool_size=1, max_overflow=0,
+                   pool_timeout=0.05)
+    engine = create_engine('sqlite:///' + str(tmp_path / 'pool.db'), **options)
+    configure_engine(engine)
+    assert isinstance(engine.pool, MeteredQueuePool)
+
+    held = engine.connect()
+    with pytest.raises(PoolTimeout):
+        engine.connect()
+    stats = pool_stats(engine)
+    assert (stats['checkouts'], stats['timeouts'], stats['connects']) == (1, 1, 1)
+    assert stats['wait_max_ms'] >= 50
+    assert (stats['size'], stats['checked_out'], stats['idle']) == (1, 1, 0)
+
+    # A waiting checkout gets the connection once it is returned
+    waiter = threading.Thread(target=lambda: engine.connect().close())
+    waiter.start()
+    held.close()
+    waiter.join()
+    stats = pool_stats(engine)
+    assert (stats['checkouts'], stats['connects'], stats['checked_out'], stats['idle']) == (2, 1, 0, 1)
+
+    # Metrics survive dispose(), which swaps in a recreated pool
+    engine.dispose()
+    assert pool_stats(engine)['checkouts'] == 2
+    engine.dispose()
+
+
+def test_pool_leaves_checkouts_unlogged(tmp_path, caplog):
+    caplog.set_level(logging.DEBUG)
+    engine = create_engine('sqlite:///' + str(tmp_path / 'quiet.db'),
+                           **engine_options('sqlite:///' + str(tmp_path / 'quiet.db')))
+    configure_engine(engine)
+    with engine.connect():
+        pass
+    engine.dispose()
+    assert not [r for r in caplog.records if 'pool' in r.name.lower()]
@@ -0,0 +1,86 @@
+import os
+import random
+
+import pytest
+
+from hls import SegmentedAudio, load_manifest, manifest_path, segment
+from models import db, Podcast
+from seek_index import scan_mp3
+from test_seek_index import BITRATE_INDEX, FRAME_SECONDS, mp3_stream
+
+
+def vbr_stream(frames, seed=17):
+    rng = random.Random(seed)
+    return mp3_stream([rng.choice(list(BITRATE_INDEX)) for _ in range(frames)], id3=b'ID3\x03' + bytes(6))
+
+
+def test_segments_cover_audio_on_frame_boundaries():
+    data, starts = vbr_stream(2000)
+    segmented = SegmentedAudio(scan_mp3(data), segment_seconds=10)
+    assert len(segmented) == 6
+
+    ranges = [segmented.byte_range(i) for i in range(len(segmented))]
+    assert ranges[0][0] == starts[0] and ranges[-1][1] == len(data)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    for index, (start, stop) in enumerate(ranges):
+        assert start == starts[int(index * 10 / FRAME_SECONDS)]
+    assert sum(segmented.duration_of(i) for i in range(len(segmented))) == pytest.approx(2000 * FRAME_SECONDS)
+    assert segmented.segment_for(35) == 3
+    with pytest.raises(IndexError):
+        segmented.byte_range(6)
+
+
+def test_manifest_is_written_once_per_version(tmp_path):
+    path = str(tmp_path / 'episode.mp3')
+    with open(path, 'wb') as f:
+        f.write(vbr_stream(1000)[0])
+    segmented = segment(path, 5)
+    manifest = load_manifest(path, segmented)
+    lines = manifest.splitlines()
+    assert lines[0] == '#EXTM3U' and lines[-1] == '#EXT-X-ENDLIST'
+    assert '#EXT-X-TARGETDURATION:5' in lines
+    assert lines.count(f'segments/{segmented.version}/0.mp3') == 1
+    assert sum(line.startswith('#EXTINF:') for line in lines) == len(segmented)
+
+    first_file = manifest_path(path, segmented.version, 5)
+    assert open(first_file).read() == manifest
+    with open(path, 'wb') as f:
+        f.write(vbr_stream(500, seed=18)[0])
+    os.utime(path, ns=(segmented.table.mtime_ns + 10 ** 9,) * 2)
+    replaced = segment(path, 5)
+    assert load_manifest(path, replaced) != manifest
+    assert not os.path.exists(first_file)
+
+
+def test_segment_routes(app, tmp_path):
+    data, starts = vbr_stream(3000)
+    path = str(tmp_path / 'episode.mp3')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with app.app_context():
+        podcast = Podcast(title='Episode', host='Host', podcast_name='Show', file_path=path)
+        db.session.add(podcast)
+        db.session.commit()
+        podcast_id = podcast.id
+
+    client = app.test_client()
+    playlist = client.get(f'/stream/podcast/{podcast_id}/playlist.m3u8')
+    assert playlist.mimetype == 'application/vnd.apple.mpegurl'
+    assert playlist.headers['Cache-Control'] == 'no-cache'
+    uris = [line for line in playlist.get_data(as_text=True).splitlines() if not line.startswith('#')]
+
+    body = b''
+    for uri in uris:
+        response = client.get(f'/stream/podcast/{podcast_id}/{uri}')
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        body += response.data
+    assert body == data[starts[0]:]
+
+    segment_url = f'/stream/podcast/{podcast_id}/{uris[3]}'
+    etag = client.get(segment_url).headers['ETag']
+    assert client.get(segment_url, headers={'If-None-Match': etag}).status_code == 304
+    stale = segment_url.replace('/segments/', '/segments/0-')
+    assert client.get(stale).status_code == 404
+    assert client.get(f'/stream/podcast/{podcast_id}/{uris[0][:-5]}{len(uris)}.mp3').status_code == 404
@@ -0,0 +1,172 @@
+import io
+import os
+import struct
+import time
+import wave
+
+from audio_metadata import read_metadata
+from ingest import IngestQueue, store_upload
+from test_seek_index import mp3_stream
+from werkzeug.datastructures import FileStorage
+
+
+def id3_tag(frames, padding=0):
+    body = b''.join(name + len(value).to_bytes(4, 'big') + b'\x00\x00' + value for name, value in frames)
+    body += bytes(padding)
+    size = len(body)
+    return b'ID3\x03\x00\x00' + bytes([(size >> 21) & 127, (size >> 14) & 127, (size >> 7) & 127, size & 127]) + body
+
+
+def mp3_file(seconds=10, padding=0):
+    tag = id3_tag([(b'TIT2', b'\x03Song\x00'), (b'TPE1', b'\x03Singer\x00')], padding)
+    frames = round(seconds * 44100 / 1152)
+    return mp3_stream([128] * frames, id3=tag)[0]
+
+
+def wav_file(path, seconds=2, rate=8000, channels=2):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(rate * channels * 2 * seconds))
+    info = b'INFO' + b''.join(name + struct.pack('<I', len(value)) + value
+                              for name, value in ((b'INAM', b'Wave\x00\x00'), (b'IART', b'Waver\x00')))
+    with open(path, 'r+b') as f:
+        f.seek(0, 2)
+        f.write(b'LIST' + struct.pack('<I', len(info)) + info)
+        size = f.tell()
+        f.seek(4)
+        f.write(struct.pack('<I', size - 8))
+
+
+def flac_file(seconds=3, rate=44100, channels=2):
+    packed = (rate << 44) | ((channels - 1) << 41) | (15 << 36) | (rate * seconds)
+    streaminfo = bytes(10) + packed.to_bytes(8, 'big') + bytes(16)
+    comments = [b'TITLE=Lossless', b'ARTIST=Flacker']
+    vorbis = struct.pack('<I', 6) + b'vendor' + struct.pack('<I', len(comments)) + b''.join(
+        struct.pack('<I', len(c)) + c for c in comments)
+    return (b'fLaC' + bytes([0]) + len(streaminfo).to_bytes(3, 'big') + streaminfo
+            + bytes([0x84]) + len(vorbis).to_bytes(3, 'big') + vorbis + bytes(4000))
+
+
+def atom(kind, body):
+    return struct.pack('>I', len(body) + 8) + kind + body
+
+
+def m4a_file(seconds=4, timescale=1000):
+    mvhd = atom(b'mvhd', bytes(4) + bytes(8) + struct.pack('>II', timescale, seconds * timescale) + bytes(80))
+    items = atom(b'ilst', atom(b'\xa9nam', atom(b'data', bytes(8) + b'Boxed'))
+                 + atom(b'\xa9ART', atom(b'data', bytes(8) + b'Boxer')))
+    udta = atom(b'udta', atom(b'meta', bytes(4) + items))
+    return atom(b'ftyp', b'M4A \x00\x00\x00\x00') + atom(b'moov', mvhd + udta) + atom(b'mdat', bytes(16000))
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_mp3_duration_bitrate_and_tags(tmp_path):
+    meta = read_metadata(write(tmp_path / 'a.mp3', mp3_file()))
+    assert meta == {'format': 'mp3', 'title': 'Song', 'artist': 'Singer', 'sample_rate': 44100, 'channels': 1,
+                    'bitrate': 128, 'duration': 10}
+
+
+def test_mp3_after_a_tag_longer_than_the_header_read(tmp_path):
+    # Cover art can make the ID3v2 tag larger than what is read to find it
+    meta = read_metadata(write(tmp_path / 'art.mp3', mp3_file(padding=400 * 1024)))
+    assert (meta['title'], meta['duration'], meta['bitrate']) == ('Song', 10, 128)
+
+
+def test_wav_flac_and_m4a(tmp_path):
+    path = str(tmp_path / 'a.wav')
+    wav_file(path)
+    assert read_metadata(path) == {'format': 'wav', 'channels': 2, 'sample_rate': 8000, 'bitrate': 256,
+                                   'title': 'Wave', 'artist': 'Waver', 'duration': 2}
+
+    meta = read_metadata(write(tmp_path / 'a.flac', flac_file()))
+    assert {k: meta[k] for k in ('format', 'sample_rate', 'channels', 'duration', 'title', 'artist')} == {
+        'format': 'flac', 'sample_rate': 44100, 'channels': 2, 'duration': 3, 'title': 'Lossless',
+        'artist': 'Flacker'}
+    assert meta['bitrate'] == round(os.path.getsize(tmp_path / 'a.flac') * 8 / 3 / 1000)
+
+    data = m4a_file()
+    assert read_metadata(write(tmp_path / 'a.m4a', data)) == {
+        'format': 'm4a', 'duration': 4, 'title': 'Boxed', 'artist': 'Boxer', 'bitrate': round(len(data) * 8 / 4000)}
+
+
+def test_store_upload_is_content_addressed(tmp_path):
+    first = store_upload(FileStorage(io.BytesIO(b'same bytes'), 'one.MP3'), str(tmp_path), 'one.MP3')
+    second = store_upload(FileStorage(io.BytesIO(b'same bytes'), 'two.mp3'), str(tmp_path), 'two.mp3')
+    other = store_upload(FileStorage(io.BytesIO(b'other bytes'), 'three.mp3'), str(tmp_path), 'three.mp3')
+    assert first.filename.endswith('.mp3') and not first.duplicate
+    assert (second.filename, second.duplicate) == (first.filename, True)
+    assert other.filename != first.filename
+    # Nothing but the two stored files is left behind
+    assert sorted(os.listdir(tmp_path)) == sorted([first.filename, other.filename])
+
+
+def test_failing_callback_leaves_the_job_done(tmp_path):
+    write(tmp_path / 'a.mp3', mp3_file(seconds=1))
+    queue = IngestQueue(str(tmp_path), workers=1)
+    seen = []
+    queue.on_complete(lambda filename, metadata: 1 / 0)
+    queue.on_complete(lambda filename, metadata: seen.append(metadata['duration']))
+    job = {'id': 'job1', 'file_path': 'a.mp3', 'status': 'queued', 'metadata': None, 'error': None}
+    queue._run(job)
+    assert queue.get('job1')['status'] == 'done' and seen == [1]
+    assert queue.metadata_for('a.mp3')['duration'] == 1
+
+
+def upload(client, headers, name, data):
+    response = client.post('/admin/upload', headers=headers, content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(data), name)})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def finished(client, headers, job_id):
+    deadline = time.monotonic() + 10
+    while True:
+        job = client.get(f'/admin/jobs/{job_id}', headers=headers).get_json()
+        if job['status'] in ('done', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def test_upload_parses_once_and_dedups(app, admin_headers):
+    client = app.test_client()
+    data = mp3_file()
+    first = upload(client, admin_headers, 'song.mp3', data)
+    assert not first['duplicate']
+    job = finished(client, admin_headers, first['job_id'])
+    assert job['status'] == 'done'
+    assert (job['metadata']['title'], job['metadata']['duration']) == ('Song', 10)
+
+    # The same bytes again: same file, and the job is done at once from the stored metadata
+    again = upload(client, admin_headers, 'copy.mp3', data)
+    assert again['duplicate'] and again['file_path'] == first['file_path']
+    assert client.get(f'/admin/jobs/{again["job_id"]}', headers=admin_headers).get_json()['status'] == 'done'
+    assert client.get('/admin/jobs/missing', headers=admin_headers).status_code == 404
+
+
+def test_truncated_upload_fails_its_job(app, admin_headers, tmp_path):
+    path = str(tmp_path / 'full.wav')
+    wav_file(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # The fmt chunk is cut short, so unpacking it raises struct.error
+    response = upload(app.test_client(), admin_headers, 'cut.wav', data[:24])
+    job = finished(app.test_client(), admin_headers, response['job_id'])
+    assert job['status'] == 'failed' and job['error']
+    assert job['metadata'] is None
+
+
+def test_simple_app_add_track_needs_title_and_artist(simple_app):
+    client = simple_app.app.test_client()
+    response = client.post('/admin/tracks', json={'file_path': 'unparsed.mp3'})
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Title and artist are required'}
+    response = client.post('/admin/tracks', json={'file_path': 'unparsed.mp3', 'title': 'T', 'artist': 'A'})
+    assert response.status_code == 201
@@ -0,0 +1,149 @@
+import json
+
+from json_store import GroupIndex, IdAllocator, JsonStore, KeyIndex, write_atomic
+
+
+def open_store(tmp_path, compact_every=1000):
+    return JsonStore(str(tmp_path / 'content.json'), {'tracks': []}, compact_every)
+
+
+def test_log_replays_into_a_fresh_reader(tmp_path):
+    writer = open_store(tmp_path)
+    reader = open_store(tmp_path)
+    assert reader.load() == {'tracks': []}
+    with writer.locked():
+        writer.append(['tracks'], {'id': 1, 'title': 'One'})
+        writer.append(['tracks'], {'id': 2, 'title': 'Two'})
+        writer.remove(['tracks'], {'id': 1, 'title': 'One'})
+    # Nothing was compacted: the snapshot was never written, the log holds every change
+    assert not (tmp_path / 'content.json').exists()
+    assert reader.load() == {'tracks': [{'id': 2, 'title': 'Two'}]}
+    assert open_store(tmp_path).load() == reader.load()
+
+
+def test_compaction_folds_the_log_into_the_snapshot(tmp_path):
+    writer = open_store(tmp_path, compact_every=3)
+    reader = open_store(tmp_path)
+    index = reader.add_index(KeyIndex(['tracks'], 'id'))
+    for n in range(4):
+        with writer.locked():
+            writer.append(['tracks'], {'id': n})
+        assert [t['id'] for t in reader.load()['tracks']] == list(range(n + 1))
+    assert json.loads((tmp_path / 'content.json').read_text()) == {'tracks': [{'id': n} for n in range(3)]}
+    assert len((tmp_path / 'content.json.log').read_bytes().splitlines()) == 2
+    assert index.get(3) == {'id': 3}
+
+
+def test_log_from_an_interrupted_compaction_is_ignored(tmp_path):
+    store = open_store(tmp_path)
+    with store.locked():
+        store.append(['tracks'], {'id': 1})
+    # The snapshot was replaced but the process died before starting a new log
+    write_atomic(str(tmp_path / 'content.json'), json.dumps({'tracks': [{'id': 1}]}).encode())
+    recovered = open_store(tmp_path)
+    assert recovered.load() == {'tracks': [{'id': 1}]}
+    with recovered.locked():
+        recovered.append(['tracks'], {'id': 2})
+    assert open_store(tmp_path).load() == {'tracks': [{'id': 1}, {'id': 2}]}
+
+
+def test_partly_written_line_waits_for_its_end(tmp_path):
+    store = open_store(tmp_path)
+    with store.locked():
+        store.append(['tracks'], {'id': 1})
+    log = tmp_path / 'content.json.log'
+    line = json.dumps({'op': 'append', 'path': ['tracks'], 'value': {'id': 2}}).encode() + b'\n'
+    with open(log, 'ab') as f:
+        f.write(line[:10])
+    reader = open_store(tmp_path)
+    assert reader.load() == {'tracks': [{'id': 1}]}
+    with open(log, 'ab') as f:
+        f.write(line[10:])
+    assert reader.load() == {'tracks': [{'id': 1}, {'id': 2}]}
+
+
+def indexed_store(tmp_path, compact_every=1000):
+    store = JsonStore(str(tmp_path / 'library.json'), {'tracks': [], 'favorites': {}}, compact_every)
+    indexes = (store.add_index(KeyIndex(['tracks'], 'id')), store.add_index(GroupIndex(['favorites'])),
+               store.add_index(IdAllocator(['tracks'])))
+    return store, indexes
+
+
+def index_state(store, indexes):
+    """What the indexes hold, after bringing the store up to date."""
+    store.load()
+    by_id, favorites, ids = indexes
+    return ({key: by_id.get(key) for key in by_id.items}, {key: list(group) for key, group in favorites.groups.items()},
+            ids.next_id())
+
+
+def rebuilt_state(data):
+    """The same, built from scratch over data."""
+    by_id = {}
+    for item in data['tracks']:
+        by_id.setdefault(item['id'], item)
+    return by_id, data['favorites'], max([t['id'] for t in data['tracks']], default=0) + 1
+
+
+def favorite_list(index, key):
+    return list(index.get(key))
+
+
+def test_indexes_follow_appends_removes_and_sets(tmp_path):
+    store, indexes = indexed_store(tmp_path)
+    with store.locked():
+        for n in (1, 2, 3):
+            store.append(['tracks'], {'id': n, 'title': f'Take {n}'})
+        # Same key twice: the first stays the indexed one until it is removed
+        store.append(['tracks'], {'id': 2, 'title': 'Retake'})
+        store.append(['favorites', '7'], 3)
+        store.append(['favorites', '7'], 1)
+        store.append(['favorites', '8'], 2)
+    by_id, favorites, ids = indexes
+    assert by_id.get(2)['title'] == 'Take 2' and favorite_list(favorites, '7') == [3, 1]
+    assert index_state(store, indexes) == rebuilt_state(store.data)
+
+    with store.locked():
+        store.remove(['tracks'], {'id': 2, 'title': 'Take 2'})
+        store.remove(['tracks'], {'id': 3, 'title': 'Take 3'})
+        store.remove(['favorites', '7'], 3)
+    assert by_id.get(2)['title'] == 'Retake' and by_id.get(3) is None
+    assert favorite_list(favorites, '7') == [1]
+    # A removed id is not handed out again while the log still holds it
+    assert ids.next_id() == 4
+
+    with store.locked():
+        store.set(['tracks'], [{'id': 5, 'title': 'Replaced'}])
+        store.set(['favorites'], {'9': [5]})
+    assert by_id.items == {5: [{'id': 5, 'title': 'Replaced'}]} and favorites.groups == {'9': {5: None}}
+    assert ids.next_id() == 6
+    assert index_state(store, indexes) == rebuilt_state(store.data)
+
+
+def test_indexes_agree_after_replay_and_compaction(tmp_path):
+    writer, writer_indexes = indexed_store(tmp_path, compact_every=5)
+    reader, reader_indexes = indexed_store(tmp_path)
+    reader.load()
+    ops = [('append', ['tracks'], {'id': 1}), ('append', ['tracks'], {'id': 2}),
+           ('append', ['favorites', '1'], 2), ('remove', ['tracks'], {'id': 2}),
+           ('append', ['tracks'], {'id': 3}), ('remove', ['favorites', '1'], 2),
+           ('append', ['favorites', '1'], 3), ('remove', ['tracks'], {'id': 3})]
+    for n, (op, path, value) in enumerate(ops):
+        with writer.locked():
+            getattr(writer, op)(path, value)
+        if n == 3:
+            # A log-only reload: the removed id 2 is still taken
+            fresh, fresh_indexes = indexed_store(tmp_path)
+            assert index_state(fresh, fresh_indexes) == index_state(writer, writer_indexes)
+            assert index_state(fresh, fresh_indexes)[2] == 3
+        # The reader replays the log, or reloads the snapshot once a compaction replaced it
+        assert index_state(reader, reader_indexes) == index_state(writer, writer_indexes)
+    assert json.loads((tmp_path / 'library.json').read_text())['tracks'] == [{'id': 1}, {'id': 3}]
+    state = index_state(writer, writer_indexes)
+    assert state == ({1: {'id': 1}}, {'1': [3]}, 4)
+    assert index_state(*indexed_store(tmp_path)) == state
+    # Compacting drops the freed ids
+    with writer.locked():
+        writer.compact()
+    assert index_state(writer, writer_indexes)[2] == index_state(reader, reader_indexes)[2] == 2
+    assert index_state(writer, writer_indexes) == rebuilt_state(writer.data)
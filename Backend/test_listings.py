@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from models import db, Playlist, PlaylistTrack, Podcast, RecentlyPlayed, Track, User
+from query_counter import count_queries
+
+
+def queries_for(app, client, path, headers):
+    client.get(path, headers=headers)  # first use of a token loads and caches its user
+    with app.app_context(), count_queries(db.engine) as queries:
+        response = client.get(path, headers=headers)
+    assert response.status_code == 200
+    return queries.count, response.get_json()
+
+
+def test_listings_cost_the_same_queries_at_any_length(app):
+    with app.app_context():
+        users = [User(username=f'lister-{n}', email=f'lister{n}@test.com', password_hash='x') for n in range(2)]
+        tracks = [Track(title=f'Track {n}', artist='Test', file_path=f'l{n}.mp3') for n in range(30)]
+        podcasts = [Podcast(title=f'Episode {n}', host='Test', podcast_name='Show', file_path=f'le{n}.mp3')
+                    for n in range(10)]
+        db.session.add_all(users + tracks + podcasts)
+        db.session.flush()
+        short, long = Playlist(name='Short', user_id=users[0].id), Playlist(name='Long', user_id=users[0].id)
+        db.session.add_all([short, long])
+        db.session.flush()
+        db.session.add_all([PlaylistTrack(playlist_id=short.id, track_id=tracks[0].id, position=1),
+                            PlaylistTrack(playlist_id=short.id, podcast_id=podcasts[0].id, position=2)])
+        db.session.add_all([PlaylistTrack(playlist_id=long.id, position=n + 1, **(
+            {'track_id': item.id} if isinstance(item, Track) else {'podcast_id': item.id}))
+            for n, item in enumerate(tracks + podcasts)])
+        start = datetime(2024, 1, 1)
+        db.session.add(RecentlyPlayed(user_id=users[0].id, track_id=tracks[0].id, played_at=start))
+        db.session.add_all([RecentlyPlayed(user_id=users[1].id, played_at=start + timedelta(minutes=n), **(
+            {'track_id': tracks[n].id} if n % 3 else {'podcast_id': podcasts[n].id})) for n in range(10)])
+        db.session.commit()
+        headers = [{'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'} for user in users]
+        short_id, long_id = short.id, long.id
+
+    client = app.test_client()
+    short_count, items = queries_for(app, client, f'/playlists/{short_id}/tracks', headers[0])
+    assert len(items) == 2
+    long_count, items = queries_for(app, client, f'/playlists/{long_id}/tracks', headers[0])
+    assert len(items) == 40 and {item['type'] for item in items} == {'track', 'podcast'}
+    assert long_count == short_count
+
+    one_count, items = queries_for(app, client, '/recently-played', headers[0])
+    assert len(items) == 1
+    ten_count, items = queries_for(app, client, '/recently-played', headers[1])
+    assert len(items) == 10 and items[0]['title'] == 'Episode 9'
+    assert ten_count == one_count
+    # The items come with the rows that list them: nothing is fetched per item
+    assert short_count <= 2 and one_count <= 2
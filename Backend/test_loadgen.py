@@ -0,0 +1,78 @@
+import json
+import os
+import random
+import subprocess
+import sys
+from collections import Counter
+
+from loadgen import Dataset, Zipf, compare, percentile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_zipf_favours_the_head():
+    rng = random.Random(3)
+    zipf = Zipf(100, s=1.0)
+    counts = Counter(zipf.index(rng) for _ in range(20000))
+    assert set(counts) <= set(range(100))
+    # P(k) ~ 1/k: the top item is drawn about twice as often as the second
+    assert 1.7 < counts[0] / counts[1] < 2.3
+    assert counts[0] > 10 * counts[50]
+
+
+def test_dataset_is_reproducible_and_consistent():
+    data = Dataset(seed=5, users=30, tracks=300, podcasts=60)
+    again = Dataset(seed=5, users=30, tracks=300, podcasts=60)
+    assert data.playlist_items == again.playlist_items and data.plays == again.plays
+    assert Dataset(seed=6, users=30, tracks=300, podcasts=60).plays != data.plays
+
+    playlist_ids = {p['id'] for p in data.playlists}
+    for row in data.playlist_items + data.plays:
+        assert (row['track_id'] is None) != (row['podcast_id'] is None)
+        assert row['track_id'] is None or 1 <= row['track_id'] <= 300
+        assert row['podcast_id'] is None or 1 <= row['podcast_id'] <= 60
+    assert {row['playlist_id'] for row in data.playlist_items} <= playlist_ids
+    played = Counter(row['track_id'] for row in data.plays if row['track_id'])
+    assert played.most_common(1)[0][0] == data.track_ranking[0]
+
+
+def test_percentiles_and_regressions():
+    latencies = [n / 1000 for n in range(1, 101)]
+    assert percentile(latencies, 0.5) == 0.05
+    assert percentile(latencies, 0.99) == 0.099
+    assert percentile([], 0.5) == 0.0
+
+    baseline = {'scenarios': {'browse': {'throughput': 100, 'p95_ms': 10, 'errors': 0},
+                              'search': {'throughput': 50, 'p95_ms': 20, 'errors': 0}}}
+    results = {'scenarios': {'browse': {'throughput': 90, 'p95_ms': 12, 'errors': 0},
+                             'search': {'throughput': 30, 'p95_ms': 40, 'errors': 2},
+                             'stream': {'throughput': 1, 'p95_ms': 1000, 'errors': 0}}}
+    regressions = compare(results, baseline, 0.25)
+    assert len(regressions) == 3 and all(r.startswith('search:') for r in regressions)
+
+
+def test_run_writes_results_and_compares_with_them(tmp_path):
+    output = tmp_path / 'run.json'
+    args = [sys.executable, 'loadgen.py', '--iterations', '6', '--warmup', '1', '--concurrency', '2',
+            '--users', '20', '--tracks', '200', '--podcasts', '40',
+            '--scenarios', 'browse,search,stream,playlist_edit,listings', '--alongside', 'login_storm',
+            '--alongside-concurrency', '2', '--output', str(output)]
+    run = subprocess.run(args, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120)
+    assert run.returncode == 0, run.stderr
+    results = json.loads(output.read_text())
+    assert list(results['scenarios']) == ['browse', 'search', 'stream', 'playlist_edit', 'listings']
+    for scenario in results['scenarios'].values():
+        assert scenario['requests'] >= 6 and scenario['errors'] == 0
+        assert scenario['p50_ms'] <= scenario['p95_ms'] <= scenario['p99_ms']
+    # The logins ran for as long as the measured scenarios did
+    assert results['alongside']['scenario'] == 'login_storm' and results['alongside']['requests'] > 0
+    assert results['alongside']['errors'] == 0
+
+    # Every result regresses against a baseline a thousand times faster
+    fast = {'scenarios': {name: {**s, 'p95_ms': s['p95_ms'] / 1000, 'throughput': s['throughput'] * 1000}
+                          for name, s in results['scenarios'].items()}}
+    (tmp_path / 'fast.json').write_text(json.dumps(fast))
+    run = subprocess.run(args[:-2] + ['--compare', str(tmp_path / 'fast.json')],
+                         cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120)
+    assert run.returncode == 1
+    assert run.stderr.count('REGRESSION') >= 4
@@ -0,0 +1,86 @@
+import io
+import json
+import logging
+import os
+import time
+
+from flask import Flask
+
+from metrics import Metrics
+from models import db, Track
+from structured_log import JsonFormatter, RateLimitFilter
+
+
+def sample(text, line_start):
+    return [float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(line_start)]
+
+
+def test_requests_queries_and_streamed_bytes_are_exported(app, tmp_path):
+    path = str(tmp_path / 'track.mp3')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(5000))
+    with app.app_context():
+        track = Track(title='Measured', artist='Test', file_path=path)
+        db.session.add(track)
+        db.session.commit()
+        track_id = track.id
+
+    client = app.test_client()
+    before = client.get('/metrics').get_data(as_text=True)
+    client.get('/tracks?limit=5')
+    response = client.get(f'/stream/track/{track_id}', headers={'Range': 'bytes=1000-'})
+    response.get_data()
+    response.close()
+    after = client.get('/metrics')
+    assert after.mimetype == 'text/plain'
+    text = after.get_data(as_text=True)
+
+    def delta(line_start):
+        return sum(sample(text, line_start)) - sum(sample(before, line_start))
+
+    assert delta('http_requests_total{method="GET",endpoint="catalog.get_tracks",status="200"}') == 1
+    assert delta('http_request_duration_seconds_count{method="GET",endpoint="catalog.get_tracks"}') == 1
+    assert delta('db_queries_total{endpoint="catalog.get_tracks"}') >= 1
+    assert delta('stream_bytes_total{endpoint="streaming.stream_content"}') == 4000
+    assert sample(text, 'http_request_duration_seconds_bucket{method="GET",endpoint="catalog.get_tracks",le="+Inf"}')
+    assert 'response_cache_hit_rate' in text and 'role_cache_hits' in text
+
+
+def test_sampling_profiler_writes_collapsed_stacks(tmp_path):
+    profiled = Flask(__name__)
+    metrics = Metrics(profile_rate=1, profile_dir=str(tmp_path))
+    metrics.instrument(profiled)
+
+    @profiled.route('/busy')
+    def busy():
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        return 'done'
+
+    assert profiled.test_client().get('/busy').status_code == 200
+    [profile] = os.listdir(tmp_path)
+    stacks = open(tmp_path / profile).read().splitlines()
+    assert any('busy (test_metrics.py' in line for line in stacks)
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in stacks) > 5
+
+
+def test_logs_are_json_and_rate_limited():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RateLimitFilter(rate=2, window=0.05))
+    logger = logging.getLogger('test_metrics.limited')
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+        for n in range(5):
+            logger.warning('Disk slow', extra={'attempt': n})
+        time.sleep(0.06)
+        logger.warning('Disk slow', extra={'attempt': 5})
+    finally:
+        logger.removeHandler(handler)
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [e['attempt'] for e in entries] == [0, 1, 5]
+    assert entries[0]['level'] == 'warning' and entries[0]['message'] == 'Disk slow'
+    assert entries[-1]['suppressed'] == 3
@@ -0,0 +1,44 @@
+import threading
+import time
+
+import pytest
+
+import routes_auth
+from models import db, User
+from passwords import HasherBusy, PasswordHasher
+
+
+@pytest.fixture
+def full_hasher(monkeypatch):
+    """A hasher whose only slot is taken until the test ends."""
+    hasher = PasswordHasher(workers=0, queue_depth=1, method='pbkdf2:sha256:1000')
+    monkeypatch.setattr(routes_auth, 'password_hasher', hasher)
+    release = threading.Event()
+    holder = threading.Thread(target=hasher._run, args=(release.wait, 10))
+    holder.start()
+    while not hasher.inflight:
+        time.sleep(0.001)
+    yield hasher
+    release.set()
+    holder.join()
+
+
+def test_full_queue_rejects_with_an_estimate(full_hasher):
+    full_hasher.average = 2.5
+    with pytest.raises(HasherBusy) as busy:
+        full_hasher.hash('secret')
+    assert busy.value.retry_after == 3
+    assert full_hasher.stats()['rejected'] == 1
+
+
+def test_full_queue_answers_429_with_retry_after(app, full_hasher):
+    with app.app_context():
+        db.session.add(User(username='member', email='member@test.com', password_hash='pbkdf2:sha256:1000$x$y'))
+        db.session.commit()
+    client = app.test_client()
+    response = client.post('/login', json={'username': 'member', 'password': 'secret'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    response = client.post('/register', json={'username': 'someone', 'email': 'someone@test.com',
+                                              'password': 'secret'})
+    assert response.status_code == 429 and int(response.headers['Retry-After']) >= 1
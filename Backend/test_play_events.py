@@ -0,0 +1,92 @@
+import time
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+import extensions
+from extensions import play_buffer
+from models import db, RecentlyPlayed, Track, User
+from play_events import PlayBuffer
+
+
+class Sink:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, events):
+        if self.fail:
+            raise OSError('database unavailable')
+        self.batches.append(events)
+
+
+def test_flushes_at_flush_size_and_coalesces_replays():
+    sink = Sink()
+    buffer = PlayBuffer(sink, flush_size=3, flush_seconds=0)
+    buffer.add(1, track_id=10, played_at=1)
+    buffer.add(1, track_id=10, played_at=2)
+    buffer.add(2, podcast_id=20, played_at=3)
+    assert sink.batches == []
+    buffer.add(1, track_id=11, played_at=4)
+    assert sink.batches == [[
+        {'user_id': 1, 'track_id': 10, 'podcast_id': None, 'played_at': 2},
+        {'user_id': 2, 'track_id': None, 'podcast_id': 20, 'played_at': 3},
+        {'user_id': 1, 'track_id': 11, 'podcast_id': None, 'played_at': 4},
+    ]]
+    assert buffer.stats() == {'pending': 0, 'flushed': 3, 'coalesced': 1}
+
+
+def test_flushes_after_flush_seconds_and_on_close():
+    sink = Sink()
+    buffer = PlayBuffer(sink, flush_size=100, flush_seconds=0.05)
+    buffer.add(1, track_id=10)
+    deadline = time.monotonic() + 2
+    while not sink.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(sink.batches) == 1
+
+    buffer.add(1, track_id=11)
+    buffer.close()
+    assert [event['track_id'] for batch in sink.batches for event in batch] == [10, 11]
+
+
+def test_failed_write_keeps_the_newest_events():
+    sink = Sink(fail=True)
+    buffer = PlayBuffer(sink, flush_size=100, flush_seconds=0, max_pending=3)
+    for track_id in range(5):
+        buffer.add(1, track_id=track_id)
+    assert buffer.flush() == 0
+    assert buffer.sync(1)
+    sink.fail = False
+    buffer.add(1, track_id=5)
+    assert buffer.flush() == 4
+    assert [event['track_id'] for event in sink.batches[0]] == [2, 3, 4, 5]
+    assert not buffer.sync(1)
+
+
+def test_flush_writes_batches_and_keeps_the_newest_plays(app, monkeypatch):
+    monkeypatch.setattr(extensions, 'RETENTION', 3)
+    with app.app_context():
+        user = User(username='player', email='player@test.com', password_hash='x')
+        tracks = [Track(title=f'Played {n}', artist='Test', file_path=f'played{n}.mp3') for n in range(5)]
+        db.session.add_all([user] + tracks)
+        db.session.commit()
+        user_id, track_ids = user.id, [t.id for t in tracks]
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user_id))}'}
+
+    start = datetime(2024, 1, 1)
+    for n, track_id in enumerate(track_ids):
+        play_buffer.add(user_id, track_id, played_at=start + timedelta(minutes=n))
+    play_buffer.add(user_id, track_ids[0], played_at=start + timedelta(minutes=10))
+    assert play_buffer.flush() == 5
+
+    with app.app_context():
+        kept = db.session.scalars(db.select(RecentlyPlayed.track_id).where(RecentlyPlayed.user_id == user_id)
+                                  .order_by(RecentlyPlayed.played_at.desc())).all()
+    assert kept == [track_ids[0], track_ids[4], track_ids[3]]
+
+    # A read right after a play sees it, though the buffer has not been flushed
+    client = app.test_client()
+    client.post('/recently-played', json={'track_id': track_ids[1]}, headers=headers)
+    items = client.get('/recently-played', headers=headers).get_json()
+    assert [item['id'] for item in items] == [track_ids[1], track_ids[0], track_ids[4]]
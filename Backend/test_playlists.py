@@ -0,0 +1,130 @@
+import pytest
+from flask_jwt_extended import create_access_token
+
+from extensions import playlist_editor
+from models import db, Playlist, PlaylistTrack, Podcast, Track, User
+from playlist_editor import PlaylistEditor
+from query_counter import count_queries
+
+
+@pytest.fixture
+def library(app):
+    with app.app_context():
+        tracks = [Track(title=f'Track {n}', artist='Editor', file_path=f'p{n}.mp3', duration=100 + n)
+                  for n in range(8)]
+        podcast = Podcast(title='Episode', host='Editor', podcast_name='Show', file_path='pe.mp3', duration=1000)
+        users = [User(username=f'editor-{n}', email=f'editor{n}@test.com', password_hash='x') for n in range(2)]
+        db.session.add_all(tracks + [podcast] + users)
+        db.session.commit()
+        tokens = [{'Authorization': 'Bearer ' + create_access_token(identity=str(user.id))} for user in users]
+        return [t.id for t in tracks], podcast.id, tokens
+
+
+def listing(client, playlist_id, headers):
+    return [(item['type'], item['id']) for item in
+            client.get(f'/playlists/{playlist_id}/tracks', headers=headers).get_json()]
+
+
+def summary(client, playlist_id, headers):
+    [row] = client.get(f'/playlists/summary?ids={playlist_id}', headers=headers).get_json()
+    return row['item_count'], row['total_duration']
+
+
+def test_batches_keep_order_and_summaries(app, library):
+    tracks, podcast, (owner, _) = library
+    client = app.test_client()
+    playlist_id = client.post('/playlists', json={'name': 'Ordered'}, headers=owner).get_json()['id']
+    url = f'/playlists/{playlist_id}/tracks'
+
+    response = client.patch(url, json={'operations': [
+        {'op': 'add', 'track_id': tracks[0]}, {'op': 'add', 'track_id': tracks[1]},
+        {'op': 'add', 'podcast_id': podcast}]}, headers=owner)
+    assert response.status_code == 200
+    body = response.get_json()
+    first, second, episode = body['added']
+    assert body['item_count'] == 3 and body['total_duration'] == 100 + 101 + 1000
+
+    # One POST in the middle, then one batch moving, removing and adding at the front
+    entry = client.post(url, json={'track_id': tracks[2], 'after': first}, headers=owner).get_json()['entry_id']
+    with app.app_context(), count_queries(db.engine) as queries:
+        response = client.patch(url, json={'operations': [
+            {'op': 'move', 'id': episode, 'before': first}, {'op': 'remove', 'id': second},
+            {'op': 'add', 'track_id': tracks[3], 'before': episode}]}, headers=owner)
+    assert response.status_code == 200
+    assert response.get_json()['moved'] == 1 and response.get_json()['removed'] == 1
+    # The move rewrote one entry's position: nothing was renumbered
+    assert [s for s in queries.statements if s.startswith('UPDATE playlist_tracks')] == [
+        'UPDATE playlist_tracks SET position=? WHERE playlist_tracks.id = ?']
+    assert listing(client, playlist_id, owner) == [
+        ('track', tracks[3]), ('podcast', podcast), ('track', tracks[0]), ('track', tracks[2])]
+    assert summary(client, playlist_id, owner) == (4, 103 + 1000 + 100 + 102)
+    assert entry in [item['entry_id'] for item in client.get(url, headers=owner).get_json()]
+
+
+def test_a_failing_batch_changes_nothing(app, library):
+    tracks, _, (owner, other) = library
+    client = app.test_client()
+    playlist_id = client.post('/playlists', json={'name': 'Atomic'}, headers=owner).get_json()['id']
+    url = f'/playlists/{playlist_id}/tracks'
+    [entry] = client.patch(url, json={'operations': [{'op': 'add', 'track_id': tracks[0]}]},
+                           headers=owner).get_json()['added']
+
+    for operations, status in (
+            ([{'op': 'add', 'track_id': tracks[1]}, {'op': 'add', 'track_id': tracks[0]}], 409),
+            ([{'op': 'add', 'track_id': tracks[1]}, {'op': 'add', 'track_id': 99999}], 400),
+            ([{'op': 'remove', 'id': entry}, {'op': 'move', 'id': entry}], 400),
+            ([{'op': 'add', 'track_id': tracks[1], 'before': entry, 'after': entry}], 400),
+            ([{'op': 'shuffle'}], 400), ([], 400)):
+        assert client.patch(url, json={'operations': operations}, headers=owner).status_code == status
+    assert client.post(url, json={'track_id': tracks[0]}, headers=owner).status_code == 409
+    assert client.patch(url, json={'operations': [{'op': 'remove', 'id': entry}]}, headers=other).status_code == 403
+    assert client.post('/playlists/99999/tracks', json={'track_id': tracks[0]}, headers=owner).status_code == 404
+    assert listing(client, playlist_id, owner) == [('track', tracks[0])]
+    assert summary(client, playlist_id, owner) == (1, 100)
+    # Only the user's own playlists are summarised
+    assert client.get(f'/playlists/summary?ids={playlist_id}', headers=other).get_json() == []
+
+
+def test_inserts_at_one_spot_renumber_when_the_gap_runs_out(app, library):
+    tracks, _, _ = library
+    with app.app_context():
+        user_id = db.session.scalar(db.select(User.id).where(User.username == 'editor-0'))
+        playlist = Playlist(name='Crowded', user_id=user_id)
+        db.session.add(playlist)
+        db.session.flush()
+        editor = PlaylistEditor(db, Playlist, PlaylistTrack, playlist_editor.arms, gap=4)
+        [head, tail] = editor.apply(playlist.id, [{'op': 'add', 'track_id': tracks[0]},
+                                                  {'op': 'add', 'track_id': tracks[1]}])['added']
+        expected = [head, tail]
+        # Each insert lands right after head, halving the gap until there is none
+        for track_id in tracks[2:]:
+            [entry] = editor.apply(playlist.id, [{'op': 'add', 'track_id': track_id, 'after': head}])['added']
+            expected.insert(1, entry)
+        positions = db.session.execute(db.select(PlaylistTrack.id, PlaylistTrack.position).where(
+            PlaylistTrack.playlist_id == playlist.id).order_by(PlaylistTrack.position, PlaylistTrack.id)).all()
+        assert [entry_id for entry_id, _ in positions] == expected
+        assert len({position for _, position in positions}) == len(positions)
+        db.session.rollback()
+
+
+def test_summaries_follow_content_changes(app, library):
+    tracks, podcast, (owner, _) = library
+    client = app.test_client()
+    playlist_id = client.post('/playlists', json={'name': 'Followed'}, headers=owner).get_json()['id']
+    client.patch(f'/playlists/{playlist_id}/tracks', json={'operations': [
+        {'op': 'add', 'track_id': tracks[0]}, {'op': 'add', 'track_id': tracks[1]},
+        {'op': 'add', 'podcast_id': podcast}]}, headers=owner)
+    with app.app_context():
+        db.session.get(Track, tracks[0]).duration = 400
+        db.session.commit()
+        assert summary(client, playlist_id, owner) == (3, 400 + 101 + 1000)
+        db.session.delete(db.session.get(Podcast, podcast))
+        db.session.delete(db.session.get(Track, tracks[1]))
+        db.session.commit()
+        assert summary(client, playlist_id, owner) == (1, 400)
+
+        # Recounting from the entries agrees with what was kept
+        db.session.execute(db.update(Playlist).where(Playlist.id == playlist_id).values(item_count=0, total_duration=0))
+        playlist_editor.refresh([playlist_id])
+        db.session.commit()
+    assert summary(client, playlist_id, owner) == (1, 400)
@@ -0,0 +1,172 @@
+import os
+import re
+import tempfile
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine, inspect, text
+
+from extensions import charts, response_cache, role_cache
+from migrations import current_version, head, upgrade
+from models import db, Track
+from pagination import encode_cursor
+from playlist_editor import POSITION_GAP
+from query_counter import count_queries
+
+# The schema create_all() built before migrations existed
+LEGACY_SCHEMA = [
+    'CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, email VARCHAR(120) NOT NULL, '
+    'password_hash VARCHAR(255) NOT NULL, is_admin BOOLEAN, created_at DATETIME, PRIMARY KEY (id), '
+    'UNIQUE (username), UNIQUE (email))',
+    'CREATE TABLE tracks (id INTEGER NOT NULL, title VARCHAR(200) NOT NULL, artist VARCHAR(200) NOT NULL, '
+    'file_path VARCHAR(500) NOT NULL, duration INTEGER, category VARCHAR(100), created_at DATETIME, PRIMARY KEY (id))',
+    'CREATE TABLE podcasts (id INTEGER NOT NULL, title VARCHAR(200) NOT NULL, host VARCHAR(200) NOT NULL, '
+    'file_path VARCHAR(500) NOT NULL, duration INTEGER, podcast_name VARCHAR(200) NOT NULL, category VARCHAR(100), '
+    'created_at DATETIME, PRIMARY KEY (id))',
+    'CREATE TABLE playlists (id INTEGER NOT NULL, name VARCHAR(200) NOT NULL, user_id INTEGER NOT NULL, '
+    'created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id))',
+    'CREATE TABLE playlist_tracks (id INTEGER NOT NULL, playlist_id INTEGER NOT NULL, track_id INTEGER, '
+    'podcast_id INTEGER, added_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(playlist_id) REFERENCES playlists (id), '
+    'FOREIGN KEY(track_id) REFERENCES tracks (id), FOREIGN KEY(podcast_id) REFERENCES podcasts (id))',
+    'CREATE TABLE recently_played (id INTEGER NOT NULL, user_id INTEGER NOT NULL, track_id INTEGER, '
+    'podcast_id INTEGER, played_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id), '
+    'FOREIGN KEY(track_id) REFERENCES tracks (id), FOREIGN KEY(podcast_id) REFERENCES podcasts (id))',
+]
+
+FULL_SCAN = re.compile(r'^SCAN \w+( AS \w+)?$')
+
+
+def quiet(message):
+    pass
+
+
+def legacy_engine():
+    """A database create_all() built before migrations existed, with some rows."""
+    engine = create_engine(f'sqlite:///{os.path.join(tempfile.mkdtemp(), "legacy.db")}')
+    with engine.begin() as conn:
+        for statement in LEGACY_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'u', 'u@x', 'x')"))
+        conn.execute(text("INSERT INTO tracks (id, title, artist, file_path) VALUES (1, 't', 'a', 'f.mp3')"))
+        conn.execute(text("INSERT INTO playlists (id, name, user_id) VALUES (1, 'p', 1)"))
+        conn.execute(text('INSERT INTO playlist_tracks (playlist_id, track_id) VALUES (1, 1), (1, 99), (1, 1)'))
+        conn.execute(text('INSERT INTO recently_played (user_id, track_id) VALUES (1, 1)'))
+        conn.execute(text("INSERT INTO podcasts (id, title, host, file_path, podcast_name) VALUES (1, 'e', 'h', 'e.mp3', 's')"))
+        conn.execute(text('INSERT INTO recently_played (user_id, track_id, podcast_id) VALUES (1, 1, 1), (1, NULL, NULL)'))
+    return engine
+
+
+def schema_and_rows(engine):
+    inspector = inspect(engine)
+    with engine.connect() as conn:
+        return {table: (
+            [(c['name'], str(c['type']), c['nullable']) for c in inspector.get_columns(table)],
+            inspector.get_indexes(table), inspector.get_foreign_keys(table),
+            inspector.get_check_constraints(table), conn.execute(text(f'SELECT * FROM {table} ORDER BY 1')).all(),
+        ) for table in db.metadata.tables}
+
+
+@pytest.fixture(scope='module')
+def migrated_engine():
+    """A legacy database upgraded through every migration."""
+    engine = legacy_engine()
+    assert upgrade(engine, db.metadata, echo=quiet) == [version for version in range(1, head() + 1)]
+    return engine
+
+
+def test_upgrade_matches_fresh_schema(migrated_engine):
+    fresh = create_engine(f'sqlite:///{os.path.join(tempfile.mkdtemp(), "fresh.db")}')
+    assert upgrade(fresh, db.metadata, echo=quiet) == []
+    assert current_version(fresh) == current_version(migrated_engine) == head()
+
+    migrated, created = inspect(migrated_engine), inspect(fresh)
+    for table in db.metadata.tables:
+        assert ({(i['name'], bool(i['unique'])) for i in migrated.get_indexes(table)} ==
+                {(i['name'], bool(i['unique'])) for i in created.get_indexes(table)}), table
+        assert ({(tuple(fk['constrained_columns']), fk['options'].get('ondelete')) for fk in migrated.get_foreign_keys(table)} ==
+                {(tuple(fk['constrained_columns']), fk['options'].get('ondelete')) for fk in created.get_foreign_keys(table)}), table
+        assert ({c['name'] for c in migrated.get_check_constraints(table)} ==
+                {c['name'] for c in created.get_check_constraints(table)}), table
+
+    assert upgrade(migrated_engine, db.metadata, echo=quiet) == []
+
+
+def test_migrations_can_run_again():
+    engine = legacy_engine()
+    upgrade(engine, db.metadata, target=2, echo=quiet)
+    assert upgrade(engine, db.metadata, target=2, echo=quiet) == []
+    upgrade(engine, db.metadata, echo=quiet)
+    migrated = schema_and_rows(engine)
+
+    # As if each migration's changes had been kept but its version never recorded
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM schema_migrations'))
+    assert upgrade(engine, db.metadata, echo=quiet) == [version for version in range(1, head() + 1)]
+    assert schema_and_rows(engine) == migrated
+    assert upgrade(engine, db.metadata, echo=quiet) == []
+
+
+def test_upgrade_keeps_rows_and_cascades(migrated_engine):
+    with migrated_engine.begin() as conn:
+        # The row pointing at a missing track and the second copy of track 1 were dropped, the rest survived
+        assert conn.execute(text('SELECT track_id, position FROM playlist_tracks')).all() == [(1, POSITION_GAP)]
+        assert conn.execute(text('SELECT item_count, total_duration FROM playlists')).all() == [(1, 0)]
+        # A play of both a track and a podcast became one of each; one of neither was dropped
+        assert conn.execute(text('SELECT track_id, podcast_id FROM recently_played ORDER BY id')).all() == [
+            (1, None), (1, None), (None, 1)]
+        conn.execute(text('PRAGMA foreign_keys=ON'))
+        conn.execute(text('DELETE FROM tracks WHERE id = 1'))
+        conn.execute(text('DELETE FROM podcasts WHERE id = 1'))
+        assert conn.execute(text('SELECT count(*) FROM playlist_tracks')).scalar() == 0
+        assert conn.execute(text('SELECT count(*) FROM recently_played')).scalar() == 0
+
+
+def route_selects(app):
+    """Every SELECT the read routes issue, with its parameters."""
+    client = app.test_client()
+    user = {'Authorization': 'Bearer ' + create_access_token(identity='1')}
+    admin = {'Authorization': 'Bearer ' + create_access_token(identity='1', additional_claims={'is_admin': True})}
+    cursor = encode_cursor(Track.created_at.type.python_type(2024, 1, 1), 1)
+    for namespace in ('track', 'podcast'):
+        response_cache.backend.bump(namespace)
+    role_cache.invalidate()
+
+    requests = [
+        ('/tracks?limit=10', {}), ('/tracks?limit=10&category=Pop', {}), (f'/tracks?limit=10&cursor={cursor}', {}),
+        (f'/tracks?limit=10&category=Pop&cursor={cursor}', {}),
+        ('/podcasts?limit=10', {}), ('/podcasts?limit=10&category=Tech', {}),
+        (f'/podcasts?limit=10&category=Tech&cursor={cursor}', {}),
+        ('/catalog?limit=10', {}), ('/catalog?limit=10&category=Pop', {}),
+        (f'/catalog?limit=10&category=Pop&cursor={cursor}.podcast', {}),
+        ('/search?q=song', {}), ('/stream/track/1', {}), ('/stream/podcast/1', {}),
+        ('/charts/top?window=week', {}), ('/charts/trending?category=Pop', {}),
+        ('/playlists', user), ('/playlists/1/tracks', user), ('/playlists/summary?ids=1,2', user),
+        ('/recently-played', user),
+        ('/admin/cache/stats', admin),
+    ]
+    selects = []
+    with count_queries(db.engine) as queries:
+        # What the chart routes serve is loaded up front and on each rebuild
+        charts.rebuild()
+        for path, headers in requests:
+            client.get(path, headers=headers)
+    for statement, parameters in zip(queries.statements, queries.parameters):
+        # The FTS index and SQLite's own catalog are outside the app's schema
+        if statement.lstrip().upper().startswith('SELECT') and 'content_fts' not in statement \
+                and 'sqlite_master' not in statement:
+            selects.append((statement, parameters))
+    return selects
+
+
+def test_route_queries_use_indexes(app, migrated_engine):
+    with app.app_context():
+        selects = route_selects(app)
+    assert selects
+
+    problems = []
+    with migrated_engine.connect() as conn:
+        for statement, parameters in selects:
+            plan = [row[3] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            if any(FULL_SCAN.match(step) or 'TEMP B-TREE' in step for step in plan):
+                problems.append(f'{statement}\n    {plan}')
+    assert not problems, '\n'.join(problems)
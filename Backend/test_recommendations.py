@@ -0,0 +1,139 @@
+import random
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from extensions import recommender
+from models import db, Playlist, PlaylistTrack, Track, User
+from recommendations import CooccurrenceIndex, Recommender
+
+
+def random_rows(seed=18, baskets=40, items=30, rows=600):
+    rng = random.Random(seed)
+    return [(('user', rng.randrange(baskets)), rng.randrange(items)) for _ in range(rows)]
+
+
+def snapshot(index):
+    # Patched neighbour lists may drift until a full refresh
+    index.dirty.update(index.counts)
+    index.refresh()
+    pairs = {item: {o: c for o, c in others.items() if c} for item, others in index.pairs.items()}
+    return dict(index.counts), {item: others for item, others in pairs.items() if others}, index.neighbors
+
+
+def test_incremental_updates_match_a_rebuild():
+    rows = random_rows()
+    incremental = CooccurrenceIndex(top_k=5, basket_size=8)
+    for basket, item in rows:
+        incremental.add(basket, item)
+    incremental.refresh()
+    assert snapshot(incremental) == snapshot(CooccurrenceIndex.build(rows, top_k=5, basket_size=8))
+
+    for basket, item in rows[:200]:
+        incremental.remove(basket, item)
+    incremental.refresh()
+    remaining = [(b, i) for b, items in incremental.baskets.items() for i in items]
+    assert snapshot(incremental) == snapshot(CooccurrenceIndex.build(remaining, top_k=5, basket_size=8))
+
+
+def test_similar_ranks_by_cosine():
+    rows = [(('playlist', 1), 1), (('playlist', 1), 2), (('playlist', 2), 1), (('playlist', 2), 2),
+            (('playlist', 3), 1), (('playlist', 3), 3)] + [(('playlist', n), 3) for n in range(4, 10)]
+    index = CooccurrenceIndex.build(rows)
+    similar = index.similar(1)
+    assert [item for item, _ in similar] == [2, 3]
+    assert similar[0][1] == pytest.approx(2 / (3 * 2) ** 0.5)
+    assert similar[1][1] == pytest.approx(1 / (3 * 7) ** 0.5)
+    assert index.similar(42) == []
+
+
+def test_baskets_keep_their_latest_items():
+    index = CooccurrenceIndex(basket_size=3)
+    for item in (1, 2, 3, 4):
+        index.add('u', item)
+    assert list(index.baskets['u']) == [2, 3, 4]
+    assert 1 not in index.counts and 1 not in index.pairs[2]
+    index.add('u', 2)
+    assert list(index.baskets['u']) == [3, 4, 2]
+
+
+def test_recommend_skips_heard_items_and_falls_back_to_popular():
+    rows = [(('user', 1), 1), (('user', 1), 2), (('user', 2), 1), (('user', 2), 3), (('user', 3), 9),
+            (('user', 4), 9), (('user', 5), 9), (('user', 7), 9)]
+    index = CooccurrenceIndex.build(rows)
+    index.add(('user', 6), 1)
+    index.refresh()
+    ranked = index.recommend(('user', 6), limit=3)
+    assert {item for item, _ in ranked[:2]} == {2, 3}
+    assert ranked[2] == (9, 0.0)
+    assert index.recommend(('user', 99), limit=1) == [(9, 0.0)]
+
+
+def test_changes_during_a_rebuild_are_replayed():
+    def load_rows():
+        # Another request records a play while the rows are being read
+        recommender.add([(('user', 1), 3)])
+        yield ('user', 1), 1
+        yield ('user', 1), 2
+
+    recommender = Recommender(load_rows, rebuild_seconds=0)
+    index = recommender.rebuild()
+    assert list(index.baskets[('user', 1)]) == [1, 2, 3]
+    recommender.add([(('user', 2), 3), (('user', 2), 1)])
+    assert recommender.similar(1)[0][0] == 3
+
+
+def test_routes_serve_precomputed_neighbours(app):
+    with app.app_context():
+        user = User(username='recommend-test', email='recommend@test.com', password_hash='x')
+        tracks = [Track(title=f'Track {n}', artist='Test', file_path=f'rec{n}.mp3') for n in range(4)]
+        db.session.add_all([user] + tracks)
+        db.session.flush()
+        playlists = [Playlist(name=f'Mix {n}', user_id=user.id) for n in range(2)]
+        db.session.add_all(playlists)
+        db.session.flush()
+        for playlist in playlists:
+            db.session.add_all([PlaylistTrack(playlist_id=playlist.id, track_id=t.id) for t in tracks[:2]])
+        db.session.commit()
+        user_id, track_ids, playlist_id = user.id, [t.id for t in tracks], playlists[0].id
+        token = create_access_token(identity=str(user_id))
+
+    recommender.rebuild()
+    client = app.test_client()
+    similar = client.get(f'/tracks/{track_ids[0]}/similar').get_json()
+    assert [t['id'] for t in similar] == [track_ids[1]]
+
+    # Committed playlist edits reach the index without a rebuild
+    with app.app_context():
+        db.session.add(PlaylistTrack(playlist_id=playlist_id, track_id=track_ids[2]))
+        db.session.commit()
+    similar = client.get(f'/tracks/{track_ids[0]}/similar').get_json()
+    assert [t['id'] for t in similar] == [track_ids[1], track_ids[2]]
+
+    client.post('/recently-played', json={'track_id': track_ids[0]},
+                headers={'Authorization': f'Bearer {token}'})
+    recommended = client.get('/users/me/recommendations?limit=2',
+                             headers={'Authorization': f'Bearer {token}'}).get_json()
+    assert [t['id'] for t in recommended] == [track_ids[1], track_ids[2]]
+
+
+def test_pair_counts_stay_within_max_pairs():
+    rows = random_rows(baskets=60, items=80, rows=1500)
+    full = CooccurrenceIndex.build(rows, top_k=3, basket_size=20, max_pairs=1000)
+    capped = CooccurrenceIndex.build(rows, top_k=3, basket_size=20, max_pairs=5)
+    assert max(len(others) for others in full.pairs.values()) > 5
+    assert max(len(others) for others in capped.pairs.values()) == 5
+    # The partners kept are the best scoring ones, so the neighbour lists are unchanged
+    assert capped.neighbors == full.neighbors and capped.stats()['pairs'] <= 5 * 80
+
+    for basket, item in random_rows(seed=19, baskets=60, items=80, rows=1500):
+        capped.add(basket, item)
+    for basket, item in rows[:500]:
+        capped.remove(basket, item)
+    capped.refresh()
+    assert max(len(others) for others in capped.pairs.values()) <= 10
+    # Counts of pairs dropped by a cut and seen again only ever fall short of the true ones
+    exact = CooccurrenceIndex.build([(b, i) for b, items in capped.baskets.items() for i in items],
+                                    top_k=3, basket_size=20, max_pairs=1000)
+    assert all(0 < together <= exact.pairs[item][other]
+               for item, others in capped.pairs.items() for other, together in others.items())
@@ -0,0 +1,132 @@
+import os
+import time
+import wave
+from array import array
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+import routes_streaming
+from models import db, Track
+from renditions import QUALITIES, RenditionCache, WavDownsampler
+
+
+def write_wav(path, frames, rate=44100, channels=2, width=2, values=(1000, 3000)):
+    """A WAV whose channels hold constant 16-bit values, widened to width bytes."""
+    sample = b''.join(v.to_bytes(2, 'little', signed=True).rjust(width, b'\x00') for v in values[:channels])
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        w.writeframes(sample * frames)
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as r:
+        return r.getframerate(), r.getnchannels(), r.getsampwidth(), array('h', r.readframes(r.getnframes()))
+
+
+@pytest.mark.parametrize('rate, width', [(44100, 2), (48000, 2), (44100, 3)])
+def test_downsampler_mixes_and_resamples(tmp_path, rate, width):
+    source, output = str(tmp_path / 'in.wav'), str(tmp_path / 'out.wav')
+    write_wav(source, rate * 3 + 17, rate=rate, width=width)
+    WavDownsampler().encode(source, output, QUALITIES['low'])
+
+    out_rate, channels, out_width, samples = read_wav(output)
+    assert (out_rate, channels, out_width) == (22050, 1, 2)
+    assert abs(len(samples) - (rate * 3 + 17) * 22050 / rate) <= 1
+    assert set(samples) == {2000}
+
+
+def test_downsampler_keeps_stereo_at_same_rate(tmp_path):
+    source, output = str(tmp_path / 'in.wav'), str(tmp_path / 'out.wav')
+    write_wav(source, 1000, width=3)
+    WavDownsampler().encode(source, output, QUALITIES['high'])
+    out_rate, channels, out_width, samples = read_wav(output)
+    assert (out_rate, channels, out_width, len(samples)) == (44100, 2, 2, 2000)
+    assert samples[:4].tolist() == [1000, 3000, 1000, 3000]
+
+
+def test_cache_evicts_least_recently_served(tmp_path):
+    sources = []
+    for name in 'abc':
+        path = str(tmp_path / f'{name}.wav')
+        write_wav(path, 44100)
+        sources.append(path)
+    cache = RenditionCache(str(tmp_path / 'renditions'), WavDownsampler(), workers=0, max_bytes=10 ** 9)
+    paths = [cache.get(source, 'low') for source in sources]
+    assert all(paths) and cache.stats()['entries'] == 3
+
+    # a is served again after b, so b is the least recently served
+    for age, path in zip((3, 2, 1), paths):
+        os.utime(path, ns=(time.time_ns() - age * 10 ** 9, os.stat(path).st_mtime_ns))
+    assert cache.get(sources[0], 'low') == paths[0]
+    cache.max_bytes = os.path.getsize(paths[0]) * 2
+    cache.evict()
+    assert [os.path.exists(p) for p in paths] == [True, False, True]
+    assert cache.stats()['evicted'] == 1
+
+
+def test_cache_skips_renditions_that_would_not_be_smaller(tmp_path):
+    source = str(tmp_path / 'small.wav')
+    write_wav(source, 22050, rate=22050, channels=1)
+    cache = RenditionCache(str(tmp_path / 'renditions'), WavDownsampler(), workers=0)
+    assert cache.get(source, 'low', duration=1) is None
+    assert cache.get(str(tmp_path / 'song.mp3'), 'low') is None
+    assert cache.stats()['generated'] == 0
+
+
+def test_changed_source_gets_a_new_rendition(tmp_path):
+    source = str(tmp_path / 'a.wav')
+    write_wav(source, 44100)
+    cache = RenditionCache(str(tmp_path / 'renditions'), WavDownsampler(), workers=0)
+    first = cache.get(source, 'low')
+    write_wav(source, 88200)
+    os.utime(source, ns=(time.time_ns(), os.stat(first).st_mtime_ns + 10 ** 9))
+    assert cache.get(source, 'low') != first
+
+
+def test_pool_encodes_in_background(tmp_path):
+    source = str(tmp_path / 'a.wav')
+    write_wav(source, 44100)
+    cache = RenditionCache(str(tmp_path / 'renditions'), WavDownsampler(), workers=1)
+    assert cache.get(source, 'medium') is None
+    deadline = time.monotonic() + 30
+    while cache.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get(source, 'medium') is not None
+    cache.executor.shutdown()
+
+
+def test_negotiate_only_when_source_format_is_refused(tmp_path):
+    class Mp3Encoder(WavDownsampler):
+        mimetype = 'audio/mpeg'
+
+    cache = RenditionCache(str(tmp_path), Mp3Encoder(), workers=0)
+    assert cache.negotiate('a.flac', MIMEAccept([('audio/mpeg', 1)])) == 'high'
+    assert cache.negotiate('a.flac', MIMEAccept([('audio/*', 1)])) is None
+    assert cache.negotiate('a.flac', MIMEAccept([('audio/ogg', 1)])) is None
+    assert cache.negotiate('a.flac', MIMEAccept()) is None
+
+
+def test_stream_serves_rendition_by_quality(app, tmp_path, monkeypatch):
+    source = str(tmp_path / 'track.wav')
+    write_wav(source, 44100 * 2)
+    monkeypatch.setattr(routes_streaming, 'renditions',
+                        RenditionCache(str(tmp_path / 'renditions'), WavDownsampler(), workers=0))
+
+    with app.app_context():
+        track = Track(title='Rendition', artist='Test', file_path=source, duration=2)
+        db.session.add(track)
+        db.session.commit()
+        track_id = track.id
+
+    client = app.test_client()
+    original = client.get(f'/stream/track/{track_id}')
+    assert original.headers['X-Rendition'] == 'original'
+    low = client.get(f'/stream/track/{track_id}?quality=low')
+    assert low.headers['X-Rendition'] == 'low'
+    assert low.mimetype == 'audio/wav'
+    assert len(low.data) < len(original.data) / 3
+    assert 'Accept' in low.headers['Vary']
+    assert client.get(f'/stream/track/{track_id}?quality=lossless').status_code == 400
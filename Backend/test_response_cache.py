@@ -0,0 +1,122 @@
+import pytest
+
+from extensions import response_cache
+from response_cache import CacheEntry, MemoryBackend, RedisBackend
+
+
+class FakeRedis:
+    """The get/set/incr subset of redis.Redis that RedisBackend uses."""
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expiry[key] = ex
+
+    def incr(self, key):
+        value = int(self.values.get(key, 0)) + 1
+        self.values[key] = str(value).encode()
+        return value
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def cached_app(app, request):
+    # conftest puts the backend from the environment back afterwards
+    response_cache.backend = MemoryBackend() if request.param == 'memory' else RedisBackend(FakeRedis(), ttl=30)
+    return app
+
+
+def titles(client, path):
+    return [item['title'] for item in client.get(path).get_json()]
+
+
+def test_writes_invalidate_their_listings(cached_app, admin_headers):
+    client = cached_app.test_client()
+    assert titles(client, '/tracks') == [] and titles(client, '/podcasts') == []
+    hits = response_cache.hits
+    assert titles(client, '/tracks') == []
+    assert response_cache.hits == hits + 1
+
+    response = client.post('/admin/tracks', headers=admin_headers,
+                           json={'title': 'Fresh', 'artist': 'Band', 'file_path': 'fresh.mp3'})
+    track_id = response.get_json()['id']
+    assert titles(client, '/tracks') == ['Fresh']
+    # Podcasts were not written: their listing is still served from the cache
+    hits = response_cache.hits
+    assert titles(client, '/podcasts') == []
+    assert response_cache.hits == hits + 1
+
+    client.post('/admin/tracks', headers=admin_headers,
+                json={'title': 'Talk', 'artist': 'Host', 'file_path': 'talk.mp3', 'is_podcast': True})
+    assert titles(client, '/podcasts') == ['Talk']
+    client.delete(f'/admin/content/track/{track_id}', headers=admin_headers)
+    assert titles(client, '/tracks') == []
+
+
+def test_if_none_match_answers_304_until_a_write(cached_app, admin_headers):
+    client = cached_app.test_client()
+    first = client.get('/tracks')
+    etag = first.headers['ETag']
+    again = client.get('/tracks', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b'' and again.headers['ETag'] == etag
+
+    client.post('/admin/tracks', headers=admin_headers,
+                json={'title': 'New', 'artist': 'Band', 'file_path': 'new.mp3'})
+    changed = client.get('/tracks', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_keys_escape_query_arguments(app):
+    def key(query):
+        with app.test_request_context('/tracks' + query):
+            return response_cache.key(['track'])
+
+    # A value holding '&' and '=' is not the same query as two arguments
+    assert key('?category=a%26b%3Dc') != key('?category=a&b=c')
+    assert key('?a=1&b=2') == key('?b=2&a=1')
+    # Nor can one forge the version part of the key
+    assert key('?q=%7Ctrack%3D0').count('|') == 1
+
+
+def entry(body):
+    return CacheEntry('etag', 'application/json', {}, body)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2, max_bytes=10)
+    backend.set('a', entry(b'1'))
+    backend.set('b', entry(b'2'))
+    backend.get('a')
+    backend.set('c', entry(b'3'))
+    assert backend.get('b') is None and backend.evictions == 1
+    assert [backend.get(key).body for key in ('a', 'c')] == [b'1', b'3']
+
+    # The byte budget evicts too, and an entry over the whole budget is never kept
+    backend.set('d', entry(b'123456789'))
+    assert list(backend.entries) == ['c', 'd'] and backend.info() == {'entries': 2, 'bytes': 10, 'evictions': 2}
+    backend.set('e', entry(b'12345678901'))
+    assert backend.get('e') is None and backend.get('d') is not None
+
+    expired = MemoryBackend(ttl=-1)
+    expired.set('a', entry(b'1'))
+    assert expired.get('a') is None and expired.info()['bytes'] == 0
+
+
+def test_redis_backend_round_trips_entries():
+    client = FakeRedis()
+    backend = RedisBackend(client, ttl=30, prefix='test:')
+    backend.set('key', CacheEntry('etag', 'application/json', {'X-Next-Cursor': 'abc'}, b'[1]\n[2]'))
+    stored = backend.get('key')
+    assert (stored.etag, stored.mimetype, stored.headers, stored.body) == (
+        'etag', 'application/json', {'X-Next-Cursor': 'abc'}, b'[1]\n[2]')
+    assert client.expiry == {'test:key': 30}
+    assert backend.get('missing') is None
+    assert backend.version('track') == 0
+    backend.bump('track')
+    backend.bump('track')
+    assert backend.version('track') == 2 and backend.version('podcast') == 0
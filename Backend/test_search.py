@@ -0,0 +1,87 @@
+import pytest
+
+from extensions import catalog_search
+from models import db, Podcast, Track
+from search_index import FtsBackend, MemoryBackend
+
+
+@pytest.fixture(params=['fts', 'memory'])
+def search_app(app, request):
+    with app.app_context():
+        backend = catalog_search.backend
+    assert isinstance(backend, FtsBackend)
+    if request.param == 'memory':
+        catalog_search._backend = MemoryBackend(catalog_search)
+        with app.app_context():
+            # Prime the (count, max id) check so only the session events can change the index
+            catalog_search.search('prime')
+    try:
+        yield app
+    finally:
+        catalog_search._backend = backend
+
+
+def found(query, limit=50, offset=0):
+    return catalog_search.search(query, limit, offset)
+
+
+def test_insert_update_delete_and_rollback(search_app):
+    with search_app.app_context():
+        track = Track(title='Midnight Train', artist='Gladys Knight', file_path='train.mp3')
+        podcast = Podcast(title='Night Shift', host='Ana Pips', podcast_name='Shows', file_path='shift.mp3')
+        db.session.add_all([track, podcast])
+        db.session.flush()
+        # Nothing is visible before the commit
+        assert found('midnight') == []
+        db.session.commit()
+        track_id, podcast_id = track.id, podcast.id
+        assert found('midnight') == [('track', track_id)]
+        assert found('pips') == [('podcast', podcast_id)]
+
+        track.title = 'Morning Train'
+        db.session.commit()
+        assert found('midnight') == []
+        assert found('morning train') == [('track', track_id)]
+
+        db.session.delete(podcast)
+        db.session.commit()
+        assert found('night shift') == []
+
+        db.session.add(Track(title='Rolled Back', artist='Nobody', file_path='gone.mp3'))
+        db.session.flush()
+        db.session.rollback()
+        assert found('rolled') == []
+        assert db.session.info.get('search_changes') is None
+
+        # The index still takes writes after the rollback
+        db.session.add(Track(title='Afterwards', artist='Somebody', file_path='after.mp3'))
+        db.session.commit()
+        assert [content_type for content_type, _ in found('afterwards')] == ['track']
+
+
+def test_prefix_matching_and_ranking(search_app):
+    with search_app.app_context():
+        in_title = Track(title='Bluebird', artist='Rivers', file_path='a.mp3')
+        in_artist = Track(title='Rivers', artist='Bluebird', file_path='b.mp3')
+        other = Track(title='Redwood', artist='Rivers', file_path='c.mp3')
+        db.session.add_all([in_title, in_artist, other])
+        db.session.commit()
+        assert found('blue') == [('track', in_title.id), ('track', in_artist.id)]
+        assert found('BLUEB riv') == [('track', in_title.id), ('track', in_artist.id)]
+        # Every term must match
+        assert found('blue redwood') == []
+        assert found('!!') == []
+
+
+def test_search_route_pages_through_results(search_app):
+    with search_app.app_context():
+        db.session.add_all([Track(title=f'Echo {n}', artist='Chorus', file_path=f'echo{n}.mp3') for n in range(5)]
+                           + [Podcast(title='Echoes', host='Host', podcast_name='Show', file_path='echoes.mp3')])
+        db.session.commit()
+    client = search_app.test_client()
+    everything = client.get('/search?q=ech').get_json()
+    assert len(everything) == 6 and {item['type'] for item in everything} == {'track', 'podcast'}
+    pages = [client.get(f'/search?q=ech&limit=2&offset={offset}').get_json() for offset in (0, 2, 4, 6)]
+    assert [len(page) for page in pages] == [2, 2, 2, 0]
+    assert [item['id'] for page in pages for item in page] == [item['id'] for item in everything]
+    assert client.get('/search?q=').get_json() == []
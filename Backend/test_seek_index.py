@@ -0,0 +1,110 @@
+import os
+import random
+
+import pytest
+
+from models import db, Track
+from seek_index import SeekTable, build_seek_table, load_seek_table, scan_mp3, seek_table_path
+
+# MPEG-1 Layer III, 44.1 kHz, mono: 1152 samples per frame
+FRAME_SECONDS = 1152 / 44100
+BITRATE_INDEX = {32: 1, 64: 5, 128: 9, 192: 11, 256: 13, 320: 14}
+
+
+def mp3_frame(bitrate, body=b''):
+    header = bytes([0xFF, 0xFB, BITRATE_INDEX[bitrate] << 4, 0xC4])
+    length = 144 * bitrate * 1000 // 44100
+    return (header + body).ljust(length, b'\x00')
+
+
+def mp3_stream(bitrates, id3=b'', xing=False, junk_after=None):
+    """Frames with the given bitrates, plus the offset at which each one starts."""
+    data = bytearray(id3)
+    if xing:
+        # Mono MPEG-1 has 17 bytes of side info before the Xing tag
+        data += mp3_frame(128, bytes(17) + b'Xing' + (1).to_bytes(4, 'big') + len(bitrates).to_bytes(4, 'big'))
+    starts = []
+    for index, bitrate in enumerate(bitrates):
+        starts.append(len(data))
+        data += mp3_frame(bitrate)
+        if index == junk_after:
+            data += b'\x00\x13\x37' * 5
+    return bytes(data), starts
+
+
+def expected_offset(starts, seconds):
+    return starts[int(seconds / FRAME_SECONDS)]
+
+
+def test_cbr_offsets_follow_frames():
+    data, starts = mp3_stream([128] * 500)
+    table = scan_mp3(data, interval=1.0)
+    assert table.duration == pytest.approx(500 * FRAME_SECONDS)
+    assert len(table.offsets) == int(500 * FRAME_SECONDS) + 1
+    for seconds in (0, 1, 5, 12):
+        assert table.offset_for(seconds) == (expected_offset(starts, seconds), seconds)
+    assert table.offset_for(-3)[0] == starts[0]
+    assert table.offset_for(10 ** 6)[0] == table.offsets[-1]
+
+
+def test_vbr_offsets_skip_tags_info_frame_and_junk():
+    rng = random.Random(15)
+    bitrates = [rng.choice(list(BITRATE_INDEX)) for _ in range(800)]
+    id3 = b'ID3\x03\x00\x00' + (0).to_bytes(3, 'big') + bytes([100]) + bytes(100)
+    data, starts = mp3_stream(bitrates, id3=id3, xing=True, junk_after=300)
+    data += b'TAG' + bytes(125)
+
+    table = scan_mp3(data, interval=0.5)
+    assert table.duration == pytest.approx(800 * FRAME_SECONDS)
+    assert table.offsets[0] == starts[0]
+    for seconds in (0.5, 3, 7.5, 10, 20.5):
+        assert table.offset_for(seconds)[0] == expected_offset(starts, seconds)
+    # Offsets don't grow linearly with time in a VBR file
+    assert table.offset_for(20)[0] != round(table.offset_for(10)[0] * 2)
+
+
+def test_non_mp3_has_no_table():
+    assert scan_mp3(b'RIFF' + bytes(1000)) is None
+
+
+def test_table_round_trips_and_rebuilds_when_file_changes(tmp_path):
+    path = str(tmp_path / 'episode.mp3')
+    with open(path, 'wb') as f:
+        f.write(mp3_stream([64] * 200)[0])
+    table = build_seek_table(path)
+    stored = SeekTable.from_bytes(open(seek_table_path(path), 'rb').read())
+    assert stored.offsets == table.offsets and stored.duration == pytest.approx(table.duration, abs=0.001)
+    assert load_seek_table(path).offsets == table.offsets
+
+    data, starts = mp3_stream([320] * 300)
+    with open(path, 'wb') as f:
+        f.write(data)
+    os.utime(path, ns=(table.mtime_ns + 10 ** 9, table.mtime_ns + 10 ** 9))
+    assert load_seek_table(path).offset_for(5)[0] == expected_offset(starts, 5)
+
+
+def test_stream_seeks_to_frame_boundary(app, tmp_path):
+    rng = random.Random(16)
+    data, starts = mp3_stream([rng.choice(list(BITRATE_INDEX)) for _ in range(400)])
+    path = str(tmp_path / 'track.mp3')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    with app.app_context():
+        track = Track(title='Seek', artist='Test', file_path=path)
+        db.session.add(track)
+        db.session.commit()
+        track_id = track.id
+
+    client = app.test_client()
+    offset = expected_offset(starts, 6)
+    response = client.get(f'/stream/track/{track_id}?t=6.4')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes {offset}-{len(data) - 1}/{len(data)}'
+    assert response.headers['X-Seek-Time'] == '6.000'
+    assert response.data == data[offset:]
+
+    seek_map = client.get(f'/stream/track/{track_id}/seek-map')
+    assert seek_map.get_json()['offsets'][6] == offset
+    assert client.get(f'/stream/track/{track_id}/seek-map',
+                      headers={'If-None-Match': seek_map.headers['ETag']}).status_code == 304
@@ -0,0 +1,72 @@
+import json
+
+from json_store import GroupIndex, IdAllocator, JsonStore, KeyIndex
+
+
+def add_track(client, title, file_path='song.mp3'):
+    response = client.post('/admin/tracks', json={'title': title, 'artist': 'Band', 'file_path': file_path})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_tracks_get_fresh_ids_and_stream_by_id(simple_app, tmp_path):
+    (tmp_path / 'uploads' / 'song.mp3').write_bytes(b'audio' * 100)
+    client = simple_app.app.test_client()
+    assert [add_track(client, 'One'), add_track(client, 'Two', 'missing.mp3')] == [1, 2]
+    response = client.get('/stream/track/1')
+    assert response.status_code == 200 and response.get_data() == b'audio' * 100
+    assert client.get('/stream/track/2').status_code == 404
+    assert client.get('/stream/track/3').status_code == 404
+    assert client.get('/stream/podcast/1').status_code == 404
+
+    # Another process appended meanwhile: its track is found and its id is not handed out again
+    other = JsonStore('content.json', simple_app.content_store.default)
+    other_ids = other.add_index(IdAllocator(['tracks']))
+    with other.locked():
+        other.append(['tracks'], {'id': other_ids.next_id(), 'title': 'Elsewhere', 'file_path': 'song.mp3'})
+    assert client.get('/stream/track/3').status_code == 200
+    assert add_track(client, 'Four') == 4
+
+
+def test_favorites_toggle_and_list_in_order(simple_app):
+    client = simple_app.app.test_client()
+    for title in ('One', 'Two', 'Three'):
+        add_track(client, title)
+    for track_id in (3, 1, 2, 99):
+        assert client.post('/favorites/7', json={'track_id': track_id}).get_json() == {'message': 'Added to favorites'}
+    assert client.post('/favorites/7', json={'track_id': 1}).get_json() == {'message': 'Removed from favorites'}
+    # Unknown track ids are skipped
+    assert [t['title'] for t in client.get('/favorites/7').get_json()] == ['Three', 'Two']
+    assert client.get('/favorites/8').get_json() == []
+    assert json.loads(open('content.json.log').read().splitlines()[-1])['op'] == 'remove'
+
+
+def test_indexes_match_a_fresh_load_after_compaction(simple_app, monkeypatch):
+    monkeypatch.setattr(simple_app.content_store, 'compact_every', 4)
+    client = simple_app.app.test_client()
+    for n in range(5):
+        add_track(client, f'Track {n}')
+        client.post('/favorites/1', json={'track_id': n + 1})
+    client.post('/favorites/1', json={'track_id': 2})
+    with open('content.json') as f:
+        assert len(json.load(f)['tracks']) >= 4
+
+    fresh = JsonStore('content.json', simple_app.content_store.default)
+    by_id = fresh.add_index(KeyIndex(['tracks'], 'id'))
+    favorites = fresh.add_index(GroupIndex(['favorites']))
+    ids = fresh.add_index(IdAllocator(['tracks']))
+    fresh.load()
+    assert by_id.items == simple_app.tracks_by_id.items
+    assert favorites.groups == simple_app.favorite_ids.groups == {'1': dict.fromkeys([1, 3, 4, 5])}
+    assert ids.next_id() == simple_app.track_ids.next_id() == 6
+
+
+def test_register_checks_names_and_emails(simple_app):
+    client = simple_app.app.test_client()
+    user = {'username': 'new', 'email': 'new@test.com', 'password': 'pw'}
+    assert client.post('/register', json=user).status_code == 201
+    for clash in ({'username': 'new'}, {'username': 'admin'}, {'email': 'admin@test.com'}):
+        response = client.post('/register', json={**user, 'username': 'other', 'email': 'other@test.com', **clash})
+        assert response.status_code == 400
+    response = client.post('/login', json={'username': 'new', 'password': 'pw'})
+    assert response.get_json()['user_id'] == 2
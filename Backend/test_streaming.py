@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from models import db, Track
+from streaming import resolve_ranges
+
+
+@pytest.fixture
+def track(app, tmp_path):
+    data = os.urandom(10000)
+    path = str(tmp_path / 'track.mp3')
+    with open(path, 'wb') as f:
+        f.write(data)
+    with app.app_context():
+        track = Track(title='Ranged', artist='Test', file_path=path)
+        db.session.add(track)
+        db.session.commit()
+        return f'/stream/track/{track.id}', data
+
+
+def test_resolve_ranges_merges_and_clamps():
+    assert resolve_ranges('bytes=0-9,10-19,100-', 50) == [(0, 20)]
+    assert resolve_ranges('bytes=-10', 50) == [(40, 50)]
+    assert resolve_ranges('bytes=40-99', 50) == [(40, 50)]
+    assert resolve_ranges('bytes=60-70', 50) == []
+    assert resolve_ranges('lines=1-2', 50) is None
+
+
+def test_ranges_are_served_as_206(app, track):
+    url, data = track
+    client = app.test_client()
+    whole = client.get(url)
+    assert whole.status_code == 200 and whole.data == data
+    assert whole.headers['Accept-Ranges'] == 'bytes'
+
+    response = client.get(url, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206 and response.data == data[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+    assert response.headers['Content-Length'] == '100'
+
+    response = client.get(url, headers={'Range': 'bytes=-500'})
+    assert response.status_code == 206 and response.data == data[-500:]
+
+    response = client.get(url, headers={'Range': 'bytes=0-9,5000-5009'})
+    assert response.status_code == 206 and response.mimetype == 'multipart/byteranges'
+    assert response.headers['Content-Length'] == str(len(response.data))
+    assert data[:10] in response.data and data[5000:5010] in response.data
+    assert f'Content-Range: bytes 5000-5009/{len(data)}'.encode() in response.data
+
+
+def test_unsatisfiable_range_is_416(app, track):
+    url, data = track
+    response = app.test_client().get(url, headers={'Range': f'bytes={len(data)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(data)}'
+
+
+def test_if_range_and_conditional_requests(app, track):
+    url, data = track
+    client = app.test_client()
+    etag = client.get(url).headers['ETag']
+
+    response = client.get(url, headers={'Range': 'bytes=100-', 'If-Range': etag})
+    assert response.status_code == 206 and response.data == data[100:]
+    # The client's copy is stale: it gets the whole file instead of a piece of the new one
+    response = client.get(url, headers={'Range': 'bytes=100-', 'If-Range': '"stale"'})
+    assert response.status_code == 200 and response.data == data
+
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': '"stale"'}).status_code == 200
@@ -2,10 +2,19 @@ from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import json
+import logging
 import os
 
+from metrics import Metrics
+from structured_log import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
+metrics = Metrics()
+metrics.instrument(app)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
@@ -23,7 +32,7 @@ def login():
 
 @app.route('/tracks')
 def get_tracks():
-    print(f"GET /tracks - Returning {len(TRACKS)} tracks: {TRACKS}")
+    logger.debug('Returning tracks', extra={'count': len(TRACKS)})
     return jsonify(TRACKS)
 
 @app.route('/admin/upload', methods=['POST'])
@@ -44,7 +53,6 @@ def upload_file():
 @app.route('/admin/tracks', methods=['POST'])
 def add_track():
     data = request.get_json()
-    print(f"POST /admin/tracks - Received: {data}")
     
     new_track = {
         'id': len(TRACKS) + 1,
@@ -56,8 +64,8 @@ def add_track():
     }
     
     TRACKS.append(new_track)
-    print(f"Added track: {new_track}")
-    print(f"Total tracks now: {len(TRACKS)}")
+    logger.info('Track added', extra={'track_id': new_track['id'], 'file_path': new_track['file_path'],
+                                      'count': len(TRACKS)})
     
     return jsonify({'message': 'Track added successfully', 'id': new_track['id']}), 201
 